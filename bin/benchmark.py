@@ -0,0 +1,360 @@
+'''
+benchmark.py
+
+Synthetic genome generator and benchmark suite for the block generation pipeline.
+
+Builds a synthetic pair of genomes, A and B, from a random seed, and then runs generate.py
+on them in several configurations (engines/modes), timing each stage and measuring peak memory.
+Each configuration's output is checked against that of its reference configuration (the Python
+engine, with the same output options), and the results are written as JSON so runs can be
+compared across commits. The mirror configuration also checks its derived B-A blocks against
+a direct B-A run (--verify-mirror).
+
+Synthetic genomes:
+    Genome A has N genes (IDs MGI:1 .. MGI:N) spread evenly over C chromosomes.
+    Genome B starts as a copy of A's gene order, and is then rearranged:
+        --inversions R      at each gene, start an inversion (of 2-50 genes) with probability R
+        --translocations R  at each gene, move a run of 2-50 genes to a random place on a random
+                            chromosome, with probability R
+        --missing R         drop each gene from B with probability R
+        --non-one-to-one R  give each gene an extra, paralogous copy in B (AB then maps the
+                            A gene to 2 B genes) with probability R
+        --overlaps R        make each feature (in A and B) overlap its predecessor with probability R
+        --non-mgi R         give each feature a non-MGI ID with probability R
+    Gene positions and lengths are laid out independently in each genome. The AB file
+    lists the A/B correspondences (identity, plus the paralog pairs).
+
+Example:
+    python benchmark.py --sizes 10000 100000 1000000 --out bench.json
+
+Reports, for each size and configuration: per-stage seconds and peak RSS, total seconds,
+throughput (features/s and blocks/s), the output's MD5, whether it matches the reference,
+and (for the mirror configuration) whether the mirror was verified.
+'''
+import argparse
+import features
+import generate
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+import traceback
+
+# (name, extra generate.py arguments, name of the reference configuration). A reference
+# is its own reference, and is listed before the configurations compared with it.
+# %(dir)s in an argument is replaced by the directory of the run's inputs and outputs.
+CONFIGS = [
+    ('python', [], 'python'),
+    ('python-j4', ['-j', '4'], 'python'),
+    ('numpy', ['--engine', 'numpy'], 'python'),
+    ('stream', ['--stream'], 'python'),
+    ('mirror', ['--mirror', '%(dir)s/blocks.mirror.BA.tsv', '--verify-mirror'], 'python'),
+    ('python-chain', ['--chain-gap', '3'], 'python-chain'),
+    ('numpy-chain', ['--engine', 'numpy', '--chain-gap', '3'], 'python-chain'),
+    ('stream-chain', ['--stream', '--chain-gap', '3'], 'python-chain'),
+]
+
+#
+class SyntheticGenomes:
+
+    def __init__ (self, args, nFeatures):
+        """
+        Initializes a generator for synthetic A/B genomes with nFeatures genes,
+        using the rates in args (see the module docstring).
+        """
+        self.args = args
+        self.n = nFeatures
+        self.rand = random.Random('%s-%s' % (args.seed, nFeatures))
+
+    def write (self, dirname) :
+        """
+        Generates the genomes. Writes A.gff3, B.gff3, and AB.tsv to the given directory,
+        and returns their paths.
+        """
+        a = self.genomeA()
+        b, ab = self.genomeB(a)
+        paths = [ os.path.join(dirname, x) for x in ['A.gff3', 'B.gff3', 'AB.tsv'] ]
+        self.writeGff(paths[0], a)
+        self.writeGff(paths[1], b)
+        fd = open(paths[2], 'w')
+        for aid, bid in ab:
+            fd.write('%s\t%s\n' % (aid, bid))
+        fd.close()
+        return paths
+
+    def genomeA (self) :
+        """
+        Returns genome A, a list of chromosomes, each a list of [id, strand] genes.
+        """
+        r = self.rand
+        nchrs = self.args.chromosomes
+        chrs = [ [] for i in range(nchrs) ]
+        for i in xrange(self.n):
+            chrs[i * nchrs // self.n].append([ 'MGI:%d' % (i+1), r.choice('+-') ])
+        return chrs
+
+    def genomeB (self, a) :
+        """
+        Returns genome B, derived from A by rearrangement, plus the list of AB pairs.
+        """
+        r = self.rand
+        args = self.args
+        ab = []
+        b = []
+        nextId = self.n + 1
+        for chrom in a:
+            genes = []
+            for aid, strand in chrom:
+                ab.append((aid, aid))
+                if r.random() < args.missing:
+                    continue
+                genes.append([aid, strand])
+                if r.random() < args.nonOneToOne:
+                    pid = 'MGI:%d' % nextId
+                    nextId += 1
+                    ab.append((aid, pid))
+                    genes.append([pid, r.choice('+-')])
+            b.append(genes)
+        #
+        for genes in b:
+            i = 0
+            while i < len(genes):
+                if r.random() < args.inversions:
+                    k = r.randint(2, 50)
+                    seg = genes[i:i+k]
+                    seg.reverse()
+                    for g in seg:
+                        g[1] = '-' if g[1] == '+' else '+'
+                    genes[i:i+k] = seg
+                    i += k
+                else:
+                    i += 1
+        #
+        for ci in range(len(b)):
+            i = 0
+            while i < len(b[ci]):
+                if r.random() < args.translocations:
+                    k = r.randint(2, 50)
+                    seg = b[ci][i:i+k]
+                    del b[ci][i:i+k]
+                    dest = b[r.randrange(len(b))]
+                    j = r.randint(0, len(dest))
+                    dest[j:j] = seg
+                    if dest is b[ci] and j <= i:
+                        i += len(seg)
+                else:
+                    i += 1
+        return b, ab
+
+    def writeGff (self, fname, chrs) :
+        """
+        Lays out the genes along each chromosome, and writes them as a GFF3 file.
+        """
+        r = self.rand
+        args = self.args
+        fd = open(fname, 'w')
+        for ci, genes in enumerate(chrs):
+            pos = 1
+            for gid, strand in genes:
+                length = r.randint(500, 50000)
+                start = pos + r.randint(1000, 100000)
+                if pos > 1 and r.random() < args.overlaps:
+                    start = max(1, pos - r.randint(1, 400))
+                end = start + length - 1
+                pos = max(pos, end)
+                if r.random() < args.nonMgi:
+                    gid = 'ENSMUSG%011d' % int(gid[4:])
+                fd.write('%d\tsynthetic\tgene\t%d\t%d\t.\t%s\t.\tID=%s;Name=G%s\n' % \
+                    (ci+1, start, end, strand, gid, gid[4:]))
+        fd.close()
+
+#
+def runConfig (argv, outname) :
+    """
+    Runs generate.py in this process with the given arguments, writing the blocks to outname.
+    Meant to be run in a fresh worker process, so the peak RSS is that of this run.
+    Returns the generator's metrics.
+    """
+    sbg = generate.SyntenyBlockGenerator()
+    sbg.ofd = open(outname, 'w')
+    try:
+        sbg.go(argv)
+    except SystemExit:
+        # a failed --verify-mirror exits with status 1; it is reported in the metrics
+        if sbg.mirrorVerified is not False:
+            raise
+    sbg.ofd.close()
+    return sbg.getMetrics()
+
+def inFreshProcess (func, *args) :
+    """
+    Calls func(*args) in a new (forked) process, and returns the result.
+    Exceptions in the process are re-raised here as RuntimeErrors.
+    """
+    q = multiprocessing.Queue()
+    def target () :
+        try:
+            q.put((True, func(*args)))
+        except (Exception, SystemExit):
+            q.put((False, traceback.format_exc()))
+    p = multiprocessing.Process(target=target)
+    p.start()
+    ok, value = q.get()
+    p.join()
+    if not ok:
+        raise RuntimeError(value)
+    return value
+
+def outputDigests (fname) :
+    """
+    Returns the MD5 digests of the named block file, exactly and with the ids column
+    sorted within each row (so outputs that differ only in ID order compare equal).
+    """
+    exact = hashlib.md5()
+    normal = hashlib.md5()
+    fd = open(fname, 'r')
+    for i, line in enumerate(fd):
+        exact.update(line)
+        toks = line[:-1].split('\t')
+        if i > 0 and len(toks) >= 15:
+            toks[14] = ','.join(sorted(toks[14].split(',')))
+        normal.update('\t'.join(toks) + '\n')
+    fd.close()
+    return exact.hexdigest(), normal.hexdigest()
+
+def gitRevision () :
+    """
+    Returns the current git commit of the source tree, or None.
+    """
+    try:
+        d = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=d).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+#
+class Benchmark:
+
+    def __init__ (self):
+        self.initArgParser()
+
+    def initArgParser (self):
+        """
+        Sets up the parser for the command line args.
+        """
+        self.parser = argparse.ArgumentParser(description='Benchmark synteny block generation on synthetic genomes.')
+        self.parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], metavar='N',
+            help='Numbers of genes per synthetic genome. (default: %(default)s)')
+        self.parser.add_argument('--chromosomes', type=int, default=20, metavar='C',
+            help='Number of chromosomes. (default: %(default)s)')
+        self.parser.add_argument('--seed', default='1',
+            help='Random seed. (default: %(default)s)')
+        self.parser.add_argument('--inversions', type=float, default=0.002, metavar='R')
+        self.parser.add_argument('--translocations', type=float, default=0.001, metavar='R')
+        self.parser.add_argument('--missing', type=float, default=0.01, metavar='R')
+        self.parser.add_argument('--non-one-to-one', dest='nonOneToOne', type=float, default=0.01, metavar='R')
+        self.parser.add_argument('--overlaps', type=float, default=0.01, metavar='R')
+        self.parser.add_argument('--non-mgi', dest='nonMgi', type=float, default=0.005, metavar='R')
+        self.parser.add_argument('--configs', nargs='+', metavar='NAME',
+            default=[ c[0] for c in CONFIGS ],
+            help='Configurations to run: %s. The reference of each is also run. (default: all)' % ', '.join([ c[0] for c in CONFIGS ]))
+        self.parser.add_argument('--workdir', default='bench_data', metavar='DIR',
+            help='Directory for the synthetic inputs and the outputs. (default: %(default)s)')
+        self.parser.add_argument('--out', metavar='FILE',
+            help='Write the results as JSON to FILE. (default: stdout)')
+
+    def go (self, argv=None) :
+        """
+        Generates the data and runs the benchmarks.
+        """
+        self.args = self.parser.parse_args(argv)
+        configs = dict([ (c[0], c[1:]) for c in CONFIGS ])
+        for c in self.args.configs:
+            if c not in configs:
+                self.parser.error('Unknown configuration: ' + c)
+        # the selected configurations and their references, references first
+        names = set(self.args.configs) | set([ configs[c][1] for c in self.args.configs ])
+        names = [ c[0] for c in CONFIGS if c[0] in names ]
+        if not os.path.isdir(self.args.workdir):
+            os.makedirs(self.args.workdir)
+        results = {
+            'revision' : gitRevision(),
+            'date' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'parameters' : vars(self.args),
+            'runs' : [],
+        }
+        for n in self.args.sizes:
+            d = os.path.join(self.args.workdir, str(n))
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            sys.stderr.write('Generating %d genes in %s\n' % (n, d))
+            fa, fb, fab = inFreshProcess(_writeSynthetic, self.args, n, d)
+            # Write the feature caches now, so every configuration reads the same way.
+            inFreshProcess(_warmCache, [fa, fb])
+            refs = {}
+            for c in names:
+                cargs, refName = configs[c]
+                argv = [ '-A', fa, '-B', fb, '-AB', fab ] + [ a % {'dir' : d} for a in cargs ]
+                outname = os.path.join(d, 'blocks.%s.tsv' % c)
+                sys.stderr.write('  %s: %s\n' % (c, ' '.join(argv)))
+                m = inFreshProcess(runConfig, argv, outname)
+                exact, normal = outputDigests(outname)
+                if refName == c:
+                    refs[c] = (exact, normal)
+                ref = refs[refName]
+                nfeats = m['counts']['A']['read'] + m['counts']['B']['read']
+                nblocks = m['counts']['blocks']['generated']
+                secs = max(m['seconds'], 1e-9)
+                r = {
+                    'size' : n,
+                    'config' : c,
+                    'reference' : refName,
+                    'argv' : argv,
+                    'stages' : m['stages'],
+                    'counts' : m['counts'],
+                    'seconds' : m['seconds'],
+                    'peakRssKb' : m['peakRssKb'],
+                    'featuresPerSecond' : round(nfeats / secs, 1),
+                    'blocksPerSecond' : round(nblocks / secs, 1),
+                    'md5' : exact,
+                    'matchesReference' : exact == ref[0],
+                    'matchesReferenceIgnoringIdOrder' : normal == ref[1],
+                }
+                if 'mirrorVerified' in m:
+                    r['mirrorVerified'] = m['mirrorVerified']
+                sys.stderr.write('    %.3fs, %d KB peak, %d blocks, %s%s\n' % (
+                    m['seconds'], m['peakRssKb'], nblocks,
+                    'same as reference' if r['matchesReference'] else
+                    'same as reference (except ID order)' if r['matchesReferenceIgnoringIdOrder'] else
+                    'DIFFERENT FROM REFERENCE',
+                    '' if 'mirrorVerified' not in r else
+                    ', mirror verified' if r['mirrorVerified'] else ', MIRROR DIFFERS'))
+                results['runs'].append(r)
+        #
+        fd = open(self.args.out, 'w') if self.args.out else sys.stdout
+        json.dump(results, fd, indent=2, sort_keys=True)
+        fd.write('\n')
+        if fd is not sys.stdout:
+            fd.close()
+        if [ r for r in results['runs'] if not r['matchesReferenceIgnoringIdOrder'] or r.get('mirrorVerified') is False ]:
+            sys.exit(1)
+
+#
+def _writeSynthetic (args, n, dirname) :
+    return SyntheticGenomes(args, n).write(dirname)
+
+def _warmCache (fnames) :
+    for f in fnames:
+        features.load(f)
+
+#
+def main () :
+    Benchmark().go()
+
+#
+if __name__ == "__main__":
+    main()
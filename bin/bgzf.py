@@ -0,0 +1,404 @@
+'''
+bgzf.py
+
+Compressed inputs, and random access by region to position-sorted files.
+
+GFF3 inputs may be plain text, gzip, or BGZF. openText() opens any of these for reading lines.
+BGZF (as written by bgzip, or by compress() here) is gzip made of independently compressed
+blocks of at most 64 KB of text each, so any line can be reached by seeking to the start
+of its block. A position in a BGZF file is a virtual offset:
+    (file offset of the block << 16) | (offset of the position within the block's text)
+Virtual offsets increase through the file. The BGZF reader's tell() and seek() use them,
+so code that records and returns to file positions (e.g., features.iterateChromosomes)
+works on BGZF files unchanged. Plain gzip files can only be read through.
+
+Region index:
+    For a plain or BGZF file whose lines are grouped by seqid, and sorted by start within
+    each seqid, the region index (FILE.gfi, JSON) records, for each seqid, the (virtual) offsets of its
+    first line and of the end of its last line, and a linear index: for each 16 kb window
+    of the chromosome, the offset of the first line that overlaps the window or lies beyond it.
+    (In the file, the linear index is stored as differences from the previous window's offset,
+    most of which are 0.)
+    A region query seeks to the window of the region's start, and reads only until a line starts
+    past the region's end. The index records FILE's size and mtime, and is built (by reading the file once)
+    when it is missing or out of date. Files that cannot be indexed are read through instead.
+
+A region is written chr or chr:start-end (1-based, inclusive; commas in the numbers are allowed).
+A line is in the region if it is on chr and its start..end overlaps start..end.
+
+Usage:
+    python bgzf.py compress FILE [OUTFILE]      writes FILE as BGZF (default OUTFILE: FILE.gz)
+    python bgzf.py index FILE                   (re)builds the region index of FILE
+    python bgzf.py query FILE REGION            writes the lines of FILE in REGION to stdout
+'''
+import gzip
+import io
+import json
+import os
+import re
+import struct
+import sys
+import zlib
+
+GZIP_MAGIC = '\x1f\x8b'
+INDEX_EXT = '.gfi'
+WINDOW_SHIFT = 14 # linear index windows are 16 kb
+BLOCK_SIZE = 0xff00 # text per block written (as bgzip does)
+# the empty block that ends a BGZF file
+EOF_BLOCK = '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+REGION_RE = re.compile(r'^(.+):([0-9,]+)-([0-9,]+)$')
+
+#
+def fileType (fname) :
+    """
+    Returns the type of the named file: "bgzf", "gzip", or "plain".
+    """
+    fd = open(fname, 'rb')
+    hdr = fd.read(18)
+    fd.close()
+    if hdr[:2] != GZIP_MAGIC:
+        return 'plain'
+    if len(hdr) == 18 and ord(hdr[3]) & 4 and hdr[12:14] == 'BC':
+        return 'bgzf'
+    return 'gzip'
+
+def openText (fname) :
+    """
+    Opens the named file (plain, gzip, or BGZF) for reading lines. "-" is stdin.
+    """
+    if fname == '-':
+        return sys.stdin
+    t = fileType(fname)
+    if t == 'bgzf':
+        return BgzfReader(fname)
+    if t == 'gzip':
+        return io.BufferedReader(gzip.open(fname, 'rb'))
+    return open(fname, 'r')
+
+#
+class BgzfReader (object):
+    """
+    Reads the lines of a BGZF file. tell() and seek() use virtual offsets.
+    """
+    def __init__ (self, fname):
+        self.fd = open(fname, 'rb')
+        self.block = ''       # text of the current block
+        self.coffset = 0      # file offset of the current block
+        self.nextCoffset = 0  # file offset of the next block
+        self.pos = 0          # position in the current block's text
+        self.loadBlock(0)
+
+    def loadBlock (self, coffset) :
+        """
+        Reads and decompresses the block at the given file offset.
+        Returns False if there is none (the end of the file).
+        """
+        self.fd.seek(coffset)
+        self.coffset = self.nextCoffset = coffset
+        self.block = ''
+        self.pos = 0
+        hdr = self.fd.read(12)
+        if len(hdr) < 12:
+            return False
+        xlen = struct.unpack('<H', hdr[10:12])[0]
+        extra = self.fd.read(xlen)
+        bsize = None
+        i = 0
+        while i + 4 <= len(extra):
+            slen = struct.unpack('<H', extra[i+2:i+4])[0]
+            if extra[i:i+2] == 'BC':
+                bsize = struct.unpack('<H', extra[i+4:i+6])[0] + 1
+            i += 4 + slen
+        if hdr[:2] != GZIP_MAGIC or bsize is None:
+            raise IOError('No BGZF block at offset %d.' % coffset)
+        data = self.fd.read(bsize - 12 - xlen)
+        self.block = zlib.decompress(data[:-8], -15)
+        self.nextCoffset = coffset + bsize
+        return True
+
+    def readline (self) :
+        parts = []
+        while True:
+            if self.pos >= len(self.block):
+                if not self.loadBlock(self.nextCoffset):
+                    break
+                continue
+            i = self.block.find('\n', self.pos)
+            if i != -1:
+                parts.append(self.block[self.pos:i+1])
+                self.pos = i + 1
+                break
+            parts.append(self.block[self.pos:])
+            self.pos = len(self.block)
+        return ''.join(parts)
+
+    def tell (self) :
+        if self.block and self.pos >= len(self.block):
+            # the end of a block is the start of the next
+            return self.nextCoffset << 16
+        return (self.coffset << 16) | self.pos
+
+    def seek (self, voffset, whence=0) :
+        if whence != 0:
+            raise IOError('BGZF files can only be seeked to a virtual offset.')
+        self.loadBlock(voffset >> 16)
+        self.pos = voffset & 0xffff
+
+    def __iter__ (self) :
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def close (self) :
+        self.fd.close()
+
+#
+def writeBlock (fd, text) :
+    """
+    Writes the given text (at most 64 KB) as one BGZF block.
+    """
+    c = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    cdata = c.compress(text) + c.flush()
+    bsize = 18 + len(cdata) + 8
+    fd.write(struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, bsize - 1))
+    fd.write(cdata)
+    fd.write(struct.pack('<II', zlib.crc32(text) & 0xffffffff, len(text)))
+
+def compress (fname, ofname) :
+    """
+    Writes the named file (plain, gzip, or BGZF) to ofname as BGZF. The file is written
+    under a temporary name and then renamed.
+    """
+    ifd = openText(fname)
+    tmpname = '%s.%d.tmp' % (ofname, os.getpid())
+    ofd = open(tmpname, 'wb')
+    buf = []
+    n = 0
+    for line in ifd:
+        buf.append(line)
+        n += len(line)
+        if n >= BLOCK_SIZE:
+            text = ''.join(buf)
+            while len(text) >= BLOCK_SIZE:
+                writeBlock(ofd, text[:BLOCK_SIZE])
+                text = text[BLOCK_SIZE:]
+            buf = [text]
+            n = len(text)
+    text = ''.join(buf)
+    if text:
+        writeBlock(ofd, text)
+    ofd.write(EOF_BLOCK)
+    ofd.close()
+    ifd.close()
+    os.rename(tmpname, ofname)
+
+#
+def parseRegion (region) :
+    """
+    Parses a region string. Returns (chr, start, end); start and end are None if not given.
+    Raises ValueError if the region is not valid.
+    """
+    m = REGION_RE.match(region)
+    if m is None:
+        if not region:
+            raise ValueError('Empty region.')
+        return (region, None, None)
+    start = int(m.group(2).replace(',', ''))
+    end = int(m.group(3).replace(',', ''))
+    if start < 1 or end < start:
+        raise ValueError('Invalid region: %s' % region)
+    return (m.group(1), start, end)
+
+def indexPath (fname) :
+    """
+    Returns the path of the region index of the named file.
+    """
+    return fname + INDEX_EXT
+
+def buildIndex (fname) :
+    """
+    Builds the region index of the named (plain or BGZF) file. Returns it, as a dict.
+    Raises ValueError if the file's lines are not grouped by seqid and sorted by start.
+    """
+    st = os.stat(fname)
+    idx = {
+        'path' : os.path.abspath(fname),
+        'size' : st.st_size,
+        'mtime' : st.st_mtime,
+        'windowShift' : WINDOW_SHIFT,
+        'seqids' : {},
+        }
+    fd = openText(fname)
+    cur = None
+    lastStart = 0
+    while True:
+        vo = fd.tell()
+        line = fd.readline()
+        if not line:
+            break
+        if line.startswith('#'):
+            continue
+        if cur is not None:
+            cur['end'] = vo
+        tokens = line.split('\t', 5)
+        seqid = tokens[0]
+        start, end = int(tokens[3]), int(tokens[4])
+        if cur is None or seqid != cur['seqid']:
+            if seqid in idx['seqids']:
+                fd.close()
+                raise ValueError('%s is not grouped by seqid (%s).' % (fname, seqid))
+            cur = idx['seqids'][seqid] = { 'seqid' : seqid, 'first' : vo, 'end' : None, 'linear' : [] }
+            lastStart = 0
+        if start < lastStart:
+            fd.close()
+            raise ValueError('%s is not sorted by start (%s:%d).' % (fname, seqid, start))
+        lastStart = start
+        linear = cur['linear']
+        w1 = end >> WINDOW_SHIFT
+        if w1 >= len(linear):
+            linear.extend([None] * (w1 + 1 - len(linear)))
+        for w in xrange(start >> WINDOW_SHIFT, w1 + 1):
+            if linear[w] is None:
+                linear[w] = vo
+    if cur is not None:
+        cur['end'] = fd.tell()
+    fd.close()
+    # a window no line overlaps starts where the next one that does starts
+    for s in idx['seqids'].values():
+        del s['seqid']
+        nxt = s['end']
+        for w in xrange(len(s['linear']) - 1, -1, -1):
+            if s['linear'][w] is None:
+                s['linear'][w] = nxt
+            nxt = s['linear'][w]
+    return idx
+
+def writeIndex (fname, idx) :
+    """
+    Writes a region index (atomically) for the named file.
+    """
+    out = dict(idx)
+    out['seqids'] = {}
+    for seqid, s in idx['seqids'].items():
+        deltas = []
+        prev = s['first']
+        for vo in s['linear']:
+            deltas.append(vo - prev)
+            prev = vo
+        out['seqids'][seqid] = dict(s, linear=deltas)
+    iname = indexPath(fname)
+    tmpname = '%s.%d.tmp' % (iname, os.getpid())
+    fd = open(tmpname, 'w')
+    json.dump(out, fd, separators=(',', ':'))
+    fd.close()
+    os.rename(tmpname, iname)
+
+def readIndex (fname) :
+    """
+    Reads the region index of the named file. Returns it, or None if there is none.
+    """
+    try:
+        fd = open(indexPath(fname), 'r')
+        idx = json.load(fd)
+        fd.close()
+    except (IOError, ValueError):
+        return None
+    for s in idx['seqids'].values():
+        vo = s['first']
+        linear = []
+        for d in s['linear']:
+            vo += d
+            linear.append(vo)
+        s['linear'] = linear
+    return idx
+
+def getIndex (fname) :
+    """
+    Returns the region index of the named file, building (and saving) it if it is missing
+    or out of date. Returns None if the file cannot be indexed.
+    """
+    if fname == '-' or fileType(fname) == 'gzip':
+        return None
+    st = os.stat(fname)
+    idx = readIndex(fname)
+    if idx and idx['path'] == os.path.abspath(fname) and idx['size'] == st.st_size and idx['mtime'] == st.st_mtime:
+        return idx
+    try:
+        idx = buildIndex(fname)
+    except ValueError as e:
+        sys.stderr.write('%s Reading through it.\n' % e)
+        return None
+    try:
+        writeIndex(fname, idx)
+    except (IOError, OSError) as e:
+        sys.stderr.write('Cannot write region index for %s: %s\n' % (fname, e))
+    return idx
+
+def regionLines (input, region) :
+    """
+    Yields the lines of the input (a file name, or an open file) in the given region
+    (a string, or the tuple parseRegion returns), in file order. Comment lines are skipped.
+    A named file is read through its region index if it can be indexed.
+    """
+    chr, start, end = parseRegion(region) if isinstance(region, basestring) else region
+    idx = getIndex(input) if isinstance(input, basestring) else None
+    if idx is None:
+        fd = openText(input) if isinstance(input, basestring) else input
+        for line in fd:
+            if line.startswith('#'):
+                continue
+            tokens = line.split('\t', 5)
+            if tokens[0] == chr and (start is None or int(tokens[4]) >= start) \
+            and (end is None or int(tokens[3]) <= end):
+                yield line
+        if fd is not input:
+            fd.close()
+        return
+    s = idx['seqids'].get(chr, None)
+    if s is None:
+        return
+    if start is None:
+        vo = s['first']
+    else:
+        w = start >> idx['windowShift']
+        vo = s['linear'][w] if w < len(s['linear']) else s['end']
+    fd = openText(input)
+    fd.seek(vo)
+    while fd.tell() < s['end']:
+        line = fd.readline()
+        if not line:
+            break
+        if line.startswith('#'):
+            continue
+        tokens = line.split('\t', 5)
+        if end is not None and int(tokens[3]) > end:
+            break
+        if start is None or int(tokens[4]) >= start:
+            yield line
+    fd.close()
+
+#
+def main () :
+    usage = 'Usage: python bgzf.py compress FILE [OUTFILE] | index FILE | query FILE REGION\n'
+    args = sys.argv[1:]
+    if len(args) < 2:
+        sys.stderr.write(usage)
+        sys.exit(1)
+    cmd, fname = args[0], args[1]
+    if cmd == 'compress' and len(args) <= 3:
+        compress(fname, args[2] if len(args) == 3 else fname + '.gz')
+    elif cmd == 'index' and len(args) == 2:
+        writeIndex(fname, buildIndex(fname))
+    elif cmd == 'query' and len(args) == 3:
+        for line in regionLines(fname, args[2]):
+            sys.stdout.write(line)
+    else:
+        sys.stderr.write(usage)
+        sys.exit(1)
+
+#
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+'''
+blockfile.py
+
+Compact binary block files, an alternative to the TSV written by generate.py that
+the viewer can read directly into typed arrays.
+
+A block file FILE.blk holds one fixed-width record per block, stored as columns:
+    blockId        uint32
+    blockCount     uint32
+    blockOri       int8    +1 or -1
+    blockRatio100  uint8   the block ratio x 100 (i.e., the two decimals of the TSV)
+    aChr, bChr     uint16  chromosome codes (indexes into the header's aChrs/bChrs)
+    aStart, aEnd, bStart, bEnd, aIndex, bIndex      uint32
+    nIds           uint32  number of IDs in the block
+    nMerged        uint32  number of blocks merged into this one (1, except in coarsened levels; see lod.py)
+    bOrder         uint32  record numbers, ordered by bChr+bStart
+Records are in the same order as the TSV rows (by A chromosome and position).
+Lengths are not stored; xLength = xEnd - xStart + 1.
+
+The JSON header gives the number of records (n), the chromosome names (aChrs, bChrs, sorted),
+the position and type of each column, and an index of record ranges by chromosome:
+    aRanges   chr -> [first, end) range of records on that A chromosome
+    bRanges   chr -> [first, end) range of positions in bOrder whose records are on that B chromosome
+
+The block IDs are in a separate text file, FILE.ids, with one line per record
+(the comma-separated ids column of the TSV), so they can be loaded only when needed.
+
+With generate.py --ids ranges, a TSV block file may leave the ids of its strict synteny blocks
+empty, since they follow from the blocks' index ranges: the A ids of a block are lines
+aIndex .. aIndex+blockCount-1 of FILE.a.ids, which lists the IDs of genome A's paired features
+in index order (one per line, from line 0), and its B ids are the same lines of FILE.b.ids, from bIndex.
+(Chained blocks with nMerged > 1, and indel blocks, are not contiguous in both genomes, and keep their ids.)
+
+Layout: 8 byte magic, uint32 header length, JSON header, then the columns, each starting
+on an 8 byte boundary. All numbers are little endian.
+
+Usage (converts an existing TSV block file):
+    python blockfile.py A-B.tsv A-B.blk
+'''
+import array
+import json
+import os
+import sys
+
+MAGIC = 'SBGBLK01'
+BLK_EXT = '.blk'
+IDS_EXT = '.ids'
+RANGE_IDS_EXT = ['.a.ids', '.b.ids']
+
+# Where the IDs of a Block come from: count consecutive items, from item first, of
+IDS_PAIRS = 0   # the pairs, in A order (each pair's A ID, then B ID)
+IDS_SWAPPED = 1 # the pairs, in B order (each pair's B ID, then A ID), for a mirrored block
+IDS_A = 2       # genome A's kept features (a deletion block)
+IDS_B = 3       # genome B's kept features (an insertion block)
+
+# Columns of the TSV block file. Coarsened levels (see lod.py) add nMerged.
+TSV_COLUMNS = [
+    "blockId",
+    "blockCount",
+    "blockOri",
+    "blockRatio",
+    "aChr",
+    "bChr",
+    "aLength",
+    "bLength",
+    "aStart",
+    "bStart",
+    "aEnd",
+    "bEnd",
+    "aIndex",
+    "bIndex",
+    "ids",
+]
+
+# (name, array typecode) for each column, in file order.
+COLUMNS = [
+    ('blockId',       'I'),
+    ('blockCount',    'I'),
+    ('blockOri',      'b'),
+    ('blockRatio100', 'B'),
+    ('aChr',          'H'),
+    ('bChr',          'H'),
+    ('aStart',        'I'),
+    ('aEnd',          'I'),
+    ('bStart',        'I'),
+    ('bEnd',          'I'),
+    ('aIndex',        'I'),
+    ('bIndex',        'I'),
+    ('nIds',          'I'),
+    ('nMerged',       'I'),
+    ('bOrder',        'I'),
+]
+
+#
+def idsPath (fname) :
+    """
+    Returns the path of the ID table for the named block file.
+    """
+    base = fname[:-len(BLK_EXT)] if fname.endswith(BLK_EXT) else fname
+    return base + IDS_EXT
+
+def rangeIdsPaths (base) :
+    """
+    Returns the paths of the A and B ID files that go with the block file whose name,
+    less its extension, is base (see --ids ranges, above).
+    """
+    return [ base + ext for ext in RANGE_IDS_EXT ]
+
+#
+class Block (object):
+    """
+    A block as generate.py builds it, in fixed slots: its id, orientation (+1 or -1), number
+    of pairs, and, for each genome, the chromosome code, start, end, and lowest index of its extent.
+    The block does not hold its IDs: they are those of a contiguous range of pairs (or features),
+    given by source (IDS_PAIRS, etc.) and first, and are looked up when it is written
+    (see SyntenyBlockGenerator.blockIds). The missing side of an indel block has chromosome None,
+    and zero start, end, and index. A chained block (--chain-gap) has the list of the strict blocks
+    it is made of as parts, and its IDs are theirs.
+    """
+    __slots__ = ['id', 'ori', 'count', 'aChr', 'aStart', 'aEnd', 'aIndex',
+        'bChr', 'bStart', 'bEnd', 'bIndex', 'source', 'first', 'parts']
+
+    def __init__ (self, id, ori, count, aChr, aStart, aEnd, aIndex, bChr, bStart, bEnd, bIndex, source, first, parts=None):
+        self.id = id
+        self.ori = ori
+        self.count = count
+        self.aChr = aChr
+        self.aStart = aStart
+        self.aEnd = aEnd
+        self.aIndex = aIndex
+        self.bChr = bChr
+        self.bStart = bStart
+        self.bEnd = bEnd
+        self.bIndex = bIndex
+        self.source = source
+        self.first = first
+        self.parts = parts
+
+    def __getstate__ (self):
+        return [ getattr(self, n) for n in self.__slots__ ]
+
+    def __setstate__ (self, state):
+        for n, v in zip(self.__slots__, state):
+            setattr(self, n, v)
+
+    def __repr__ (self):
+        return 'Block(%s)' % ', '.join(map(repr, self.__getstate__()))
+
+    def copy (self) :
+        b = Block.__new__(Block)
+        b.__setstate__(self.__getstate__())
+        return b
+
+    def swapped (self) :
+        """
+        Returns the block with its A and B sides swapped (for the mirrored pair), with no id.
+        """
+        source = { IDS_PAIRS : IDS_SWAPPED, IDS_SWAPPED : IDS_PAIRS }.get(self.source, self.source)
+        return Block(None, self.ori, self.count,
+            self.bChr, self.bStart, self.bEnd, self.bIndex,
+            self.aChr, self.aStart, self.aEnd, self.aIndex, source, self.first)
+
+    def isIndel (self) :
+        return self.aChr is None or self.bChr is None
+
+    def isRange (self) :
+        """
+        Returns True if the block's IDs are exactly those of its index ranges in each genome,
+        so --ids ranges need not write them.
+        """
+        return not self.isIndel() and (self.parts is None or len(self.parts) == 1)
+
+#
+def write (fname, rows) :
+    """
+    Writes a block file and its ID table. Rows are lists of the values of the
+    TSV columns (see TSV_COLUMNS), plus optionally nMerged, in output order.
+    Both files are written under temporary names and then renamed.
+    """
+    aChrs = sorted(set([ r[4] for r in rows ]))
+    bChrs = sorted(set([ r[5] for r in rows ]))
+    if max(len(aChrs), len(bChrs)) > 0xffff:
+        raise ValueError('Too many chromosomes for a block file.')
+    aCode = dict([ (c, i) for i, c in enumerate(aChrs) ])
+    bCode = dict([ (c, i) for i, c in enumerate(bChrs) ])
+    #
+    cols = dict([ (name, array.array(tc)) for name, tc in COLUMNS ])
+    aRanges = {}
+    tmpids = '%s.%d.tmp' % (idsPath(fname), os.getpid())
+    fd = open(tmpids, 'w')
+    for i, r in enumerate(rows):
+        blkid, blkcount, ori, ratio, achr, bchr, alen, blen, \
+            astart, bstart, aend, bend, aindex, bindex, ids = r[:15]
+        cols['blockId'].append(int(blkid))
+        cols['blockCount'].append(int(blkcount))
+        cols['blockOri'].append(1 if ori == '+' else -1)
+        cols['blockRatio100'].append(int(round(float(ratio) * 100)))
+        cols['aChr'].append(aCode[achr])
+        cols['bChr'].append(bCode[bchr])
+        cols['aStart'].append(int(astart))
+        cols['aEnd'].append(int(aend))
+        cols['bStart'].append(int(bstart))
+        cols['bEnd'].append(int(bend))
+        cols['aIndex'].append(int(aindex))
+        cols['bIndex'].append(int(bindex))
+        cols['nIds'].append(ids.count(',') + 1 if ids else 0)
+        cols['nMerged'].append(int(r[15]) if len(r) > 15 else 1)
+        fd.write(ids + '\n')
+        #
+        rng = aRanges.get(achr, None)
+        if rng is None:
+            aRanges[achr] = [i, i+1]
+        elif rng[1] == i:
+            rng[1] = i + 1
+        else:
+            fd.close()
+            os.remove(tmpids)
+            raise ValueError('Blocks are not grouped by A chromosome (%s).' % achr)
+    fd.close()
+    #
+    order = sorted(xrange(len(rows)), key=lambda i: (cols['bChr'][i], cols['bStart'][i], i))
+    cols['bOrder'].extend(order)
+    bRanges = {}
+    for j, i in enumerate(order):
+        bchr = bChrs[cols['bChr'][i]]
+        bRanges.setdefault(bchr, [j, j])[1] = j + 1
+    #
+    blobs = []
+    for name, tc in COLUMNS:
+        a = cols[name]
+        if sys.byteorder != 'little':
+            a.byteswap()
+        blobs.append(a.tostring())
+    hdr = {
+        'n' : len(rows),
+        'aChrs' : aChrs,
+        'bChrs' : bChrs,
+        'aRanges' : aRanges,
+        'bRanges' : bRanges,
+        'columns' : {},
+    }
+    # header length depends on the offsets it contains, so fix its size by padding
+    hlen = 4096
+    while True:
+        pos = 12 + hlen
+        for (name, tc), b in zip(COLUMNS, blobs):
+            pos += (-pos) % 8
+            hdr['columns'][name] = [tc, pos, pos + len(b)]
+            pos += len(b)
+        htext = json.dumps(hdr, sort_keys=True)
+        if len(htext) <= hlen:
+            break
+        hlen *= 2
+    htext += ' ' * (hlen - len(htext))
+    #
+    hl = array.array('I', [hlen])
+    if sys.byteorder != 'little':
+        hl.byteswap()
+    tmpname = '%s.%d.tmp' % (fname, os.getpid())
+    fd = open(tmpname, 'wb')
+    fd.write(MAGIC)
+    fd.write(hl.tostring())
+    fd.write(htext)
+    pos = 12 + hlen
+    for b in blobs:
+        pad = (-pos) % 8
+        fd.write('\0' * pad)
+        fd.write(b)
+        pos += pad + len(b)
+    fd.close()
+    os.rename(tmpids, idsPath(fname))
+    os.rename(tmpname, fname)
+
+def read (fname) :
+    """
+    Reads a block file. Returns (header, columns), where columns maps each column name to an array.
+    Raises ValueError if the file is not a block file.
+    """
+    fd = open(fname, 'rb')
+    data = fd.read()
+    fd.close()
+    if data[0:8] != MAGIC:
+        raise ValueError('%s is not a block file.' % fname)
+    hl = array.array('I', data[8:12])
+    if sys.byteorder != 'little':
+        hl.byteswap()
+    hdr = json.loads(data[12:12+hl[0]])
+    cols = {}
+    for name, (tc, start, end) in hdr['columns'].items():
+        a = array.array(str(tc))
+        a.fromstring(data[start:end])
+        if sys.byteorder != 'little':
+            a.byteswap()
+        cols[name] = a
+    return hdr, cols
+
+def readIds (fname) :
+    """
+    Reads the ID table of the named block file. Returns a list, per record, of lists of IDs.
+    """
+    fd = open(idsPath(fname), 'r')
+    ids = [ line[:-1].split(',') if line != '\n' else [] for line in fd ]
+    fd.close()
+    return ids
+
+#
+def main () :
+    if len(sys.argv) != 3:
+        sys.stderr.write('Usage: python blockfile.py BLOCKS.tsv BLOCKS.blk\n')
+        sys.exit(1)
+    fd = open(sys.argv[1], 'r')
+    fd.readline()
+    rows = [ line[:-1].split('\t') for line in fd ]
+    fd.close()
+    write(sys.argv[2], rows)
+
+#
+if __name__ == "__main__":
+    main()
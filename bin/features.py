@@ -0,0 +1,579 @@
+'''
+features.py
+
+Projected feature tables for synteny block generation.
+
+Generating synteny blocks needs only five things from each GFF3 feature:
+ID, seqid, start, end, and strand. This module reads GFF3 files into lists of
+small ProjectedFeature objects holding just those fields, and maintains a
+persistent binary cache of the projection so that a file need only be parsed once.
+
+Cache files:
+    The cache for FILE is a sidecar file, FILE.fcache, written the first time FILE
+    is loaded. It records the path, size, mtime, and MD5 digest of FILE, and stores
+    the projected features as columns of typed arrays plus a string table:
+        id      uint32 index into the string table
+        seqid   uint32 index into the string table
+        start   int32 (-1 means ".")
+        end     int32 (-1 means ".")
+        strand  int8 character code
+    A later load reads the columns from the (memory mapped) cache, rather than parsing FILE, provided
+    FILE's size and mtime match those recorded. The columns are decoded eagerly: the load returns a list
+    of ProjectedFeatures, just as parsing FILE would. If only the mtime differs (e.g., the file was touched
+    or copied), the digest is checked, and the cache is reused if the content is unchanged; the cache is
+    then rewritten with the new mtime, so later loads need not check the digest again.
+    A file having a coordinate too large for int32 is not cached (but is still read).
+
+    Layout: 8 byte magic, uint32 header length, JSON header, then the string table and
+    the columns, each starting on an 8 byte boundary. All numbers are little endian.
+
+Input formats:
+    load reads the projected features from any of three formats (see READERS), each in one pass:
+        gff3        a GFF3 file
+        mousemine   a MouseMine gene export, the tab delimited input of cvt.py:
+                    ID, symbol, chromosome, start, end, and strand (+1 or -1)
+        fcache      a cache file (below), read directly
+    so a MouseMine export need not be converted to GFF3 only to be parsed back.
+
+Chromosome manifests:
+    A small, per-genome TSV file (chr, length, count), one row per chromosome, giving the
+    extent of the chromosome (the greatest end coordinate of any feature on it) and its number
+    of features. The viewer reads these to lay out the chromosomes.
+
+Interned features:
+    Block generation only compares IDs and chromosomes, so generate.py interns them once, when
+    a genome is read: an MGI ID becomes its number (MGI:1234567 -> 1234567), and other IDs None;
+    a chromosome name becomes a small int code from CHROMOSOMES, a table shared by all genomes
+    in the process. The joins, filters, and block ID sets then work on ints, and the strings
+    are restored (mgiId, CHROMOSOMES.name) only when blocks are written.
+'''
+import array
+import bgzf
+import gff3
+import hashlib
+import json
+import mmap
+import os
+import sys
+import threading
+
+CACHE_EXT = '.fcache'
+CACHE_MAGIC = 'SBGFC01\0'
+STRSEP = '\0'
+NONE = -1 # stored in place of "." for start and end
+
+# The input formats load reads (see READERS).
+FORMATS = ['gff3', 'mousemine', 'fcache']
+
+# The name of a strain's file of each format in a data directory (generate.py --all).
+FORMAT_EXTS = {
+    'gff3' : '.gff3',
+    'mousemine' : '.tsv',
+    'fcache' : '.gff3' + CACHE_EXT,
+}
+
+# MouseMine strand -> GFF3 strand
+MOUSEMINE_STRANDS = { '+1' : '+', '-1' : '-' }
+
+# (name, array typecode) for each column, in file order.
+COLUMNS = [
+    ('id',     'I'),
+    ('seqid',  'I'),
+    ('start',  'i'),
+    ('end',    'i'),
+    ('strand', 'b'),
+]
+
+#
+class ProjectedFeature (object):
+    """
+    The projection of a GFF3 feature used for generating synteny blocks.
+    Provides the same attribute names as gff3.Feature.
+    """
+    __slots__ = ['ID', 'seqid', 'start', 'end', 'strand']
+
+    def __init__ (self, ID, seqid, start, end, strand):
+        self.ID = ID
+        self.seqid = seqid
+        self.start = start
+        self.end = end
+        self.strand = strand
+
+    def __repr__ (self):
+        return 'ProjectedFeature(%r, %r, %r, %r, %r)' % \
+            (self.ID, self.seqid, self.start, self.end, self.strand)
+
+def project (f) :
+    """
+    Returns the ProjectedFeature for the given gff3.Feature.
+    """
+    return ProjectedFeature(getattr(f, 'ID', ''), f.seqid, f.start, f.end, f.strand)
+
+#
+def mgiNumber (ID) :
+    """
+    Returns the number of the given MGI ID (e.g., 1234567 for "MGI:1234567"), or None if it
+    is not an MGI ID. (An ID whose number has leading zeros does not count, since mgiId could not restore it.)
+    """
+    if not ID.startswith('MGI:'):
+        return None
+    n = ID[4:]
+    if not n.isdigit() or (n[0] == '0' and len(n) > 1):
+        return None
+    return int(n)
+
+def mgiId (n) :
+    """
+    Returns the MGI ID having the given number. The inverse of mgiNumber.
+    """
+    return 'MGI:%d' % n
+
+class ChromosomeTable (object):
+    """
+    Assigns a small int code to each chromosome name, in order of first appearance.
+    Codes do not sort like the names; see ranks(). Thread safe.
+    """
+    def __init__ (self):
+        self.names = [] # code -> name
+        self.codes = {} # name -> code
+        self.lock = threading.Lock()
+
+    def code (self, name) :
+        c = self.codes.get(name, None)
+        if c is None:
+            with self.lock:
+                c = self.codes.get(name, None)
+                if c is None:
+                    c = len(self.names)
+                    self.names.append(name)
+                    self.codes[name] = c
+        return c
+
+    def name (self, code) :
+        return self.names[code]
+
+    def ranks (self) :
+        """
+        Returns a list giving, for each code, the rank of its name among the names in sorted order.
+        Sorting features by the rank of their seqid sorts them by chromosome name.
+        """
+        names = list(self.names)
+        ranks = [0] * len(names)
+        for r, c in enumerate(sorted(xrange(len(names)), key=names.__getitem__)):
+            ranks[c] = r
+        return ranks
+
+CHROMOSOMES = ChromosomeTable()
+
+def internFeatures (feats) :
+    """
+    Interns the IDs and seqids of the given ProjectedFeatures, in place: each ID becomes its
+    MGI number (or None), and each seqid its code in CHROMOSOMES. Returns feats.
+    """
+    code = CHROMOSOMES.code
+    for f in feats:
+        f.ID = mgiNumber(f.ID)
+        f.seqid = code(f.seqid)
+    return feats
+
+def internPairs (pairs) :
+    """
+    Interns the IDs of a list of [aid, bid] pairs (an AB file). Returns a new list.
+    MGI IDs become their numbers, as in internFeatures. Other IDs become distinct negative ints:
+    no interned feature has them, but they still count when finding the 1:1 pairs.
+    """
+    others = {}
+    def intern (ID) :
+        n = mgiNumber(ID)
+        if n is None:
+            n = others.setdefault(ID, -1 - len(others))
+        return n
+    return [ [ intern(a), intern(b) ] for a, b in pairs ]
+
+#
+def fileDigest (fname) :
+    """
+    Returns the MD5 hex digest of the contents of the named file.
+    """
+    md5 = hashlib.md5()
+    fd = open(fname, 'rb')
+    while True:
+        buf = fd.read(1 << 20)
+        if not buf:
+            break
+        md5.update(buf)
+    fd.close()
+    return md5.hexdigest()
+
+def contentDigest (fname) :
+    """
+    Returns the MD5 hex digest of the contents of the named file. If the file has a
+    current cache, the digest recorded there is used rather than reading the file.
+    """
+    st = os.stat(fname)
+    try:
+        fd = open(cachePath(fname), 'rb')
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, mmap.error, ValueError):
+        return fileDigest(fname)
+    hdr,_ = readHeader(mm)
+    mm.close()
+    fd.close()
+    if hdr and hdr['path'] == os.path.abspath(fname) \
+    and hdr['size'] == st.st_size and hdr['mtime'] == st.st_mtime:
+        return str(hdr['md5'])
+    return fileDigest(fname)
+
+def cachePath (fname) :
+    """
+    Returns the path of the cache file for the named file.
+    """
+    return fname + CACHE_EXT
+
+#
+def load (fname, cache=True, jobs=1, format=None) :
+    """
+    Reads the named input file, in the given format (one of FORMATS; default: as guessFormat
+    guesses it). Returns a list of ProjectedFeatures, in file order.
+    If cache is True, the features are loaded from the file's cache if it is
+    current; otherwise the file is read and the cache (re)written.
+    The file name "-" reads from standard input, and is never cached. Neither is a file
+    that is itself in the projected (fcache) format.
+    If jobs is more than 1, a plain GFF3 file is parsed in that many worker processes
+    (see gff3.iterateParallel). Must not be called from a pool's worker with jobs > 1.
+    """
+    format = format or guessFormat(fname)
+    if fname == '-' or format == 'fcache' or not cache:
+        return READERS[format](fname, jobs)
+    #
+    st = os.stat(fname)
+    key = {
+        'path' : os.path.abspath(fname),
+        'size' : st.st_size,
+        'mtime' : st.st_mtime,
+    }
+    feats = readCache(cachePath(fname), key, fname)
+    if feats is not None:
+        return feats
+    #
+    if format != 'gff3' or bgzf.fileType(fname) != 'plain' or jobs > 1:
+        # the digest is of the file's (compressed) contents
+        feats = READERS[format](fname, jobs)
+        key['md5'] = fileDigest(fname)
+    else:
+        # Parse the file, computing the digest as we go.
+        md5 = hashlib.md5()
+        def lines (fd) :
+            for line in fd:
+                md5.update(line)
+                yield line
+        fd = open(fname, 'r')
+        feats = [ project(f) for f in gff3.iterate(lines(fd), lazy=True) ]
+        fd.close()
+        key['md5'] = md5.hexdigest()
+    try:
+        writeCache(cachePath(fname), key, feats)
+    except (IOError, OSError, OverflowError) as e:
+        # OverflowError: a coordinate too large for the int32 columns
+        sys.stderr.write('Cannot write feature cache for %s: %s\n' % (fname, e))
+    return feats
+
+def guessFormat (fname) :
+    """
+    Returns the format of the named input file: "fcache" if it begins like a feature cache,
+    "mousemine" if its name (less any .gz) ends in .tsv or .txt, and otherwise "gff3".
+    Standard input ("-") is taken to be GFF3.
+    """
+    if fname == '-':
+        return 'gff3'
+    fd = open(fname, 'rb')
+    magic = fd.read(len(CACHE_MAGIC))
+    fd.close()
+    if magic == CACHE_MAGIC:
+        return 'fcache'
+    base = fname[:-3] if fname.endswith('.gz') else fname
+    if os.path.splitext(base)[1] in ('.tsv', '.txt'):
+        return 'mousemine'
+    return 'gff3'
+
+#
+def parse (fname, jobs=1) :
+    """
+    Parses the named GFF3 file (plain, gzip, or BGZF). Returns a list of ProjectedFeatures, in file order.
+    If jobs is more than 1, a plain file is parsed in parallel, and only the projected
+    columns are passed back from the workers.
+    """
+    if jobs <= 1:
+        return [ project(f) for f in gff3.iterate(fname, lazy=True) ]
+    return [ ProjectedFeature(ID or '', seqid, start, end, strand) for ID, seqid, start, end, strand
+        in gff3.iterateParallel(fname, columns=ProjectedFeature.__slots__, jobs=jobs) ]
+
+def readMouseMine (fname, jobs=1) :
+    """
+    Reads a MouseMine gene export (plain, gzip, or BGZF): tab delimited lines of ID, symbol, chromosome,
+    start, end, and strand (+1 or -1). Returns a list of ProjectedFeatures, in file order: the
+    features cvt.py would write as GFF3, without writing and re-parsing it. Blank and comment lines
+    are skipped. (jobs is ignored.)
+    """
+    fd = bgzf.openText(fname)
+    feats = []
+    for line in fd:
+        if line.startswith(gff3.COMMENT_CHAR) or not line.strip():
+            continue
+        tokens = line.rstrip('\r\n').split('\t')
+        if len(tokens) < 6:
+            raise gff3.ParseError("Wrong number of columns (%d)\n%s" % (len(tokens),line))
+        feats.append(ProjectedFeature(
+            tokens[0],
+            tokens[2],
+            '.' if tokens[3] == '.' else int(tokens[3]),
+            '.' if tokens[4] == '.' else int(tokens[4]),
+            MOUSEMINE_STRANDS.get(tokens[5], '.')))
+    if fd is not sys.stdin:
+        fd.close()
+    return feats
+
+def readProjected (fname, jobs=1) :
+    """
+    Reads a file in the projected (fcache) format: a feature cache, read directly, without
+    checking it against the file it was made from (which need not exist). Returns a list
+    of ProjectedFeatures, in file order. (jobs is ignored.)
+    """
+    fd = open(fname, 'rb')
+    try:
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except (mmap.error, ValueError):
+        fd.close()
+        raise ValueError('Not a feature cache file: %s' % fname)
+    hdr,_ = readHeader(mm)
+    if hdr is None:
+        mm.close()
+        fd.close()
+        raise ValueError('Not a feature cache file: %s' % fname)
+    feats = readColumns(mm, hdr)
+    mm.close()
+    fd.close()
+    return feats
+
+# The readers of the input formats. Each reads the named file in one pass, and returns a list of
+# ProjectedFeatures, in file order.
+READERS = {
+    'gff3' : parse,
+    'mousemine' : readMouseMine,
+    'fcache' : readProjected,
+}
+
+def iterateChromosomes (fname, offsets=None) :
+    """
+    Reads the named GFF3 file one chromosome at a time. Yields (seqid, offset, features)
+    for each run of consecutive features having the same seqid, where offset is the file
+    position of the run's first feature and features is a list of ProjectedFeatures.
+    If offsets (positions previously yielded) is given, only the runs starting
+    at those positions are read, in the order given.
+    Only one run is held in memory at a time. The file must be plain or BGZF (so that it is seekable),
+    and is never cached.
+    """
+    fd = bgzf.openText(fname)
+    for start in ([0] if offsets is None else offsets):
+        fd.seek(start)
+        seqid = None
+        feats = []
+        while True:
+            pos = fd.tell()
+            line = fd.readline()
+            if not line:
+                break
+            if line.startswith(gff3.COMMENT_CHAR):
+                continue
+            f = project(gff3.LazyFeature(line))
+            if f.seqid != seqid:
+                if seqid is not None:
+                    yield (seqid, runStart, feats)
+                    if offsets is not None:
+                        seqid = None
+                        break
+                seqid = f.seqid
+                runStart = pos
+                feats = []
+            feats.append(f)
+        if seqid is not None:
+            yield (seqid, runStart, feats)
+    fd.close()
+
+#
+def chromosomeSummary (feats) :
+    """
+    Returns a list of [chr, length, count] rows, one per chromosome (seqid) of the
+    given features, sorted by chromosome. Length is the greatest end coordinate on the chromosome.
+    The features may be interned (see internFeatures); the rows give chromosome names regardless.
+    """
+    summary = {}
+    for f in feats:
+        s = summary.get(f.seqid, None)
+        if s is None:
+            s = summary[f.seqid] = [f.seqid, 0, 0]
+        if f.end != '.' and f.end > s[1]:
+            s[1] = f.end
+        s[2] += 1
+    for s in summary.values():
+        if isinstance(s[0], int):
+            s[0] = CHROMOSOMES.name(s[0])
+    return sorted(summary.values())
+
+def writeChromosomeManifest (fname, summary) :
+    """
+    Writes the rows returned by chromosomeSummary to the named file, as a TSV with a header.
+    The file is written under a temporary name and then renamed.
+    """
+    tmpname = '%s.%d.tmp' % (fname, os.getpid())
+    fd = open(tmpname, 'w')
+    fd.write(formatChromosomeManifest(summary))
+    fd.close()
+    os.rename(tmpname, fname)
+
+def formatChromosomeManifest (summary) :
+    """
+    Returns the text of the chromosome manifest for the rows returned by chromosomeSummary.
+    """
+    return 'chr\tlength\tcount\n' + ''.join([ '%s\t%d\t%d\n' % tuple(row) for row in summary ])
+
+#
+def readHeader (mm) :
+    """
+    Reads the header of a memory mapped cache file. Returns (header dict, data offset),
+    or (None, 0) if the file is not a cache file.
+    """
+    if mm[0:8] != CACHE_MAGIC:
+        return (None, 0)
+    hlen = array.array('I', mm[8:12])
+    if sys.byteorder != 'little':
+        hlen.byteswap()
+    return (json.loads(mm[12:12+hlen[0]]), 12 + hlen[0])
+
+def readCache (cname, key, fname) :
+    """
+    Loads features from the named cache file if its key matches the given key.
+    Returns a list of ProjectedFeatures, or None if the cache is missing or stale.
+    """
+    try:
+        fd = open(cname, 'rb')
+    except IOError:
+        return None
+    try:
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except (mmap.error, ValueError):
+        # empty file
+        fd.close()
+        return None
+    hdr,_ = readHeader(mm)
+    if hdr is None \
+    or hdr['path'] != key['path'] \
+    or hdr['size'] != key['size']:
+        mm.close()
+        fd.close()
+        return None
+    if hdr['mtime'] != key['mtime'] and hdr['md5'] != fileDigest(fname):
+        mm.close()
+        fd.close()
+        return None
+    feats = readColumns(mm, hdr)
+    mm.close()
+    fd.close()
+    if hdr['mtime'] != key['mtime']:
+        # The content is unchanged. Record the new mtime, so the next load need not read FILE.
+        try:
+            writeCache(cname, dict(key, md5=str(hdr['md5'])), feats)
+        except (IOError, OSError) as e:
+            sys.stderr.write('Cannot write feature cache for %s: %s\n' % (fname, e))
+    return feats
+
+def readColumns (mm, hdr) :
+    """
+    Returns the list of ProjectedFeatures stored in a (memory mapped) cache file, given its header.
+    """
+    strings = mm[hdr['strings'][0]:hdr['strings'][1]].split(STRSEP)
+    cols = {}
+    for name, tc in COLUMNS:
+        start, end = hdr['columns'][name]
+        a = array.array(tc)
+        a.fromstring(mm[start:end])
+        if sys.byteorder != 'little':
+            a.byteswap()
+        cols[name] = a
+    #
+    feats = []
+    for ID, seqid, start, end, strand in \
+        zip(cols['id'], cols['seqid'], cols['start'], cols['end'], cols['strand']):
+        feats.append(ProjectedFeature(
+            strings[ID],
+            strings[seqid],
+            '.' if start == NONE else start,
+            '.' if end == NONE else end,
+            chr(strand)))
+    return feats
+
+def writeCache (cname, key, feats) :
+    """
+    Writes the given list of ProjectedFeatures to the named cache file, recording the given key.
+    The file is written under a temporary name and then renamed, so readers never see a partial file.
+    """
+    strings = []
+    str2index = {}
+    def intern (s) :
+        i = str2index.get(s, None)
+        if i is None:
+            i = str2index[s] = len(strings)
+            strings.append(s)
+        return i
+    cols = dict([ (name, array.array(tc)) for name, tc in COLUMNS ])
+    for f in feats:
+        cols['id'].append(intern(f.ID))
+        cols['seqid'].append(intern(f.seqid))
+        cols['start'].append(NONE if f.start == '.' else f.start)
+        cols['end'].append(NONE if f.end == '.' else f.end)
+        cols['strand'].append(ord(f.strand))
+    #
+    # Lay out the data sections, then write the header that points to them.
+    blobs = [ STRSEP.join(strings) ]
+    for name, tc in COLUMNS:
+        a = cols[name]
+        if sys.byteorder != 'little':
+            a.byteswap()
+        blobs.append(a.tostring())
+    hdr = dict(key)
+    hdr['n'] = len(feats)
+    hdr['columns'] = {}
+    # header length depends on the offsets it contains, so fix its size by padding
+    hlen = 4096
+    while True:
+        offsets = []
+        pos = 12 + hlen
+        for b in blobs:
+            pos += (-pos) % 8
+            offsets.append([pos, pos + len(b)])
+            pos += len(b)
+        hdr['strings'] = offsets[0]
+        for (name, tc), o in zip(COLUMNS, offsets[1:]):
+            hdr['columns'][name] = o
+        htext = json.dumps(hdr)
+        if len(htext) <= hlen:
+            break
+        hlen *= 2
+    htext += ' ' * (hlen - len(htext))
+    #
+    hl = array.array('I', [hlen])
+    if sys.byteorder != 'little':
+        hl.byteswap()
+    tmpname = '%s.%d.tmp' % (cname, os.getpid())
+    fd = open(tmpname, 'wb')
+    fd.write(CACHE_MAGIC)
+    fd.write(hl.tostring())
+    fd.write(htext)
+    pos = 12 + hlen
+    for b in blobs:
+        pad = (-pos) % 8
+        fd.write('\0' * pad)
+        fd.write(b)
+        pos += pad + len(b)
+    fd.close()
+    os.rename(tmpname, cname)
@@ -24,6 +24,50 @@ Each row corresponds to one block, and has the following fields:
     8. bStart: start position on bChr
     9. bEnd: end position on bChr
 
+Batch mode (--all STRAINLIST): generates a block file for every ordered pair of
+strains in STRAINLIST. Each strain's GFF3 file is read and sorted once, and the pairs
+are divided among a pool of worker processes (-j).
+Batch mode is incremental: OUTDIR/manifest.json records, for each pair, the content
+digests of its inputs and the generator version and options. Only pairs whose entry
+has changed (or whose output is missing) are recomputed, and only the strains they
+involve are read. Outputs are written to a temporary file and renamed into place.
+Batch mode also writes a chromosome manifest, OUTDIR/<strain>.chrs.tsv, for each strain
+(see features.py). The viewer gets chromosome names and lengths from these, so the
+self-comparison (A-A) pairs can be skipped with --skip-self.
+With --binary and --lod, batch mode also writes binary block files and coarsened levels for the viewer
+(see blockfile.py and lod.py).
+Batch mode also writes a strains x strains matrix of summary statistics of the pairs
+(blocks, inversions, translocations, inflated blocks), OUTDIR/summary.json and summary.tsv,
+accumulated as the blocks are written (see summary.py).
+
+One-vs-many mode (-B with several files): generates the blocks of one reference genome (-A)
+against each of several partner genomes, writing OUTDIR/<A>-<B>.tsv for each. The reference is read,
+filtered, sorted, and de-overlapped once, and its prepared features and ID index are reused for every
+partner. Partners are divided among a pool of worker processes (-j).
+
+Genomes may also be read from MouseMine gene exports or projected feature caches (--informat; see
+features.py), each read straight into the projected features, without a GFF3 round trip.
+Inputs may be gzip or BGZF compressed. --region filters the output: only the blocks whose A extent overlaps
+the given region are written, exactly the full run's blocks there, with the same IDs and indexes. All of A is still read
+(from its feature cache, cheaply), since the B indexes, and so the blocks, depend on every pair (see selectRegion).
+
+Streaming mode (--stream): for an A file grouped by chromosome (as prepStrainFile.py writes them),
+processes one A chromosome at a time - filter, overlap removal, join, block generation,
+and output - so memory holds only B and the current A chromosome. See goStream.
+
+Indel blocks (--indels): runs of consecutive features present in only one genome are written as
+blocks with an empty chromosome (and zero coordinates) on the other side. They are found by an anti-join
+of each genome's sorted features against the pairs, in the same pass as the synteny blocks
+(see scanWithIndels). The viewer shows them in the genome that has them (the "deletions" facet).
+
+IDs and chromosome names are interned to ints when the inputs are read (see features.py),
+and restored when the blocks are written.
+
+Blocks are held as compact records (blockfile.Block) of their extent and index ranges in each genome;
+a block's IDs are not kept, but looked up from the pairs in its range when it is written, in genomic
+order (see blockIds). With --ids ranges, the IDs of each genome's paired features are written once,
+in index order, and the ids of the strict synteny blocks are left for the reader to find from their ranges.
+
 Implementation outline:
 
 1. Filter AB to contain only 1:1 relationships.
@@ -46,8 +90,32 @@ Implementation outline:
    indicate synteny block boundaries. (Detail: also look for changes in aChr or bChr)
 '''
 import argparse
-import gff3
+import bgzf
+import bisect
+import blockfile
+import collections
+import cProfile
+import contextlib
+import features
+import json
+import lod
+import multiprocessing
+import operator
+import os
+import resource
+import summary
 import sys
+import time
+
+# Recorded in the batch manifest. Change it when a code change alters the output,
+# so that the next batch run recomputes everything.
+VERSION = '3'
+MANIFEST = 'manifest.json'
+
+try:
+    import npengine
+except ImportError:
+    npengine = None
 
 class SyntenyBlockGenerator:
 
@@ -56,18 +124,34 @@ class SyntenyBlockGenerator:
         Initializes the SyntenyBlockGenerator instance.
         """
         #
-        self.A = None   # list of gff3.Features
-        self.B = None   # list of gff3.Features
+        self.A = None   # list of features.ProjectedFeatures
+        self.B = None   # list of features.ProjectedFeatures
         self.AB = None  # list of [aid,bid] pairs
         #
         self.nBlocks = 0 # number of synteny blocks created.
+        self.ofd = sys.stdout # where blocks are written
+        self.blockJobs = 1 # number of processes for generating blocks
+        #
+        # Instrumentation. See stage() and count().
+        self.stages = []  # list of {name, seconds, peakRssKb}, in the order run
+        self.counts = {}  # counts of things in and out of each stage
+        self.profilePrefix = '' # prefix for profile file names
+        self.blockRows = None # if a list, writeBlock also appends each row to it (for --binary)
+        self.summary = summary.newSummary() # statistics of the blocks written (see summary.py)
+        self.aPrepared = False # if True, A, a2b, and b2a are already prepared (see goOneVsMany)
+        self.strictBlocks = None # the blocks before chaining (see mirrorBlocks)
+        self.mirrored = None # the blocks of the mirrored pair, B-A, once computed (see writeMirror)
+        self.mirror = None # number of blocks and summary of the mirrored pair, once written
+        self.mirrorVerified = None # result of --verify-mirror, once checked
+        self.pairIds = None # (A IDs, B IDs, B indexes) of the pairs, in A order, once needed (see blockIds)
+        self.pairsBase = 0 # the A index of the first of self.pairs (see goStream)
         #
         # Create a special object to serve as the "missing" side of an insertion/deletion block.
         #
         self.INSERTED = {
             'index' : -1,
             'ID' : '',
-            'chr': '',
+            'chr': None,
             'start': 0,
             'end' : 0,
             'strand' : '.',
@@ -75,20 +159,149 @@ class SyntenyBlockGenerator:
 
         self.initArgParser()
 
-    def go (self):
+    def go (self, argv=None):
         """
         The generator's main program. Reads the inputs, does the computation,
         and writes the synteny blocks to the output.
+        Command line arguments are taken from argv if given, otherwise from sys.argv.
+        """
+        self.parseArgs(argv)
+        if self.args.strainList:
+            self.goBatch()
+            return
+        if len(self.args.filesB) > 1:
+            self.goOneVsMany()
+            return
+        if self.args.binary:
+            self.blockRows = []
+        if not (self.args.stream and self.goStream()):
+            if self.args.engine == 'python' and self.args.jobs:
+                self.blockJobs = self.args.jobs
+            with self.stage('readFiles'):
+                self.readFiles()
+            self.compute()
+            with self.stage('writeBlocks'):
+                self.writeBlocks()
+                self.writeRangeIds(self.args.idsPrefix)
+            if self.args.mirror:
+                ofd, rows = self.ofd, self.blockRows
+                self.ofd = open(tmpName(self.args.mirror), 'w')
+                self.blockRows = None
+                self.writeMirror()
+                self.ofd.close()
+                os.rename(tmpName(self.args.mirror), self.args.mirror)
+                self.writeRangeIds(os.path.splitext(self.args.mirror)[0], True)
+                self.ofd, self.blockRows = ofd, rows
+        if self.args.binary:
+            with self.stage('writeBinary'):
+                blockfile.write(self.args.binary, self.blockRows)
+        if self.args.verifyMirror:
+            self.mirrorVerified = self.verifyMirror()
+        if self.args.metrics:
+            self.writeMetrics(self.args.metrics, self.getMetrics())
+        if self.mirrorVerified is False:
+            sys.exit(1)
+
+    def compute (self) :
+        """
+        Computes the synteny blocks from the A, B, and AB inputs, which must
+        already be loaded.
+        """
+        if not (self.args.engine == 'numpy' and npengine.compute(self)):
+            if not self.aPrepared:
+                with self.stage('prepAB'):
+                    self.prepAB()
+                with self.stage('prepGff.A'):
+                    self.aid2feat = self.prepGff(self.A, self.a2b, 'A')
+            with self.stage('prepGff.B'):
+                self.bid2feat = self.prepGff(self.B, self.b2a, 'B')
+            with self.stage('join'):
+                self.join()
+            if self.args.debug: self.writePairs()
+            with self.stage('generateBlocks'):
+                self.generateBlocks()
+        self.strictBlocks = self.blocks
+        if self.args.chainGap is not None:
+            with self.stage('chainBlocks'):
+                self.blocks = self.chainBlocks(self.blocks)
+            self.count('blocks', 'chained', len(self.blocks))
+        if self.args.region is not None:
+            self.strictBlocks = self.selectRegion(self.strictBlocks)
+            self.blocks = self.selectRegion(self.blocks)
+            self.count('blocks', 'inRegion', len(self.blocks))
+
+    def selectRegion (self, blocks) :
+        """
+        Returns the blocks whose A extent overlaps the --region. The blocks are computed from
+        all the pairs, not just the region's: a B feature joined to from elsewhere in A still
+        takes up a B index, and so keeps the region's blocks apart just as in the full run.
         """
-        self.parseArgs()
-        self.readFiles()
-        self.prepAB()
-        self.aid2feat = self.prepGff(self.A, self.a2b)
-        self.bid2feat = self.prepGff(self.B, self.b2a)
-        self.join()
-        if self.args.debug: self.writePairs()
-        self.generateBlocks()
-        self.writeBlocks()
+        chr, start, end = bgzf.parseRegion(self.args.region)
+        code = features.CHROMOSOMES.codes.get(chr, None)
+        return [ blk for blk in blocks if blk.aChr is not None and blk.aChr == code
+            and (start is None or blk.aEnd >= start) and (end is None or blk.aStart <= end) ]
+
+    @contextlib.contextmanager
+    def stage (self, name) :
+        """
+        Context manager that records the wall time of a stage of the computation, and
+        the process's peak RSS during it (see startRssPeak). If --profile is specified, the stage
+        is also run under cProfile, and its stats dumped to PROFILEDIR/<prefix><name>.prof.
+        """
+        prof = None
+        if self.args.profileDir:
+            prof = cProfile.Profile()
+            prof.enable()
+        startRssPeak()
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            peak = endRssPeak()
+        t1 = time.time()
+        if prof:
+            prof.disable()
+            prof.dump_stats(os.path.join(self.args.profileDir, '%s%s.prof' % (self.profilePrefix, name)))
+        self.stages.append({
+            'name' : name,
+            'seconds' : round(t1 - t0, 6),
+            'peakRssKb' : peak,
+        })
+
+    def count (self, group, name, n) :
+        """
+        Records a count, e.g. count('A', 'overlaps', 12).
+        """
+        self.counts.setdefault(group, {})[name] = n
+
+    def getMetrics (self) :
+        """
+        Returns the stage timings and counts as a dict.
+        """
+        metrics = {
+            'A' : self.args.fileA,
+            'B' : self.args.fileB,
+            'engine' : self.args.engine,
+            'stages' : self.stages,
+            'seconds' : round(sum([ s['seconds'] for s in self.stages ]), 6),
+            'peakRssKb' : max([0] + [ s['peakRssKb'] for s in self.stages ]),
+            'counts' : self.counts,
+            'summary' : self.summary,
+        }
+        if self.mirror:
+            metrics['mirror'] = self.mirror
+        if self.mirrorVerified is not None:
+            metrics['mirrorVerified'] = self.mirrorVerified
+        return metrics
+
+    def writeMetrics (self, fname, metrics) :
+        """
+        Writes metrics as JSON to the named file.
+        """
+        fd = open(fname, 'w')
+        json.dump(metrics, fd, indent=2, sort_keys=True)
+        fd.write('\n')
+        fd.close()
 
     def initArgParser (self):
         """
@@ -97,17 +310,18 @@ class SyntenyBlockGenerator:
         self.parser = argparse.ArgumentParser(description='Generate synteny blocks.')
         self.parser.add_argument(
             '-A',
-            required=True,
             dest="fileA",
             metavar='AFEATURES', 
-            help='GFF3 file of features from genome A.')
+            help='GFF3 (or see --informat) file of features from genome A. Required unless --all is given.')
 
         self.parser.add_argument(
             '-B',
-            required=True,
-            dest="fileB",
+            dest="filesB",
+            nargs='+',
             metavar='BFEATURES', 
-            help='GFF3 file of features from genome B.')
+            help='GFF3 (or see --informat) file of features from genome B. Required unless --all is given. ' + \
+                 'Given several files, generates the blocks of AFEATURES against each of them, ' + \
+                 'writing OUTDIR/<A>-<B>.tsv for each (one-vs-many mode).')
 
         self.parser.add_argument(
             '-AB',
@@ -122,31 +336,417 @@ class SyntenyBlockGenerator:
             default=False,
             help='Debug mode.')
 
-    def parseArgs (self) :
+        self.parser.add_argument(
+            '--engine',
+            dest="engine",
+            choices=['python', 'numpy'],
+            default='python',
+            help='Implementation of the block generation steps. The numpy engine works on arrays rather than ' + \
+                 'per-feature dicts, and produces identical output. (default: %(default)s)')
+
+        self.parser.add_argument(
+            '--metrics',
+            dest="metrics",
+            metavar='FILE',
+            help='Write metrics as JSON to FILE: wall time and peak RSS for each stage (on Linux, the peak during the stage; ' + \
+                 'elsewhere, the process\'s peak so far), and ' + \
+                 'counts of features read, dropped (non-MGI, not in AB, overlapping) and kept, AB pairs, joined pairs, and blocks, ' + \
+                 'and the summary statistics of the blocks written (see summary.py). ' + \
+                 'In batch mode, metrics are reported for loading each strain and for each pair.')
+
+        self.parser.add_argument(
+            '--profile',
+            dest="profileDir",
+            metavar='PROFILEDIR',
+            help='Run each stage under cProfile, and dump the stats to PROFILEDIR/<stage>.prof ' + \
+                 '(PROFILEDIR/<A>-<B>.<stage>.prof in batch mode).')
+
+        self.parser.add_argument(
+            '--no-cache',
+            dest="noCache",
+            action="store_true",
+            default=False,
+            help='Always parse the GFF3 files; do not read or write their feature caches (FILE.fcache).')
+
+        self.parser.add_argument(
+            '--region',
+            dest="region",
+            metavar='REGION',
+            help='Write just the blocks whose A extent overlaps one region of genome A, chr or chr:start-end. ' + \
+                 'This filters the output only: A and B are both read, and the blocks computed, whole (since the B indexes ' + \
+                 'depend on every pair), so the blocks written are the full run\'s blocks there, with the same IDs and indexes. ' + \
+                 'With --indels, insertion blocks (which have no A extent) are not written.')
+
+        self.parser.add_argument(
+            '--informat',
+            dest="informat",
+            choices=features.FORMATS,
+            default=None,
+            help='Format of the genome files: gff3; mousemine, a MouseMine gene export (ID, symbol, chr, start, end, ' + \
+                 'strand as +1/-1), read directly rather than converted by cvt.py; or fcache, a projected feature cache ' + \
+                 '(see features.py). In batch mode, the strain files are DATADIR/<strain>.gff3, .tsv, or .gff3.fcache, ' + \
+                 'respectively. (default: guessed from each file: fcache by its content, mousemine if named .tsv or .txt, ' + \
+                 'otherwise gff3)')
+
+        self.parser.add_argument(
+            '--stream',
+            dest="stream",
+            action="store_true",
+            default=False,
+            help='Streaming mode, for AFEATURES files grouped by chromosome (as written by prepStrainFile.py). ' + \
+                 'Processes and writes one A chromosome at a time, holding only B and the current A chromosome in memory. ' + \
+                 'Output is identical to the default mode. If AFEATURES turns out not to be grouped by chromosome, ' + \
+                 'it is read into memory as usual.')
+
+        self.parser.add_argument(
+            '--chain-gap',
+            dest="chainGap",
+            type=int,
+            metavar='K',
+            help='Chain the blocks, tolerating gaps: a block continues the chain before it (same chromosomes and orientation) ' + \
+                 'if at most K genes are skipped or locally transposed between them in each genome. ' + \
+                 'Adds a column, nMerged, giving the number of strict blocks in each chained block. (default: no chaining)')
+
+        self.parser.add_argument(
+            '--indels',
+            dest="indels",
+            action="store_true",
+            default=False,
+            help='Also generate indel blocks: runs of consecutive features (on one chromosome) that are present in only one genome. ' + \
+                 'A deletion block (genes of A missing from B) has an empty bChr, and zero bLength, bStart, bEnd, and bIndex; ' + \
+                 'an insertion block (genes of B missing from A) likewise has an empty aChr. Deletions are interleaved with the synteny blocks ' + \
+                 'in A order; insertions follow, in B order. Synteny blocks are unchanged. Python engine only; not with --stream. ' + \
+                 '(In single pair mode, -j is ignored.)')
+
+        self.parser.add_argument(
+            '--binary',
+            dest="binary",
+            nargs='?',
+            const=True,
+            metavar='BLKFILE',
+            help='Also write the blocks in the compact binary format the viewer reads (see blockfile.py): ' + \
+                 'to BLKFILE, with their IDs in a separate table (BLKFILE with the extension .ids). ' + \
+                 'In batch and one-vs-many modes, give no BLKFILE; OUTDIR/A-B.blk and OUTDIR/A-B.ids are written for each pair.')
+
+        self.parser.add_argument(
+            '--lod',
+            dest="lod",
+            type=int,
+            nargs='*',
+            metavar='RES',
+            help='Batch and one-vs-many modes. Also write coarsened (level-of-detail) block files for the viewer, ' + \
+                 'OUTDIR/A-B.lod<RES>.tsv, in which adjacent collinear blocks up to RES bp apart are merged (see lod.py). ' + \
+                 '(default resolutions: %s)' % ' '.join(map(str, lod.LEVELS)))
+
+        self.parser.add_argument(
+            '--ids',
+            dest="ids",
+            choices=['inline', 'ranges'],
+            default='inline',
+            help='How the ids column is written. inline: every block lists its IDs. ranges: a strict synteny block\'s ids are ' + \
+                 'left empty, since they follow from its aIndex and bIndex ranges, and the IDs of each genome\'s paired features ' + \
+                 'are written once, in index order, to PREFIX.a.ids and PREFIX.b.ids (see blockfile.py). ' + \
+                 'PREFIX is given by --ids-prefix in single pair mode, and is OUTDIR/A-B otherwise. ' + \
+                 'Not with --stream. (default: %(default)s)')
+
+        self.parser.add_argument(
+            '--ids-prefix',
+            dest="idsPrefix",
+            metavar='PREFIX',
+            help='Single pair mode, with --ids ranges: write the ID files to PREFIX.a.ids and PREFIX.b.ids. ' + \
+                 '(With --mirror FILE, those of the mirrored pair are named for FILE, less its extension.)')
+
+        self.parser.add_argument(
+            '--mirror',
+            dest="mirror",
+            nargs='?',
+            const=True,
+            metavar='FILE',
+            help='Also write the blocks of the mirrored pair, B-A, derived from the A-B blocks (by swapping sides, ' + \
+                 're-sorting by B, and renumbering) rather than computed from scratch (see mirrorBlocks): ' + \
+                 'to FILE (TSV only). In batch mode, give no FILE; each unordered pair of strains is computed once, and ' + \
+                 'both OUTDIR/A-B.tsv and OUTDIR/B-A.tsv (and their other files) are written from it. In one-vs-many mode, give no FILE; ' + \
+                 'OUTDIR/<B>-<A>.tsv is also written for each partner. Not with -AB in batch mode (the AB pairs are not symmetric).')
+
+        self.parser.add_argument(
+            '--verify-mirror',
+            dest="verifyMirror",
+            action="store_true",
+            default=False,
+            help='Check that the mirrored (B-A) blocks are the same as those of a direct B-A run, which is also computed. ' + \
+                 'Reports the result, and any blocks found by only one of the two, on stderr, and exits with status 1 if they differ. ' + \
+                 'Single pair mode only.')
+
+        self.parser.add_argument(
+            '--all',
+            dest="strainList",
+            metavar='STRAINLIST',
+            help='Batch mode. Generates blocks for every ordered pair of strains listed in STRAINLIST (one name per line). ' + \
+                 'Each strain is read from DATADIR/<strain>.gff3 (once), and the blocks for strains A and B are written to OUTDIR/A-B.tsv.')
+
+        self.parser.add_argument(
+            '--datadir',
+            dest="datadir",
+            default="data",
+            metavar='DATADIR',
+            help='Batch mode. Directory containing the strain GFF3 files. (default: %(default)s)')
+
+        self.parser.add_argument(
+            '--outdir',
+            dest="outdir",
+            default="output",
+            metavar='OUTDIR',
+            help='Batch and one-vs-many modes. Directory where the block files are written. (default: %(default)s)')
+
+        self.parser.add_argument(
+            '--skip-self',
+            dest="skipSelf",
+            action="store_true",
+            default=False,
+            help='Batch mode. Do not generate the self-comparison (A-A) block files.')
+
+        self.parser.add_argument(
+            '--force',
+            dest="force",
+            action="store_true",
+            default=False,
+            help='Batch mode. Recompute every pair, even if its inputs are unchanged since the last run.')
+
+        self.parser.add_argument(
+            '-j',
+            dest="jobs",
+            type=int,
+            default=None,
+            metavar='N',
+            help='Number of worker processes. In batch and one-vs-many modes, pairs are computed in parallel. ' + \
+                 'Otherwise, the blocks for each A chromosome are generated in parallel (python engine only). ' + \
+                 'Uncached plain GFF3 files read by the main process are also parsed in parallel, in chunks. ' + \
+                 '(default: number of CPUs in batch and one-vs-many modes, otherwise 1)')
+
+    def parseArgs (self, argv=None) :
         """
         """
-        self.args = self.parser.parse_args()
+        self.args = self.parser.parse_args(argv)
+        if not self.args.strainList and not (self.args.fileA and self.args.filesB):
+            self.parser.error('-A and -B are required (unless --all is given).')
+        self.args.filesB = self.args.filesB or []
+        self.args.fileB = self.args.filesB[0] if len(self.args.filesB) == 1 else None
+        # batch and one-vs-many modes write a set of files to OUTDIR
+        multi = self.args.strainList or len(self.args.filesB) > 1
+        if self.args.binary is True and not multi:
+            self.parser.error('--binary requires BLKFILE (unless --all or several -B files are given).')
+        if self.args.binary not in (None, True) and multi:
+            self.parser.error('--binary takes no BLKFILE with --all or several -B files.')
+        if self.args.chainGap is not None and self.args.chainGap < 0:
+            self.parser.error('--chain-gap must not be negative.')
+        if self.args.lod is not None:
+            if not multi:
+                self.parser.error('--lod requires --all or several -B files. (To coarsen a single block file, use lod.py.)')
+            self.args.lod = sorted(set(self.args.lod or lod.LEVELS))
+        if self.args.stream and (multi or self.args.region or self.args.engine != 'python'):
+            self.parser.error('--stream cannot be used with --all, several -B files, --region, or --engine numpy.')
+        if self.args.region is not None:
+            if self.args.strainList:
+                self.parser.error('--region cannot be used with --all.')
+            try:
+                bgzf.parseRegion(self.args.region)
+            except ValueError as e:
+                self.parser.error(str(e))
+        if self.args.mirror is True and not multi:
+            self.parser.error('--mirror requires FILE (unless --all or several -B files are given).')
+        if self.args.mirror not in (None, True) and multi:
+            self.parser.error('--mirror takes no FILE with --all or several -B files.')
+        if self.args.mirror and self.args.strainList and self.args.fileAB:
+            self.parser.error('--mirror cannot be used with -AB in batch mode.')
+        if self.args.verifyMirror:
+            if multi:
+                self.parser.error('--verify-mirror requires a single pair (-A and one -B file).')
+            if self.args.region or '-' in (self.args.fileA, self.args.fileB):
+                self.parser.error('--verify-mirror cannot be used with --region or standard input.')
+        if self.args.indels and (self.args.engine != 'python' or self.args.stream):
+            self.parser.error('--indels requires --engine python, and cannot be used with --stream.')
+        if self.args.ids == 'ranges':
+            if self.args.stream:
+                self.parser.error('--ids ranges cannot be used with --stream.')
+            if not multi and not self.args.idsPrefix:
+                self.parser.error('--ids ranges requires --ids-prefix (unless --all or several -B files are given).')
+        if self.args.idsPrefix and (multi or self.args.ids != 'ranges'):
+            self.parser.error('--ids-prefix requires --ids ranges, in single pair mode.')
+        if self.args.stream and (self.args.mirror or self.args.verifyMirror):
+            self.parser.error('--stream cannot be used with --mirror or --verify-mirror.')
+        if self.args.engine == 'numpy' and npengine is None:
+            self.parser.error('--engine numpy requires the numpy package.')
+        if self.args.profileDir and not os.path.isdir(self.args.profileDir):
+            os.makedirs(self.args.profileDir)
 
     def readFiles (self) :
         """
         Loads the 2 GFF3 files and the AB file (if specified).
         If no AB specified, generates AB so that features with same ID correspond.
         """
-        self.A = self.readGff(self.args.fileA)
-        self.B = self.readGff(self.args.fileB)
+        jobs = self.args.jobs or 1
+        self.A = self.readGff(self.args.fileA, jobs=jobs)
+        self.B = self.readGff(self.args.fileB, jobs=jobs)
+        self.count('A', 'read', len(self.A))
+        self.count('B', 'read', len(self.B))
         if self.args.fileAB:
             # correspondence is based on data file provided by user
-            self.AB = self.readTsv(self.args.fileAB)
+            self.AB = self.readAB(self.args.fileAB)
         else:
-            # correspondence is based on shared ID.
-            allIds = set([f.ID for f in self.A] + [f.ID for f in self.B])
-            self.AB = [ [i,i] for i in allIds ]
+            self.AB = self.sharedIdPairs()
 
-    def readGff (self, fname) :
+    def goPair (self, A, B, AB) :
         """
-        Reads a GFF3 file. Returns list of gff3.Feature objects.
+        Computes the blocks for genomes A and B, already loaded (and sorted) by the caller,
+        and writes them to self.ofd. AB is the list of A/B pairs, or None if features correspond
+        by ID. The genome lists are not modified. Used by batch mode and by synserve.py, which
+        load each genome once for many pairs. self.args must be set.
         """
-        return list(gff3.iterate(fname))
+        # prepGff modifies its list in place, so give it a (shallow) copy.
+        self.A = list(A)
+        self.B = list(B)
+        self.AB = AB or self.sharedIdPairs()
+        self.count('A', 'read', len(self.A))
+        self.count('B', 'read', len(self.B))
+        self.compute()
+        with self.stage('writeBlocks'):
+            self.writeBlocks()
+
+    def goStream (self) :
+        """
+        Streaming mode (--stream). Generates the same blocks as go(), but holds only B (and its
+        index) plus one A chromosome in memory at a time. Genome A must be grouped by chromosome,
+        as prepStrainFile.py writes it. A is read twice:
+            1. Each chromosome is filtered and de-overlapped, and the B features its kept
+               features join to are marked. This gives the B indexes of the pairs (as renumber would),
+               and the file position of each chromosome.
+            2. The chromosomes are re-read in sorted order, and each one is joined,
+               scanned for blocks, and its blocks written before the next is read.
+        Returns True on success. Returns False, having written nothing, if A cannot be
+        streamed (it is stdin, is not grouped by chromosome, or two of its features join to the
+        same B feature); the caller then falls back to the in-memory path.
+        """
+        fname = self.args.fileA
+        if fname == '-':
+            sys.stderr.write('Cannot stream standard input. Reading A into memory.\n')
+            return False
+        if (self.args.informat or features.guessFormat(fname)) != 'gff3':
+            sys.stderr.write('Can only stream GFF3. Reading A into memory.\n')
+            return False
+        nstages = len(self.stages)
+        with self.stage('readFiles'):
+            self.B = self.readGff(self.args.fileB)
+            self.count('B', 'read', len(self.B))
+            if self.args.fileAB:
+                self.AB = self.readAB(self.args.fileAB)
+        if self.args.fileAB:
+            with self.stage('prepAB'):
+                self.prepAB()
+        else:
+            # features correspond if they have the same ID
+            self.a2b = self.b2a = SharedIds()
+        with self.stage('prepGff.B'):
+            self.bid2feat = self.prepGff(self.B, self.b2a, 'B')
+        #
+        # Pass 1.
+        chroms = [] # (seqid, offset) of each A chromosome, in file order
+        matched = set() # IDs of the B features joined to
+        totals = { 'read' : 0 }
+        problem = None
+        with self.stage('scanA'):
+            for seqid, offset, feats in features.iterateChromosomes(fname):
+                if seqid in [ c[0] for c in chroms ]:
+                    problem = 'is not grouped by chromosome (%s)' % seqid
+                    break
+                chroms.append((seqid, offset))
+                totals['read'] += len(feats)
+                features.internFeatures(feats)
+                self.prepGff(feats, self.a2b, 'A')
+                for k, v in self.counts['A'].items():
+                    totals[k] = totals.get(k, 0) + v
+                for a in feats:
+                    bid = self.a2b.get(a['ID'],[None])[0]
+                    if bid in self.bid2feat:
+                        if bid in matched:
+                            problem = 'has two features that join to %s' % bid
+                            break
+                        matched.add(bid)
+                if problem:
+                    break
+            # number the B features that are joined to, as renumber would
+            n = 0
+            for b in self.B:
+                if b['ID'] in matched and self.bid2feat[b['ID']] is b:
+                    b['index'] = n
+                    n += 1
+        if problem:
+            sys.stderr.write('%s %s. Reading A into memory.\n' % (fname, problem))
+            del self.stages[nstages:]
+            self.counts = {}
+            return False
+        #
+        # Pass 2.
+        npairs = 0
+        nstrict = 0
+        nchained = 0
+        with self.stage('generateBlocks'):
+            self.writeHeader()
+            offsets = [ c[1] for c in sorted(chroms) ]
+            for seqid, offset, feats in features.iterateChromosomes(fname, offsets):
+                features.internFeatures(feats)
+                self.prepGff(feats, self.a2b, 'A')
+                self.pairs = []
+                self.pairIds = None
+                self.pairsBase = npairs
+                for a in feats:
+                    b = self.bid2feat.get(self.a2b.get(a['ID'],[None])[0], self.INSERTED)
+                    if b is self.INSERTED: continue
+                    a['index'] = npairs + len(self.pairs)
+                    self.pairs.append({ 'a' : a, 'b' : b })
+                npairs += len(self.pairs)
+                if self.args.debug: self.writePairs()
+                blocks = self.scanPairs(self.pairs)
+                nstrict += len(blocks)
+                if self.args.chainGap is not None:
+                    blocks = self.chainBlocks(blocks, nchained + 1)
+                    nchained += len(blocks)
+                for block in blocks:
+                    self.writeBlock(block)
+                self.ofd.flush()
+        self.pairs = []
+        self.counts['A'] = totals
+        self.count('pairs', 'joined', npairs)
+        self.count('blocks', 'generated', nstrict)
+        if self.args.chainGap is not None:
+            self.count('blocks', 'chained', nchained)
+        return True
+
+    def sharedIdPairs (self) :
+        """
+        Returns AB pairs under which features correspond if they have the same ID.
+        """
+        allIds = set([f.ID for f in self.A] + [f.ID for f in self.B])
+        allIds.discard(None) # non-MGI features
+        return [ [i,i] for i in allIds ]
+
+    def readGff (self, fname, jobs=1) :
+        """
+        Reads a GFF3 file. Returns list of features.ProjectedFeature objects, with
+        their IDs and seqids interned (see features.internFeatures).
+        Unless --no-cache is specified, the projected features are loaded from (or saved to)
+        the file's cache, so each file is parsed only once.
+        If jobs is more than 1, an uncached plain file is parsed in that many worker processes.
+        The file is read in the format given by --informat (see features.READERS).
+        """
+        return features.internFeatures(features.load(fname, cache=not self.args.noCache, jobs=jobs,
+            format=self.args.informat))
+
+    def readAB (self, fname) :
+        """
+        Reads the AB file. Returns its list of [aid,bid] pairs, with the IDs interned
+        (see features.internPairs).
+        """
+        return features.internPairs(self.readTsv(fname))
 
     def readTsv (self, fname) :
         """
@@ -185,29 +785,30 @@ class SyntenyBlockGenerator:
                 if len(self.b2a[b]) == 1:
                     ab1_1.append([a,b])
         #
+        self.count('AB', 'read', len(self.AB))
+        self.count('AB', 'oneToOne', len(ab1_1))
         self.AB = ab1_1
         # reindex with just the 1-1's
         self.indexAB()
 
-    def prepGff (self, feats, index) :
+    def prepGff (self, feats, index, name) :
         """
         Filters, sorts, and otherwise modifies the list of GFF3 features
         to the refined list of (feature-like) objects.
         Returns an index from ID to feature-like object.
+        Counts are recorded under the given name ("A" or "B").
         """
         # a. Filter for features whose ID is in the index
+        # (Interned IDs are MGI numbers, or None for non-MGI features.)
         n = len(feats)
-        feats[:] = filter(lambda f: f.ID.startswith("MGI:") and f.ID in index, feats)
+        feats[:] = filter(lambda f: f.ID is not None, feats)
+        dn_mgi = n - len(feats)
+        n = len(feats)
+        feats[:] = filter(lambda f: f.ID in index, feats)
         dn_a = n - len(feats)
 
         # b. Sort by chr+start position.
-        def gffSorter (a, b) :
-            if a.seqid == b.seqid:
-                return cmp(a.start, b.start)
-            else:
-                return cmp(a.seqid, b.seqid)
-        #
-        feats.sort(gffSorter)
+        sortFeatures(feats)
 
         # c. Filter to remove any overlaps between features.
         # IS THIS IMPORTANT??
@@ -224,6 +825,10 @@ class SyntenyBlockGenerator:
         n = len(feats)
         feats[:] = nfs
         dn_c = n - len(feats)
+        self.count(name, 'nonMgi', dn_mgi)
+        self.count(name, 'notInAB', dn_a)
+        self.count(name, 'overlaps', dn_c)
+        self.count(name, 'kept', len(feats))
         
         # d. Number the features, 1, 2, 3... and project just the bits we need
         nfs = []
@@ -266,9 +871,8 @@ class SyntenyBlockGenerator:
     def join (self) :
         """
         Joins the features in A to their corresponding features in B.
-        Generates a list of feature pairs. 
-        Update: add pairs that contain just an A or just a B (to deal with
-        insertions/deletions).
+        Generates a list of feature pairs. (Features with no counterpart become indel blocks,
+        with --indels; see scanWithIndels.)
         """
         self.pairs = []
         for a in self.A:
@@ -284,16 +888,7 @@ class SyntenyBlockGenerator:
               }
             self.pairs.append(pair)
         #
-        '''
-        for b in self.B:
-            bid = b['ID']
-            if not bid in self.b2a:
-                # b outer join row
-                pair = {
-                    'a': self.INSERTED,
-                    'b': b
-                }
-        '''
+        self.count('pairs', 'joined', len(self.pairs))
 
         # the join step may cause genes to drop out, and it is important that the
         # sequence is unbroken for each genome
@@ -302,48 +897,46 @@ class SyntenyBlockGenerator:
     def startBlock(self,pair):
         """
         Starts a new synteny block from the given feature pair.
-        Returns the block, which is a list of 4 values:
-         - Block id (integer) Block ids are assigned starting at 0.
+        Returns the block, a blockfile.Block, which records:
+         - Block id (integer) Block ids are assigned starting at 1.
            They have no meaning outside a given set of results.
-         - Block orientation ("+" or "-") Specifies whether the A and B regions 
+         - Block orientation (+1 or -1) Specifies whether the A and B regions 
            of the block have the same or opposite orientations in their respective genomes.
          - Block count (integer) Records how many a/b feature pairs combined to generate this block
-         - Pair (pair of feaure-like objects) Looks like this: {a:feature,b:feature}.
-           Each feature (-like object) is used to record the chromosome, start, and end of the syntenic
-           region in its genome.
+         - For each genome, the chromosome, start, and end of the syntenic region, and
+           its lowest index.
+         - Where its IDs come from: the pairs from this one on. (They are not copied.)
+        A pair with one side INSERTED starts an indel block; the caller sets its first feature (see scanWithIndels).
         """
         self.nBlocks += 1
-        blockId = self.nBlocks
-        blockCount = 1
-        ori = +1
-        if pair['a'] is self.INSERTED:
-            ids = set([pair['b']['ID']])
-            pcopy = { 'a':self.INSERTED, 'b': pair['b'].copy() }
-        elif pair['b'] is self.INSERTED:
-            ids = set([pair['a']['ID']])
-            pcopy = { 'b':self.INSERTED, 'a': pair['a'].copy() }
-        else:
-            ori = +1 if (pair['a']['strand'] == pair['b']['strand']) else -1
-            ids = set([pair['a']['ID'], pair['b']['ID']])
-            pcopy = pair.copy()
-        return [ blockId, ori, blockCount, pcopy, ids ]
+        a = pair['a']
+        b = pair['b']
+        if a is self.INSERTED:
+            return blockfile.Block(self.nBlocks, +1, 1, None, 0, 0, 0,
+                b['chr'], b['start'], b['end'], b['index'], blockfile.IDS_B, None)
+        if b is self.INSERTED:
+            return blockfile.Block(self.nBlocks, +1, 1, a['chr'], a['start'], a['end'], a['index'],
+                None, 0, 0, 0, blockfile.IDS_A, None)
+        ori = +1 if (a['strand'] == b['strand']) else -1
+        return blockfile.Block(self.nBlocks, ori, 1, a['chr'], a['start'], a['end'], a['index'],
+            b['chr'], b['start'], b['end'], b['index'], blockfile.IDS_PAIRS, a['index'])
 
     def extendBlock(self,currPair,currBlock):
         """
         Extends the given synteny block to include the coordinate
         ranges of the given pair.
         """
-        bname,ori,blockCount,pair,ids = currBlock
-        currBlock[2] = blockCount+1
-        if pair['a'] is not self.INSERTED:
-            pair['a']['start'] = min(pair['a']['start'], currPair['a']['start'])
-            pair['a']['end']   = max(pair['a']['end'],   currPair['a']['end'])
-            ids.add(currPair['a']['ID'])
-        if pair['b'] is not self.INSERTED:
-            pair['b']['start'] = min(pair['b']['start'], currPair['b']['start'])
-            pair['b']['end']   = max(pair['b']['end'],   currPair['b']['end'])
-            pair['b']['index'] = currPair['b']['index']
-            ids.add(currPair['b']['ID'])
+        currBlock.count += 1
+        a = currPair['a']
+        b = currPair['b']
+        if a is not self.INSERTED:
+            currBlock.aStart = min(currBlock.aStart, a['start'])
+            currBlock.aEnd   = max(currBlock.aEnd,   a['end'])
+        if b is not self.INSERTED:
+            currBlock.bStart = min(currBlock.bStart, b['start'])
+            currBlock.bEnd   = max(currBlock.bEnd,   b['end'])
+            if currBlock.ori == -1:
+                currBlock.bIndex = b['index']
 
     def canMerge(self,currPair,currBlock):
         """
@@ -352,83 +945,987 @@ class SyntenyBlockGenerator:
         """
         if currBlock is None:
                     return False
-        bid,ori,bcount,pair,ids = currBlock
+        ori = currBlock.ori
         if currPair['a'] is self.INSERTED or currPair['b'] is self.INSERTED:
             cori = +1
         else:
             cori = 1 if (currPair['a']['strand']==currPair['b']['strand']) else -1
+        # the B index of the block's last pair
+        bLast = currBlock.bIndex + currBlock.count - 1 if ori == 1 else currBlock.bIndex
         return \
-            currPair['a']['chr'] == pair['a']['chr'] \
-            and currPair['b']['chr'] == pair['b']['chr'] \
+            currPair['a']['chr'] == currBlock.aChr \
+            and currPair['b']['chr'] == currBlock.bChr \
             and ori == cori \
-            and (currPair['b'] is self.INSERTED or currPair['b']['index'] == pair['b']['index']+ori)
+            and (currPair['b'] is self.INSERTED or currPair['b']['index'] == bLast+ori)
 
     def generateBlocks (self) :
         """
         Scans the pairs, generating synteny blocks.
+        If blockJobs > 1, the scanning is done in parallel (see generateBlocksParallel).
+        With --indels, indel blocks are generated too, in the same pass (see scanWithIndels).
         """
-        self.blocks = []
+        if self.args.indels:
+            self.blocks = self.scanWithIndels()
+        elif self.blockJobs > 1:
+            self.generateBlocksParallel()
+        else:
+            self.blocks = self.scanPairs(self.pairs)
+        self.count('blocks', 'generated', len(self.blocks))
+
+    def scanPairs (self, pairs) :
+        """
+        Scans the given list of pairs, generating synteny blocks. Returns the list of blocks.
+        """
+        blocks = []
         currBlock = None
-        for currPair in self.pairs:
+        for currPair in pairs:
             if self.canMerge(currPair,currBlock):
                 self.extendBlock(currPair,currBlock)
             else:
                 currBlock = self.startBlock(currPair)
-                self.blocks.append(currBlock)
-            currPair['block'] = currBlock[0]
+                blocks.append(currBlock)
+            currPair['block'] = currBlock.id
+        return blocks
+
+    def scanWithIndels (self) :
+        """
+        Generates the synteny blocks, as scanPairs does, plus the indel blocks (--indels):
+        maximal runs of features, consecutive in their genome and on one chromosome, that are
+        present (kept by prepGff) in only one genome. Such runs are found by an anti-join of each
+        genome's (sorted) features against the pairs sorted the same way: walking the two lists together,
+        a feature that is not the next pair's is unmatched. No IDs are looked up.
+        A's unmatched features (deletions) are found in the same pass over A as the synteny blocks,
+        and their blocks are interleaved with them in A order. B's (insertions) are found in a second
+        pass, over B, and their blocks follow, in B order. The syntenic blocks are the same as without
+        --indels (an indel does not break a synteny block). Unmatched features are not copied:
+        each indel block records the position of its first feature in A (or B).
+        Returns the list of blocks.
+        """
+        blocks = []
+        pairs = self.pairs
+        bOrder = sorted(pairs, key=lambda p: p['b']['index'])
+        #
+        currBlock = None
+        currIndel = None
+        i = 0
+        for j, f in enumerate(self.A):
+            if i < len(pairs) and pairs[i]['a'] is f:
+                p = pairs[i]
+                i += 1
+                if self.canMerge(p, currBlock):
+                    self.extendBlock(p, currBlock)
+                else:
+                    currBlock = self.startBlock(p)
+                    blocks.append(currBlock)
+                p['block'] = currBlock.id
+                currIndel = None
+                continue
+            f['index'] = i
+            p = { 'a' : f, 'b' : self.INSERTED }
+            if currIndel is not None and currIndel.aChr == f['chr']:
+                self.extendBlock(p, currIndel)
+            else:
+                currIndel = self.startBlock(p)
+                currIndel.first = j
+                blocks.append(currIndel)
+        nDeletions = len(blocks)
+        #
+        currIndel = None
+        i = 0
+        for j, f in enumerate(self.B):
+            if i < len(bOrder) and bOrder[i]['b'] is f:
+                i += 1
+                currIndel = None
+                continue
+            f['index'] = i
+            p = { 'a' : self.INSERTED, 'b' : f }
+            if currIndel is not None and currIndel.bChr == f['chr']:
+                self.extendBlock(p, currIndel)
+            else:
+                currIndel = self.startBlock(p)
+                currIndel.first = j
+                blocks.append(currIndel)
+        self.count('blocks', 'deletions', len([ b for b in blocks[:nDeletions] if b.bChr is None ]))
+        self.count('blocks', 'insertions', len(blocks) - nDeletions)
+        return blocks
+
+    def partitionPairs (self) :
+        """
+        Divides the (sorted) pairs into runs having the same A chromosome.
+        Returns a list of (start, end) index ranges into self.pairs.
+        A block never spans a change in aChr (see canMerge), so each run
+        can be scanned independently.
+        """
+        parts = []
+        start = 0
+        for i in xrange(1, len(self.pairs)):
+            if self.pairs[i]['a']['chr'] != self.pairs[i-1]['a']['chr']:
+                parts.append((start, i))
+                start = i
+        if self.pairs:
+            parts.append((start, len(self.pairs)))
+        return parts
+
+    def generateBlocksParallel (self) :
+        """
+        Generates the blocks for each A chromosome in a separate worker process,
+        using up to blockJobs workers. The workers are forked with the pairs already
+        in memory. Afterwards, the blocks are put in A chromosome order and
+        their ids reassigned, so the result is the same as a serial scan.
+        """
+        parts = self.partitionPairs()
+        _partition['sbg'] = self
+        pool = multiprocessing.Pool(min(self.blockJobs, max(1, len(parts))))
+        results = pool.map(_partitionWorker, parts)
+        pool.close()
+        pool.join()
+        del _partition['sbg']
+        #
+        self.blocks = []
+        for blocks in results:
+            for blk in blocks:
+                blk.id = len(self.blocks) + 1
+                self.blocks.append(blk)
+        self.nBlocks = len(self.blocks)
+
+    def chainBlocks (self, blocks, firstId=1) :
+        """
+        Gap-tolerant chaining (--chain-gap K). Strict blocks end wherever the B index
+        sequence breaks, so one missing, misplaced, or locally shuffled gene splits a syntenic
+        region in two. This chains the (strict) blocks, in A order, into larger blocks:
+        a block extends a chain having the same aChr, bChr, and orientation if
+            - at most K A indexes lie between the chain's end and the block's start, and
+            - the block's start in B is within K indexes of the chain's end in B, in the chain's
+              direction (up to K before it is allowed, for local transpositions).
+        The open chains for each (aChr, bChr, ori) are kept sorted by where they end in B,
+        so each block finds its chain by binary search. Since the blocks come in A order, a chain
+        that ends more than K A indexes before a block can never be extended again, and is closed
+        (dropped from the sorted lists). So only the chains ending in the last K or so A indexes are
+        open, and the whole is O(n log n) (for a fixed K), however many chains there are.
+        Returns the list of chained blocks, with ids assigned from firstId. Each lists the strict
+        blocks it contains as its parts (their number is written as nMerged). Indel blocks (--indels) are
+        passed through, unchained.
+        """
+        k = self.args.chainGap
+        chains = []
+        tips = {} # (aChr, bChr, ori) -> sorted list of [tip, chain number]
+        ends = collections.deque() # (aHi, tip entry), for each tip entry added, in the order added
+        aChr = None
+        for blk in blocks:
+            if blk.isIndel():
+                c = blk.copy()
+                c.parts = [ blk ]
+                chains.append({ 'blk' : c })
+                continue
+            if blk.aChr != aChr:
+                # chains never span A chromosomes
+                tips = {}
+                ends.clear()
+                aChr = blk.aChr
+            ori = blk.ori
+            count = blk.count
+            aLo = blk.aIndex
+            bLo = blk.bIndex
+            bHi = bLo + count - 1
+            # close the chains too far behind in A (entries superseded by an extension are just dropped)
+            while ends and aLo - ends[0][0] - 1 > k:
+                aHi, t = ends.popleft()
+                c = chains[t[1]]
+                if c['tip'] is t:
+                    lst = tips[c['key']]
+                    del lst[bisect.bisect_left(lst, t)]
+                    c['tip'] = None
+            # Work in the chain's direction: a chain's tip is its B end (its last B index for "+",
+            # minus its first for "-"), and a block's head is its B start, in the same terms.
+            head = bLo if ori == 1 else -bHi
+            tail = bHi if ori == 1 else -bLo
+            key = (blk.aChr, blk.bChr, ori)
+            lst = tips.setdefault(key, [])
+            # find the open chains whose tip is within k of this block's head
+            i = bisect.bisect_left(lst, [head - k - 1])
+            j = bisect.bisect_right(lst, [head + k])
+            best = None
+            for t in lst[i:j]:
+                c = chains[t[1]]
+                if aLo - c['aHi'] - 1 > k:
+                    continue
+                d = head - t[0] - 1
+                if d > k or d < -k:
+                    continue
+                if best is None or (abs(d), d < 0) < best[0]:
+                    best = ((abs(d), d < 0), t)
+            if best is None:
+                c = {
+                    'blk' : blk.copy(),
+                    'aHi' : aLo + count - 1,
+                    'key' : key,
+                    'tip' : [tail, len(chains)],
+                }
+                c['blk'].parts = [ blk ]
+                chains.append(c)
+                bisect.insort(lst, c['tip'])
+                ends.append((c['aHi'], c['tip']))
+                continue
+            t = best[1]
+            c = chains[t[1]]
+            del lst[bisect.bisect_left(lst, t)]
+            cb = c['blk']
+            cb.count += count
+            cb.aEnd = max(cb.aEnd, blk.aEnd)
+            cb.bStart = min(cb.bStart, blk.bStart)
+            cb.bEnd = max(cb.bEnd, blk.bEnd)
+            cb.bIndex = min(cb.bIndex, bLo)
+            # the chain's ids are its blocks' ids, in the order they are added
+            cb.parts.append(blk)
+            c['aHi'] = aLo + count - 1
+            c['tip'] = [max(t[0], tail), t[1]]
+            bisect.insort(lst, c['tip'])
+            ends.append((c['aHi'], c['tip']))
+        #
+        chained = []
+        for i, c in enumerate(chains):
+            c['blk'].id = firstId + i
+            chained.append(c['blk'])
+        return chained
+
+    def mirrorBlocks (self, blocks) :
+        """
+        Returns the (strict) blocks of the mirrored pair, B-A, given the strict blocks of A-B.
+        A strict block is a maximal run of pairs that are consecutive in both genomes, so the
+        B-A blocks are the same runs: each block's sides are swapped, the blocks are put in B order
+        (by their lowest B index), and their ids are reassigned. A swapped block takes its IDs from the
+        same pairs, in B order (see blockIds). The indexes themselves are unchanged,
+        since renumber numbers each genome's joined features the same way in either direction.
+        (Everything before generateBlocks treats the two genomes alike, except that a second feature
+        with the same ID as another in its genome is joined in one direction only. See verifyMirror.)
+        Indel blocks (--indels) swap sides too: A-B's deletions are B-A's insertions, and vice versa.
+        Since each genome's kept features do not overlap, ordering blocks by A position is the same as by
+        A index, and places the deletions among the synteny blocks as scanWithIndels does; the insertions
+        follow, in B order.
+        """
+        # (the index of the side of an indel block that is present is the number of paired features
+        # before it, in either direction)
+        mirrored = [ blk.swapped() for blk in blocks ]
+        rank = features.CHROMOSOMES.ranks()
+        def position (blk) :
+            if blk.aChr is None:
+                return (1, rank[blk.bChr], blk.bStart)
+            return (0, rank[blk.aChr], blk.aStart)
+        mirrored.sort(key=position)
+        for i, blk in enumerate(mirrored):
+            blk.id = i + 1
+        return mirrored
+
+    def mirrorPair (self) :
+        """
+        Returns the blocks of the mirrored pair, B-A, derived from the A-B blocks just computed,
+        and chained (in B-A order) if --chain-gap is given.
+        """
+        with self.stage('mirrorBlocks'):
+            blocks = self.mirrorBlocks(self.strictBlocks)
+        if self.args.chainGap is not None:
+            with self.stage('chainBlocks.mirror'):
+                blocks = self.chainBlocks(blocks)
+        return blocks
+
+    def writeMirror (self) :
+        """
+        Writes the blocks of the mirrored pair, B-A, to the output. Their number and summary
+        are recorded in self.mirror.
+        """
+        self.mirrored = self.mirrorPair()
+        abSummary = self.summary
+        self.summary = summary.newSummary()
+        with self.stage('writeBlocks.mirror'):
+            self.writeBlocks(self.mirrored)
+        self.mirror = { 'blocks' : len(self.mirrored), 'summary' : self.summary }
+        self.summary = abSummary
+
+    def verifyMirror (self) :
+        """
+        Checks the mirrored blocks against a direct B-A run (--verify-mirror): reads the inputs
+        again, swapped (with the AB pairs swapped), and computes the B-A blocks from scratch.
+        Blocks are compared on every column, taking the ids as sets. Reports on stderr, including
+        the blocks found by only one of the two. Returns True if they are the same.
+        """
+        mirrored = self.mirrored if self.mirrored is not None else self.mirrorPair()
+        d = SyntenyBlockGenerator()
+        d.args = self.args
+        d.profilePrefix = 'direct.'
+        with d.stage('readFiles'):
+            d.A = d.readGff(self.args.fileB)
+            d.B = d.readGff(self.args.fileA)
+            if self.args.fileAB:
+                d.AB = [ [b, a] for a, b in d.readAB(self.args.fileAB) ]
+            else:
+                d.AB = d.sharedIdPairs()
+        d.compute()
+        self.stages += d.stages
+        #
+        # (each generator looks up the IDs of its own blocks)
+        def key (sbg, blk) :
+            r = sbg.blockRow(blk)
+            return tuple(r[1:14]) + (tuple(sorted(r[14].split(','))),) + tuple(r[15:])
+        mkeys = [ key(self, blk) for blk in mirrored ]
+        dkeys = [ key(d, blk) for blk in d.blocks ]
+        if mkeys == dkeys:
+            sys.stderr.write('Mirror verified: the %d B-A blocks derived from A-B are the same as those of a direct B-A run.\n' % len(mkeys))
+            return True
+        onlyM = collections.Counter(mkeys) - collections.Counter(dkeys)
+        onlyD = collections.Counter(dkeys) - collections.Counter(mkeys)
+        if not (onlyM or onlyD):
+            sys.stderr.write('Mirror differs from a direct B-A run: the same %d blocks, in a different order.\n' % len(mkeys))
+            return False
+        sys.stderr.write('Mirror differs from a direct B-A run: %d of %d derived blocks are not in the direct run, and %d of %d direct blocks are not derived.\n' % (
+            sum(onlyM.values()), len(mkeys), sum(onlyD.values()), len(dkeys)))
+        for label, blks in [('derived only', onlyM), ('direct only', onlyD)]:
+            for k in sorted(blks, key=lambda k: (k[3], k[7]))[:10]:
+                # k is the row less its blockId: count, ori, ratio, aChr, bChr, aLength, bLength, aStart, bStart, aEnd, bEnd, ...
+                sys.stderr.write('    %s: %s:%d-%d %s %s:%d-%d (%d pairs)\n' % (label, k[3], k[7], k[9], k[1], k[4], k[8], k[10], k[0]))
+            if len(blks) > 10:
+                sys.stderr.write('    ... and %d more\n' % (len(blks) - 10))
+        dups = [ (name, len(feats) - len(set([ f['ID'] for f in feats ])))
+            for name, feats in [('B', d.A), ('A', d.B)] if feats and isinstance(feats[0], dict) ]
+        for name, n in dups:
+            if n:
+                sys.stderr.write('    %s: %d kept feature(s) share an ID with another feature, and are joined in one direction only.\n' % (name, n))
+        return False
 
     def writePairs (self) :
         for p in self.pairs:
             a = p['a']
             b = p['b']
-            r = [ a['index'], b['index'], a['ID'], a['chr'], a['start'], a['end'], a['strand'], b['ID'], b['chr'], b['start'], b['end'], b['strand'] ]
-            sys.stdout.write('# ' + '\t'.join([ str(x) for x in r ]) + '\n')
-
-    def writeBlocks(self):
-        """
-        Writes the blocks to stdout.
-        """
-        b = [
-              "blockId",
-              "blockCount",
-              "blockOri",
-              "blockRatio",
-              "aChr",
-              "bChr",
-              "aLength",
-              "bLength",
-              "aStart",
-              "bStart",
-              "aEnd",
-              "bEnd",
-              "aIndex",
-              "bIndex",
-              "ids",
-            ]
-        sys.stdout.write( '\t'.join(map(lambda x:str(x),b)) + '\n' )
-        for block in self.blocks:
-            blkid, ori, blkcount, fields, ids = block
-            alen = fields['a']['end']-fields['a']['start']+1
-            blen = fields['b']['end']-fields['b']['start']+1
-            blkRatio = (1.0 * min(alen,blen)) / max(alen,blen);
-            r = [
-              blkid,
-              blkcount,
-              (ori==1 and "+" or "-"),
-              "%1.2f"%blkRatio,
-              fields['a']['chr'],
-              fields['b']['chr'],
-              fields['a']['end']-fields['a']['start']+1,
-              fields['b']['end']-fields['b']['start']+1,
-              fields['a']['start'],
-              fields['b']['start'],
-              fields['a']['end'],
-              fields['b']['end'],
-              fields['a']['index'],
-              fields['b']['index'] - (blkcount-1 if ori == 1 else 0),
-              ','.join(ids),
-            ]
-            sys.stdout.write( '\t'.join(map(lambda x:str(x),r)) + '\n' )
+            r = [ a['index'], b['index'],
+                features.mgiId(a['ID']), features.CHROMOSOMES.name(a['chr']), a['start'], a['end'], a['strand'],
+                features.mgiId(b['ID']), features.CHROMOSOMES.name(b['chr']), b['start'], b['end'], b['strand'] ]
+            self.ofd.write('# ' + '\t'.join([ str(x) for x in r ]) + '\n')
+
+    def writeBlocks(self, blocks=None):
+        """
+        Writes the given blocks (default: self.blocks) to the output (stdout, by default).
+        """
+        self.writeHeader()
+        for block in (self.blocks if blocks is None else blocks):
+            self.writeBlock(block)
+
+    def writeHeader (self) :
+        """
+        Writes the column header line of the block file.
+        """
+        b = blockfile.TSV_COLUMNS
+        if self.args.chainGap is not None:
+            b = b + ['nMerged']
+        self.ofd.write( '\t'.join(map(lambda x:str(x),b)) + '\n' )
+
+    def writeBlock (self, block) :
+        """
+        Writes one block as a line of the block file.
+        With --ids ranges, the ids of a block whose IDs follow from its index ranges are left empty
+        (see blockfile.py), and are looked up only if the row is also kept (for --binary or --lod).
+        """
+        ranged = self.args.ids == 'ranges' and block.isRange()
+        r = self.blockRow(block, not ranged or self.blockRows is not None)
+        w = r[:14] + [''] + r[15:] if ranged else r
+        self.ofd.write( '\t'.join(map(lambda x:str(x),w)) + '\n' )
+        summary.add(self.summary, r)
+        if self.blockRows is not None:
+            self.blockRows.append(r)
+
+    def blockRow (self, block, withIds=True) :
+        """
+        Returns the values of the block file columns for one block.
+        The ids are looked up (see blockIds) only if withIds is True; otherwise they are empty.
+        """
+        if block.isIndel():
+            return self.indelRow(block, withIds)
+        alen = block.aEnd-block.aStart+1
+        blen = block.bEnd-block.bStart+1
+        blkRatio = (1.0 * min(alen,blen)) / max(alen,blen);
+        chrName = features.CHROMOSOMES.name
+        r = [
+          block.id,
+          block.count,
+          (block.ori==1 and "+" or "-"),
+          "%1.2f"%blkRatio,
+          chrName(block.aChr),
+          chrName(block.bChr),
+          alen,
+          blen,
+          block.aStart,
+          block.bStart,
+          block.aEnd,
+          block.bEnd,
+          block.aIndex,
+          block.bIndex,
+          ','.join(map(features.mgiId, self.blockIds(block))) if withIds else '',
+        ]
+        if block.parts is not None:
+            r.append(len(block.parts))
+        return r
+
+    def indelRow (self, block, withIds=True) :
+        """
+        Returns the values of the block file columns for one indel block (--indels).
+        The missing side has an empty chromosome and zero length, start, end, and index,
+        so the block ratio is 0.00. The other side's index is the number of paired features before the block.
+        """
+        cols = {}
+        for s, chr, start, end, index in [
+                ('a', block.aChr, block.aStart, block.aEnd, block.aIndex),
+                ('b', block.bChr, block.bStart, block.bEnd, block.bIndex)]:
+            if chr is None:
+                cols[s] = ('', 0, 0, 0, 0)
+            else:
+                cols[s] = (features.CHROMOSOMES.name(chr), end-start+1, start, end, index)
+        a = cols['a']
+        b = cols['b']
+        r = [ block.id, block.count, "+", "0.00", a[0], b[0], a[1], b[1], a[2], b[2], a[3], b[3], a[4], b[4],
+            ','.join(map(features.mgiId, self.blockIds(block))) if withIds else '' ]
+        if block.parts is not None:
+            r.append(len(block.parts))
+        return r
+
+    def blockIds (self, block) :
+        """
+        Returns the IDs of the given block's features, in genomic order (of its A side), each once.
+        They are looked up from where the block says they are (see blockfile.Block): for pairs,
+        each pair's A ID, then its B ID (the same, unless there is an AB file). A chained block's
+        are those of its parts, in order.
+        """
+        if block.parts is not None:
+            ids = []
+            for p in block.parts:
+                ids += self.blockIds(p)
+        elif block.source == blockfile.IDS_A:
+            ids = [ f['ID'] for f in self.A[block.first:block.first+block.count] ]
+        elif block.source == blockfile.IDS_B:
+            ids = [ f['ID'] for f in self.B[block.first:block.first+block.count] ]
+        else:
+            aIds, bIds, bIndex = self.getPairIds()
+            lo = block.first - self.pairsBase
+            hi = lo + block.count
+            # a mirrored block's A side is B, whose order is the reverse of A's in a "-" block
+            rev = block.source == blockfile.IDS_SWAPPED and block.ori == -1
+            first, second = (bIds, aIds) if block.source == blockfile.IDS_SWAPPED else (aIds, bIds)
+            ids = first[lo:hi]
+            if second is not first:
+                ids = [ x for pair in zip(ids, second[lo:hi]) for x in pair ]
+            if rev:
+                ids.reverse()
+                if second is not first:
+                    # keep each pair's IDs in order
+                    ids[0::2], ids[1::2] = ids[1::2], ids[0::2]
+        if len(set(ids)) == len(ids):
+            return ids
+        seen = set()
+        return [ x for x in ids if not (x in seen or seen.add(x)) ]
+
+    def getPairIds (self) :
+        """
+        Returns (A IDs, B IDs, B indexes) of the pairs, as lists in A order (built from
+        self.pairs the first time; the numpy engine sets them directly). If every pair's A and B IDs
+        are the same (as without an AB file), the B IDs are the A IDs list itself.
+        """
+        if self.pairIds is None:
+            a = map(operator.itemgetter('a'), self.pairs)
+            b = map(operator.itemgetter('b'), self.pairs)
+            aIds = map(operator.itemgetter('ID'), a)
+            bIds = map(operator.itemgetter('ID'), b)
+            self.pairIds = (aIds, aIds if aIds == bIds else bIds, map(operator.itemgetter('index'), b))
+        return self.pairIds
+
+    def writeRangeIds (self, base, mirrored=False) :
+        """
+        With --ids ranges, writes the A and B ID files for the block file named base (less its
+        extension; see blockfile.rangeIdsPaths): the IDs of each genome's paired features, in index order.
+        If mirrored, for the mirrored pair (B-A), so the genomes are swapped.
+        """
+        if self.args.ids != 'ranges':
+            return
+        aIds, bIds, bIndex = self.getPairIds()
+        bOrdered = [ None ] * len(bIds)
+        for k, i in enumerate(bIndex):
+            bOrdered[i] = bIds[k]
+        lists = [ bOrdered, aIds ] if mirrored else [ aIds, bOrdered ]
+        for fname, ids in zip(blockfile.rangeIdsPaths(base), lists):
+            fd = open(tmpName(fname), 'w')
+            fd.write(''.join([ features.mgiId(x) + '\n' for x in ids ]))
+            fd.close()
+            os.rename(tmpName(fname), fname)
+
+    def readStrainList (self, fname) :
+        """
+        Reads a list of strain names, one per line. Blank lines and a
+        "strain" header line (as in output/strainList.tsv) are skipped.
+        """
+        strains = []
+        for row in self.readTsv(fname):
+            s = row[0].strip()
+            if s and s != "strain":
+                strains.append(s)
+        return strains
+
+    def outputOptions (self) :
+        """
+        Returns a dict of the options that affect the contents of the block files.
+        (The engine and -j do not.) Recorded in the batch manifest.
+        """
+        opts = {}
+        if self.args.binary:
+            opts['binary'] = True
+        if self.args.lod:
+            opts['lod'] = self.args.lod
+        if self.args.chainGap is not None:
+            opts['chainGap'] = self.args.chainGap
+        if self.args.indels:
+            opts['indels'] = True
+        if self.args.ids != 'inline':
+            opts['ids'] = self.args.ids
+        return opts
+
+    def outputFiles (self, ofname) :
+        """
+        Returns the names of the files batch mode writes for the pair whose TSV block file is ofname.
+        """
+        fnames = [ ofname ]
+        if self.args.binary:
+            fnames.append(blkName(ofname))
+        for res in self.args.lod or []:
+            fnames.append(lod.levelName(ofname, res))
+        if self.args.ids == 'ranges':
+            fnames += blockfile.rangeIdsPaths(os.path.splitext(ofname)[0])
+        return fnames
+
+    def readManifest (self) :
+        """
+        Reads the batch manifest from the output directory. Returns a dict from
+        pair name ("A-B") to manifest entry. Returns an empty dict if there is no manifest.
+        """
+        fname = os.path.join(self.args.outdir, MANIFEST)
+        if not os.path.exists(fname):
+            return {}
+        fd = open(fname, 'r')
+        m = json.load(fd)
+        fd.close()
+        return m.get('pairs', {})
+
+    def writeManifest (self, entries) :
+        """
+        Writes the batch manifest (atomically) to the output directory.
+        """
+        fname = os.path.join(self.args.outdir, MANIFEST)
+        tmp = tmpName(fname)
+        fd = open(tmp, 'w')
+        json.dump({ 'version' : VERSION, 'pairs' : entries }, fd, indent=1, sort_keys=True)
+        fd.write('\n')
+        fd.close()
+        os.rename(tmp, fname)
+
+    def goBatch (self) :
+        """
+        Batch mode. Reads and sorts the features for each strain exactly once, then
+        generates the blocks for every ordered pair of strains using a pool of
+        worker processes. The workers are forked after the genomes are loaded,
+        so they share the parsed features rather than receiving a pickled copy per pair.
+        Pairs whose inputs are unchanged since the last run (per the manifest) are skipped.
+        With --mirror, each unordered pair of strains is computed once, writing both A-B and B-A.
+        The summary statistics of every pair are written to OUTDIR/summary.json and summary.tsv (see summary.py).
+        """
+        t0 = time.time()
+        strains = self.readStrainList(self.args.strainList)
+        if not os.path.isdir(self.args.outdir):
+            os.makedirs(self.args.outdir)
+        #
+        # Decide which pairs need computing.
+        ext = features.FORMAT_EXTS[self.args.informat or 'gff3']
+        fnames = dict([ (s, os.path.join(self.args.datadir, s + ext)) for s in strains ])
+        digests = dict([ (s, features.contentDigest(fnames[s])) for s in strains ])
+        abDigest = features.contentDigest(self.args.fileAB) if self.args.fileAB else None
+        manifest = {} if self.args.force else self.readManifest()
+        entries = {}
+        tasks = []
+        for a in strains:
+            for b in strains:
+                if a == b and self.args.skipSelf:
+                    continue
+                name = '%s-%s' % (a, b)
+                ofname = os.path.join(self.args.outdir, name + '.tsv')
+                entries[name] = {
+                    'A' : digests[a],
+                    'B' : digests[b],
+                    'AB' : abDigest,
+                    'version' : VERSION,
+                    'options' : self.outputOptions(),
+                }
+                if manifest.get(name) != entries[name] \
+                or [ f for f in self.outputFiles(ofname) if not os.path.exists(f) ]:
+                    tasks.append((a, b, ofname, None))
+        if self.args.mirror:
+            # compute each unordered pair once (as A-B, A before B in the strain list), if either direction is needed
+            needed = set([ (a, b) for a, b, ofname, m in tasks ])
+            tasks = []
+            for i, a in enumerate(strains):
+                for b in strains[i:]:
+                    if (a, b) in needed or (b, a) in needed:
+                        mofname = os.path.join(self.args.outdir, '%s-%s.tsv' % (b, a)) if a != b else None
+                        tasks.append((a, b, os.path.join(self.args.outdir, '%s-%s.tsv' % (a, b)), mofname))
+        npairs = len(entries)
+        stale = set()
+        for a, b, ofname, mofname in tasks:
+            stale.add('%s-%s' % (a, b))
+            if mofname:
+                stale.add('%s-%s' % (b, a))
+        sys.stderr.write("%d of %d pairs to compute.\n" % (len(stale), npairs))
+        self.count('pairs', 'total', npairs)
+        self.count('pairs', 'computed', len(stale))
+        #
+        # The entries of the pairs that are current (plus any not part of this run).
+        done = dict(manifest)
+        for name in entries:
+            if name in stale:
+                done.pop(name, None)
+            else:
+                done[name] = entries[name]
+        #
+        # The summaries of the pairs that are current. Those of the pairs to compute are dropped
+        # (and the summary files rewritten) first, so an interrupted run cannot leave a stale one.
+        summaries = summary.readTsv(os.path.join(self.args.outdir, summary.SUMMARY_TSV))
+        summaries = dict([ (n, s) for n, s in summaries.items() if n in done and n in entries ])
+        summary.write(self.args.outdir, strains, summaries)
+        #
+        genomes = {}
+        for s in strains:
+            cname = os.path.join(self.args.outdir, s + '.chrs.tsv')
+            if not [ t for t in tasks if s in t[0:2] ] and os.path.exists(cname):
+                continue
+            fname = fnames[s]
+            sys.stderr.write("Reading %s\n" % fname)
+            with self.stage('load.' + s):
+                feats = self.readGff(fname, jobs=self.args.jobs or multiprocessing.cpu_count())
+                # Sorting now means the sort in prepGff (on a filtered copy) is nearly free.
+                sortFeatures(feats)
+            self.count('load', s, len(feats))
+            features.writeChromosomeManifest(cname, features.chromosomeSummary(feats))
+            genomes[s] = feats
+        AB = self.readAB(self.args.fileAB) if self.args.fileAB else None
+        _batch['genomes'] = genomes
+        _batch['AB'] = AB
+        _batch['args'] = self.args
+        #
+        jobs = self.args.jobs or multiprocessing.cpu_count()
+        if jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(jobs)
+            results = pool.imap_unordered(_batchWorker, tasks)
+        else:
+            pool = None
+            results = (_batchWorker(t) for t in tasks)
+        pairMetrics = {}
+        for i,(a,b,nBlocks,metrics) in enumerate(results):
+            name = '%s-%s' % (a,b)
+            names = [ name ]
+            if 'mirror' in metrics:
+                sys.stderr.write("[%d/%d] %s-%s: %d blocks (%s-%s: %d blocks)\n" % (i+1, len(tasks), a, b, nBlocks, b, a, metrics['mirror']['blocks']))
+                names.append('%s-%s' % (b,a))
+                summaries[names[1]] = metrics['mirror']['summary']
+            else:
+                sys.stderr.write("[%d/%d] %s-%s: %d blocks\n" % (i+1, len(tasks), a, b, nBlocks))
+            pairMetrics[name] = metrics
+            summaries[name] = metrics['summary']
+            # record each pair as it completes, so an interrupted run loses nothing
+            for n in names:
+                if n in entries:
+                    done[n] = entries[n]
+            self.writeManifest(done)
+        if pool:
+            pool.close()
+            pool.join()
+        self.writeManifest(done)
+        # pairs computed before there was a summary (or whose summary was lost) are summarized from their block files
+        for name in entries:
+            if name not in summaries:
+                summaries[name] = summary.summarizeFile(os.path.join(self.args.outdir, name + '.tsv'))
+        summary.write(self.args.outdir, strains, summaries)
+        if self.args.metrics:
+            self.writeMetrics(self.args.metrics, {
+                'load' : {
+                    'stages' : self.stages,
+                    'counts' : self.counts.get('load', {}),
+                },
+                'pairs' : pairMetrics,
+                'counts' : self.counts.get('pairs', {}),
+                'jobs' : jobs,
+                'seconds' : round(time.time() - t0, 6),
+            })
+        #
+        fname = os.path.join(self.args.outdir, 'strainList.tsv')
+        fd = open(tmpName(fname), 'w')
+        fd.write('strain\n')
+        for s in strains:
+            fd.write(s + '\n')
+        fd.close()
+        os.rename(tmpName(fname), fname)
+
+    def goOneVsMany (self) :
+        """
+        One-vs-many mode (-B with several files). Reads the reference genome (A) once and,
+        for the python engine, prepares it once: the AB file is filtered to its 1:1 pairs, and the
+        reference features are filtered, sorted, de-overlapped, and projected. (None of this depends
+        on the partner: without an AB file, every ID corresponds to itself.) Each partner then needs only
+        its own preparation, the join, and block generation. The workers are forked with the
+        prepared reference in memory. With --mirror, OUTDIR/<B>-<A>.tsv is also written for each partner.
+        """
+        t0 = time.time()
+        if not os.path.isdir(self.args.outdir):
+            os.makedirs(self.args.outdir)
+        ref = genomeName(self.args.fileA)
+        tasks = []
+        for fname in self.args.filesB:
+            ofname = os.path.join(self.args.outdir, '%s-%s.tsv' % (ref, genomeName(fname)))
+            if ofname in [ t[1] for t in tasks ]:
+                self.parser.error('Two -B files would both be written to %s.' % ofname)
+            mofname = None
+            if self.args.mirror and genomeName(fname) != ref:
+                mofname = os.path.join(self.args.outdir, '%s-%s.tsv' % (genomeName(fname), ref))
+            tasks.append((fname, ofname, mofname))
+        #
+        with self.stage('readFiles'):
+            self.A = self.readGff(self.args.fileA, jobs=self.args.jobs or multiprocessing.cpu_count())
+            if self.args.fileAB:
+                self.AB = self.readAB(self.args.fileAB)
+        self.count('A', 'read', len(self.A))
+        if self.args.engine == 'python':
+            if self.args.fileAB:
+                with self.stage('prepAB'):
+                    self.prepAB()
+            else:
+                self.a2b = self.b2a = SharedIds()
+            with self.stage('prepGff.A'):
+                self.prepGff(self.A, self.a2b, 'A')
+            self.aPrepared = True
+        _oneVsMany['sbg'] = self
+        #
+        jobs = self.args.jobs or multiprocessing.cpu_count()
+        if jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(tasks)))
+            results = pool.imap_unordered(_oneVsManyWorker, tasks)
+        else:
+            pool = None
+            results = (_oneVsManyWorker(t) for t in tasks)
+        pairMetrics = {}
+        for i,(name,nBlocks,metrics) in enumerate(results):
+            if 'mirror' in metrics:
+                sys.stderr.write("[%d/%d] %s: %d blocks (mirror: %d blocks)\n" % (i+1, len(tasks), name, nBlocks, metrics['mirror']['blocks']))
+            else:
+                sys.stderr.write("[%d/%d] %s: %d blocks\n" % (i+1, len(tasks), name, nBlocks))
+            pairMetrics[name] = metrics
+        if pool:
+            pool.close()
+            pool.join()
+        del _oneVsMany['sbg']
+        if self.args.metrics:
+            self.writeMetrics(self.args.metrics, {
+                'reference' : {
+                    'A' : self.args.fileA,
+                    'stages' : self.stages,
+                    'counts' : self.counts,
+                },
+                'pairs' : pairMetrics,
+                'jobs' : jobs,
+                'seconds' : round(time.time() - t0, 6),
+            })
+
+    def writePairFiles (self, ofname, compute, mirrored=False) :
+        """
+        Calls compute(), which writes the blocks to self.ofd, with self.ofd set to the named
+        block file. Then writes the binary block file, coarsened levels, and range ID files, if requested
+        (the last for the mirrored pair, if mirrored). Used by batch and one-vs-many modes.
+        """
+        # write to a temporary file, so the viewer never sees a partial file
+        self.ofd = open(tmpName(ofname), 'w')
+        if self.args.binary or self.args.lod:
+            self.blockRows = []
+        compute()
+        self.ofd.close()
+        os.rename(tmpName(ofname), ofname)
+        if self.args.binary:
+            with self.stage('writeBinary'):
+                blockfile.write(blkName(ofname), self.blockRows)
+        if self.args.lod:
+            with self.stage('writeLevels'):
+                lod.writeLevels(ofname, self.blockRows, self.args.lod, self.args.binary)
+        self.writeRangeIds(os.path.splitext(ofname)[0], mirrored)
+
+#
+def sortFeatures (feats) :
+    """
+    Sorts a list of (interned) features by chr+start position, with chromosomes in order of name.
+    """
+    rank = features.CHROMOSOMES.ranks()
+    feats.sort(key=lambda f: (rank[f.seqid], f.start))
+
+#
+class SharedIds (object) :
+    """
+    Stands in for the a2b and b2a indexes when there is no AB file:
+    every ID corresponds to itself.
+    """
+    def __contains__ (self, id) :
+        return True
+
+    def get (self, id, default=None) :
+        return [id]
+
+#
+# The peak RSS of each stage. On Linux, the process's high-water mark (VmHWM) is reset to the
+# current RSS at the start of each stage, so a stage's peak is its own, not that of whatever the
+# process did before it (e.g. the earlier pairs computed by a pool worker). Stages may nest: the
+# enclosing stages' peaks so far are kept on _rssPeaks while an inner stage runs. Elsewhere, the
+# peak is the process's lifetime peak (ru_maxrss).
+_rssPeaks = []
+
+def readRssPeak () :
+    """
+    Returns the process's peak RSS in KB, since the last reset if it can be reset.
+    """
+    try:
+        fd = open('/proc/self/status', 'r')
+        try:
+            for line in fd:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+        finally:
+            fd.close()
+    except (IOError, OSError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def resetRssPeak () :
+    """
+    Resets the process's peak RSS to its current RSS, if possible.
+    """
+    try:
+        fd = open('/proc/self/clear_refs', 'w')
+        try:
+            fd.write('5')
+        finally:
+            fd.close()
+    except (IOError, OSError):
+        pass
+
+def startRssPeak () :
+    """
+    Starts measuring the peak RSS of a stage.
+    """
+    if _rssPeaks:
+        _rssPeaks[-1] = max(_rssPeaks[-1], readRssPeak())
+    resetRssPeak()
+    _rssPeaks.append(0)
+
+def endRssPeak () :
+    """
+    Ends measuring the peak RSS of the innermost stage. Returns it in KB.
+    """
+    peak = max(_rssPeaks.pop(), readRssPeak())
+    if _rssPeaks:
+        _rssPeaks[-1] = max(_rssPeaks[-1], peak)
+    return peak
+
+#
+def tmpName (fname) :
+    """
+    Returns the temporary name under which to write the named file
+    before renaming it into place.
+    """
+    return '%s.%d.tmp' % (fname, os.getpid())
+
+def genomeName (fname) :
+    """
+    Returns the name of the genome in the named file: its base name, less the extension
+    (and less features.CACHE_EXT, for a projected feature file).
+    """
+    if fname.endswith(features.CACHE_EXT):
+        fname = fname[:-len(features.CACHE_EXT)]
+    return os.path.splitext(os.path.basename(fname))[0]
+
+def blkName (fname) :
+    """
+    Returns the name of the binary block file (--binary) written alongside the named TSV block file.
+    """
+    return os.path.splitext(fname)[0] + blockfile.BLK_EXT
+
+#
+# Batch mode state. Set in the parent process before the worker pool is
+# created, so forked workers inherit the parsed genomes.
+_batch = {}
+
+def _batchWorker (task) :
+    """
+    Generates the blocks for one (A, B) pair of strains in batch mode, and those of (B, A)
+    if the task names a mirror file. Returns (A, B, number of blocks, metrics).
+    """
+    a, b, ofname, mofname = task
+    sbg = SyntenyBlockGenerator()
+    sbg.args = _batch['args']
+    sbg.profilePrefix = '%s-%s.' % (a, b)
+    sbg.writePairFiles(ofname, lambda: sbg.goPair(_batch['genomes'][a], _batch['genomes'][b], _batch['AB']))
+    if mofname:
+        sbg.writePairFiles(mofname, sbg.writeMirror, True)
+    metrics = sbg.getMetrics()
+    metrics['A'] = a
+    metrics['B'] = b
+    return (a, b, len(sbg.blocks), metrics)
+
+#
+# One-vs-many mode state. Set in the parent process before the worker pool is
+# created, so forked workers inherit the prepared reference genome.
+_oneVsMany = {}
+
+def _oneVsManyWorker (task) :
+    """
+    Generates the blocks of the reference genome against one partner in one-vs-many mode,
+    and those of the partner against the reference if the task names a mirror file. Returns (pair name, number of blocks, metrics).
+    """
+    fname, ofname, mofname = task
+    ref = _oneVsMany['sbg']
+    name = os.path.splitext(os.path.basename(ofname))[0]
+    sbg = SyntenyBlockGenerator()
+    sbg.args = ref.args
+    sbg.profilePrefix = name + '.'
+    def compute () :
+        with sbg.stage('readFiles'):
+            B = sbg.readGff(fname)
+        if not ref.aPrepared:
+            sbg.goPair(ref.A, B, ref.AB)
+            return
+        # join and renumber modify the features, so each partner gets its own copies
+        sbg.A = [ dict(a) for a in ref.A ]
+        sbg.B = B
+        sbg.a2b = ref.a2b
+        sbg.b2a = ref.b2a
+        sbg.aPrepared = True
+        sbg.count('B', 'read', len(B))
+        sbg.compute()
+        with sbg.stage('writeBlocks'):
+            sbg.writeBlocks()
+    sbg.writePairFiles(ofname, compute)
+    if mofname:
+        sbg.writePairFiles(mofname, sbg.writeMirror, True)
+    metrics = sbg.getMetrics()
+    metrics['B'] = fname
+    return (name, len(sbg.blocks), metrics)
+
+#
+# Per-chromosome block generation state. Set in the parent process before
+# the worker pool is created, so forked workers inherit the pairs.
+_partition = {}
+
+def _partitionWorker (part) :
+    """
+    Generates the blocks for one range of pairs. Returns the list of blocks.
+    (Blocks refer to their pairs by A index, so the parent can look up their IDs.)
+    """
+    sbg = _partition['sbg']
+    return sbg.scanPairs(sbg.pairs[part[0]:part[1]])
 
 #
 def main () :
@@ -436,4 +1933,5 @@ def main () :
     sbg.go()
 
 #
-main()
+if __name__ == "__main__":
+    main()
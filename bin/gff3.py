@@ -57,6 +57,10 @@ import sys
 import types
 import urllib
 import re
+import os
+import multiprocessing
+import cStringIO
+import bgzf
 
 #----------------------------------------------------
 HEADER = '##gff-version 3\n'
@@ -65,6 +69,7 @@ C9SEP = ';'
 QUOTECHARS_RE = re.compile(r'[\t\n\r;=%&,]')
 COMMENT_CHAR = '#'
 GROUPSEP = "###\n"
+CHUNK_BYTES = 16 << 20	# target size of the byte ranges parsed by iterateParallel
 
 #----------------------------------------------------
 HASH	= '#'
@@ -161,30 +166,176 @@ class Feature(types.ListType):
     def __str__(self):
 	return format(self)
 
+#----------------------------------------------------
+#
+# A faster, lighter weight alternative to Feature, for reading
+# large files. A LazyFeature stores the 8 standard fields in
+# fixed slots and keeps column 9 as the raw string until
+# its attributes are actually used. Reading f.ID extracts just
+# the ID from the raw string, without building the attribute dict.
+#
+# LazyFeatures support the same access as Features: f.seqid, f.ID,
+# f[3], f[0:4], f.attributes, str(f), etc., and can be passed to format().
+# Column 9 attributes other than ID can be set through f.attributes.
+# Unlike Feature, assigning to f.start or f.end does not convert
+# the value to an int.
+#
+# Created by iterate(input, lazy=True), or directly:
+#       LazyFeature()           every field ".", no attributes
+#       LazyFeature(line)       parses a line from a GFF file
+#
+class LazyFeature(object):
+
+    __slots__ = Feature.fields[:8] + ['_c9', '_attrs', 'ID']
+
+    #
+    def __init__(self, line=None):
+	if line is None:
+	    self.seqid = self.source = self.type = self.start = self.end \
+	      = self.score = self.strand = self.phase = "."
+	    self._c9 = "."
+	    self._attrs = {}
+	    return
+	tokens = line.split(TAB)
+	if len(tokens) != 9:
+	    raise ParseError("Wrong number of columns (%d)\n%s" % (len(tokens),line))
+	self.seqid, self.source, self.type, start, end, \
+	    self.score, self.strand, self.phase, c9 = tokens
+	self.start = int(start) if start != "." else start
+	self.end = int(end) if end != "." else end
+	self._c9 = c9[:-1] if c9[-1:] == NL else c9
+	self._attrs = None
+
+    # Called only for names that are not (yet) set slots: ID and the
+    # other column 9 attributes.
+    def __getattr__(self, name):
+	if name == "ID" and self._attrs is None:
+	    v = extractID(self._c9)
+	    if v is None:
+		raise AttributeError(name)
+	    self.ID = v
+	    return v
+	v = self.attributes.get(name,None)
+	if v is None:
+	    raise AttributeError(name)
+	return v
+
+    # The attribute dict, parsed from column 9 on first use.
+    # A pending assignment to f.ID is folded into the dict.
+    def _getAttributes(self):
+	d = self._attrs
+	if d is None:
+	    d = self._attrs = parseColumn9(self._c9)
+	try:
+	    d["ID"] = _LAZY_ID.__get__(self, LazyFeature)
+	    _LAZY_ID.__delete__(self)
+	except AttributeError:
+	    pass
+	return d
+
+    def _setAttributes(self, d):
+	try:
+	    _LAZY_ID.__delete__(self)
+	except AttributeError:
+	    pass
+	self._attrs = dict(d)
+
+    attributes = property(_getAttributes, _setAttributes)
+
+    def __getitem__(self, i):
+	if type(i) is types.SliceType:
+	    return [ self[j] for j in range(9)[i] ]
+	return getattr(self, Feature.fields[i])
+
+    def __setitem__(self, i, v):
+	setattr(self, Feature.fields[i], v)
+
+    def __len__(self):
+	return 9
+
+    def __iter__(self):
+	for i in range(9):
+	    yield self[i]
+
+    def __hash__(self):
+	return hash(getattr(self, "ID", None))
+
+    def __str__(self):
+	return format(self)
+
+    # Pickling support (e.g., for passing LazyFeatures between
+    # processes). The ID slot is saved only if it is set.
+    def __getstate__(self):
+	try:
+	    ID = _LAZY_ID.__get__(self, LazyFeature)
+	except AttributeError:
+	    ID = None
+	return tuple(self[0:8]) + (self._c9, self._attrs, ID)
+
+    def __setstate__(self, state):
+	self.seqid, self.source, self.type, self.start, self.end, \
+	    self.score, self.strand, self.phase, self._c9, self._attrs, ID = state
+	if ID is not None:
+	    self.ID = ID
+
+_LAZY_ID = LazyFeature.ID
+
+#----------------------------------------------------
+#
+# Returns the value of the ID attribute in an unparsed column 9
+# string, or None if there is no ID. Only falls back to a full
+# parse if the value needs unquoting or is multi-valued.
+#
+def extractID(c9):
+    if c9.startswith("ID="):
+	i = 3
+    else:
+	i = c9.find(";ID=")
+	if i == -1:
+	    if "ID" in c9:
+		return parseColumn9(c9).get("ID",None)
+	    return None
+	i += 4
+    j = c9.find(SEMI, i)
+    v = c9[i:] if j == -1 else c9[i:j]
+    if "%" in v or COMMA in v or v != v.strip():
+	return parseColumn9(c9).get("ID",None)
+    return v
+
 #----------------------------------------------------
 # A very simple file iterator that yields a sequence
 # of GFF3 Features. 
 #
 # Args:
 #  input (file name or open file) If file name is "-", reads
-#	from standard input.
+#	from standard input. A named file may be plain, gzip, or
+#	BGZF compressed (see bgzf.py).
 #  returnGroups (boolean) If True, groups Features into lists
 #	before yielding. This only makes sense if the GFF3 file
 #	uses the "###" construct. (See GFF3 spec.) If False,
 #	(the default), yields each Feature individually.
+#  lazy (boolean) If True, yields LazyFeatures rather than
+#	Features. Much faster when only a few attributes are used.
+#  region (string) If given, e.g. "1" or "1:1000000-2000000", yields
+#	only the features in that region. A named plain or BGZF file that is
+#	sorted by position is read through its region index, so only the
+#	region is read. (See bgzf.regionLines.)
 #
-def iterate(input, returnGroups=False):
+def iterate(input, returnGroups=False, lazy=False, region=None):
     #
     # Set up the input
     #
     closeit = False
-    if type(input) is types.StringType:
+    if region is not None:
+	input = bgzf.regionLines(input, region)
+    elif type(input) is types.StringType:
 	if input=="-":
 	    input = sys.stdin
 	else:
-	    input = open(input, 'r')
+	    input = bgzf.openText(input)
 	    closeit = True
     group = []
+    cls = LazyFeature if lazy else Feature
     #
     # Iterate through file.
     #
@@ -195,7 +346,7 @@ def iterate(input, returnGroups=False):
 	elif line.startswith(COMMENT_CHAR):
 	    continue
 	else:
-	    f = Feature(line)
+	    f = cls(line)
 	    if returnGroups:
 		group.append(f)
 	    else:
@@ -211,6 +362,121 @@ def iterate(input, returnGroups=False):
     if closeit:
 	input.close()
 
+#----------------------------------------------------
+# A parallel version of iterate, for large files. The file is split
+# into byte ranges that start and end on line boundaries (see splitFile),
+# the ranges are parsed in worker processes, and the results are yielded
+# in file order: the same sequence iterate yields. Comment lines are
+# skipped, and "###" lines separate groups (with returnGroups), just as
+# in iterate; a group may span ranges.
+#
+# Args:
+#  input (file name) A plain (uncompressed) file. Anything else (standard
+#	input, an open file, a gzip or BGZF file, or a region) cannot be split,
+#	and is read by iterate, serially.
+#  returnGroups, lazy, region: as for iterate.
+#  columns (list of names) If given, yields, rather than Features, tuples of
+#	just these values of each feature: field names (seqid, start, etc.) or
+#	column 9 attributes (e.g., ID; None if a feature does not have it).
+#	Only the tuples are passed back from the workers, which is much
+#	faster when a few columns are all the caller needs (e.g., the
+#	projection in features.py).
+#  jobs (int) Number of worker processes. (Default: the number of CPUs.)
+#  chunkBytes (int) Target size of a byte range.
+#
+def iterateParallel(input, returnGroups=False, lazy=False, region=None, columns=None, jobs=None, chunkBytes=CHUNK_BYTES):
+    jobs = jobs or multiprocessing.cpu_count()
+    serial = region is not None or type(input) is not types.StringType \
+	or input == "-" or bgzf.fileType(input) != 'plain'
+    ranges = [] if serial else splitFile(input, max(jobs, os.path.getsize(input) // chunkBytes))
+    if len(ranges) < 2 or jobs < 2:
+	if columns is None:
+	    for x in iterate(input, returnGroups, lazy, region):
+		yield x
+	    return
+	for x in iterate(input, returnGroups, True, region):
+	    if returnGroups:
+		yield [ _columns(f, columns) for f in x ]
+	    else:
+		yield _columns(x, columns)
+	return
+    tasks = [ (input, r, returnGroups, lazy, columns) for r in ranges ]
+    pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    results = pool.imap(_parseRange, tasks)
+    #
+    # Merge. A None item is a group separator.
+    #
+    group = []
+    try:
+	for items in results:
+	    if not returnGroups:
+		for x in items:
+		    yield x
+		continue
+	    for x in items:
+		if x is not None:
+		    group.append(x)
+		elif len(group) > 0:
+		    yield group
+		    group = []
+	if len(group) > 0:
+	    yield group
+    finally:
+	pool.terminate()
+	pool.join()
+
+#
+# Splits the named file into about n byte ranges, each starting and ending
+# on a line boundary. Returns a list of (start, end) offsets, in file order.
+#
+def splitFile(fname, n):
+    size = os.path.getsize(fname)
+    n = max(1, min(n, size))
+    bounds = [0]
+    fd = open(fname, 'rb')
+    for i in range(1, n):
+	pos = size * i // n
+	if pos <= bounds[-1]:
+	    continue
+	# the end of the line that contains byte pos-1
+	fd.seek(pos - 1)
+	fd.readline()
+	pos = fd.tell()
+	if bounds[-1] < pos < size:
+	    bounds.append(pos)
+    fd.close()
+    bounds.append(size)
+    return [ (bounds[i], bounds[i+1]) for i in range(len(bounds) - 1) ]
+
+#
+# Worker for iterateParallel. Parses one byte range, (start, end), of the
+# named file and returns the list of its features (or column tuples),
+# with None for each group separator if returnGroups.
+#
+def _parseRange(task):
+    fname, rng, returnGroups, lazy, columns = task
+    fd = open(fname, 'rb')
+    fd.seek(rng[0])
+    lines = cStringIO.StringIO(fd.read(rng[1] - rng[0]))
+    fd.close()
+    cls = LazyFeature if lazy or columns is not None else Feature
+    items = []
+    for line in lines:
+	if returnGroups and line == GROUPSEP:
+	    items.append(None)
+	elif line.startswith(COMMENT_CHAR):
+	    continue
+	else:
+	    f = cls(line)
+	    items.append(f if columns is None else _columns(f, columns))
+    return items
+
+#
+# Returns the tuple of the named columns' values of feature f.
+#
+def _columns(f, columns):
+    return tuple([ getattr(f, c, None) for c in columns ])
+
 #----------------------------------------------------
 def index(features):
     id2feature = {}
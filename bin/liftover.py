@@ -0,0 +1,253 @@
+'''
+liftover.py
+
+Projects coordinates in genome A onto genome B, using a file of synteny blocks.
+
+Within a block, a position maps linearly from the block's A extent onto its B extent
+(reversed for "-" blocks), exactly as the viewer maps positions between genomes.
+The blocks of each A chromosome are indexed in order of start position, so finding the blocks
+that contain a position or overlap an interval is a binary search, not a scan of the blocks.
+(Coarsened or chained blocks may overlap one another; the index handles that too.)
+
+An interval is
+    mapped      if it lies entirely within one block. It maps to one interval in B.
+    split       if it overlaps blocks but does not lie within one (it spans a block boundary,
+                or extends beyond the blocks). Each overlapping piece maps separately.
+    unmapped    if it overlaps no block. Indel blocks (generate.py --indels) do not count, so an interval
+                within a deletion is unmapped.
+
+Usage:
+    python liftover.py BLOCKS [INPUT] [-o OUTPUT] [--unmapped FILE] [--no-split]
+
+BLOCKS is a block file written by generate.py (TSV, or binary .blk; see blockfile.py).
+INPUT (default: stdin) is BED or GFF3 (by extension, or --format). Lines are read and
+written one at a time, so inputs of any size can be lifted over. In the output, the coordinates and
+chromosome (and strand, for "-" blocks) are replaced and all other columns are kept; a split
+interval is written once per piece. Unmapped intervals (and, with --no-split, split ones)
+are written unchanged to the --unmapped file. Counts are reported on stderr.
+'''
+import argparse
+import bisect
+import blockfile
+import sys
+
+FLIP = { '+' : '-', '-' : '+' }
+
+#
+class BlockIndex:
+
+    def __init__ (self, blocks):
+        """
+        Indexes the given blocks, a list of dicts with keys: id, ori, aChr, aStart, aEnd, bChr, bStart, bEnd.
+        """
+        self.chrs = {} # aChr -> (starts, maxEnds, blocks), sorted by aStart
+        bychr = {}
+        for b in blocks:
+            bychr.setdefault(b['aChr'], []).append(b)
+        for c, blks in bychr.items():
+            blks.sort(key=lambda b: (b['aStart'], b['aEnd']))
+            # maxEnds[i] is the greatest aEnd of blocks 0..i
+            maxEnds = []
+            m = None
+            for b in blks:
+                m = b['aEnd'] if m is None else max(m, b['aEnd'])
+                maxEnds.append(m)
+            self.chrs[c] = ([ b['aStart'] for b in blks ], maxEnds, blks)
+
+    def find (self, chr, start, end) :
+        """
+        Returns the blocks that overlap the interval [start, end] of A chromosome chr, in A order.
+        """
+        x = self.chrs.get(chr, None)
+        if x is None:
+            return []
+        starts, maxEnds, blks = x
+        found = []
+        i = bisect.bisect_right(starts, end) - 1
+        while i >= 0 and maxEnds[i] >= start:
+            if blks[i]['aEnd'] >= start:
+                found.append(blks[i])
+            i -= 1
+        found.reverse()
+        return found
+
+#
+def readBlocks (fname) :
+    """
+    Reads a block file (TSV, or binary if the name ends with .blk). Returns a list of dicts
+    with keys: id, ori, aChr, aStart, aEnd, bChr, bStart, bEnd.
+    Indel blocks (generate.py --indels), which have an empty chromosome on one side, are skipped:
+    they map nothing from A to B.
+    """
+    blocks = []
+    if fname.endswith(blockfile.BLK_EXT):
+        hdr, cols = blockfile.read(fname)
+        for i in xrange(hdr['n']):
+            if not hdr['aChrs'][cols['aChr'][i]] or not hdr['bChrs'][cols['bChr'][i]]:
+                continue
+            blocks.append({
+                'id' : cols['blockId'][i],
+                'ori' : '+' if cols['blockOri'][i] == 1 else '-',
+                'aChr' : str(hdr['aChrs'][cols['aChr'][i]]),
+                'aStart' : cols['aStart'][i],
+                'aEnd' : cols['aEnd'][i],
+                'bChr' : str(hdr['bChrs'][cols['bChr'][i]]),
+                'bStart' : cols['bStart'][i],
+                'bEnd' : cols['bEnd'][i],
+            })
+        return blocks
+    fd = open(fname, 'r')
+    names = fd.readline()[:-1].split('\t')
+    for line in fd:
+        r = dict(zip(names, line[:-1].split('\t')))
+        if not r['aChr'] or not r['bChr']:
+            continue
+        blocks.append({
+            'id' : int(r['blockId']),
+            'ori' : r['blockOri'],
+            'aChr' : r['aChr'],
+            'aStart' : int(r['aStart']),
+            'aEnd' : int(r['aEnd']),
+            'bChr' : r['bChr'],
+            'bStart' : int(r['bStart']),
+            'bEnd' : int(r['bEnd']),
+        })
+    fd.close()
+    return blocks
+
+#
+class LiftOver:
+
+    def __init__ (self, blocks):
+        """
+        Initializes a liftover from a list of blocks (see readBlocks), or the name of a block file.
+        """
+        if isinstance(blocks, basestring):
+            blocks = readBlocks(blocks)
+        self.index = BlockIndex(blocks)
+
+    def mapInBlock (self, b, pos) :
+        """
+        Maps an A position, within block b, to B. As in the viewer, the block's
+        A extent maps linearly onto its B extent (reversed for "-" blocks).
+        """
+        alen = b['aEnd'] - b['aStart']
+        f = (1.0 * (pos - b['aStart']) / alen) if alen else 0.0
+        blen = b['bEnd'] - b['bStart']
+        if b['ori'] == '+':
+            return int(round(b['bStart'] + f * blen))
+        else:
+            return int(round(b['bEnd'] - f * blen))
+
+    def mapPosition (self, chr, pos) :
+        """
+        Maps a position in A. Returns a list of (bChr, bPos, ori, blockId), one for each
+        block containing the position (usually 0 or 1).
+        """
+        return [ (b['bChr'], self.mapInBlock(b, pos), b['ori'], b['id'])
+            for b in self.index.find(chr, pos, pos) ]
+
+    def mapInterval (self, chr, start, end) :
+        """
+        Maps an interval [start, end] in A. Returns (status, pieces), where status is
+        "mapped", "split", or "unmapped" (see the module docstring), and pieces is a list of
+        (bChr, bStart, bEnd, ori, blockId), one for the part of the interval in each overlapping block.
+        """
+        blks = self.index.find(chr, start, end)
+        pieces = []
+        for b in blks:
+            s = self.mapInBlock(b, max(start, b['aStart']))
+            e = self.mapInBlock(b, min(end, b['aEnd']))
+            pieces.append((b['bChr'], min(s, e), max(s, e), b['ori'], b['id']))
+        if not pieces:
+            status = 'unmapped'
+        elif len(blks) == 1 and blks[0]['aStart'] <= start and end <= blks[0]['aEnd']:
+            status = 'mapped'
+        else:
+            status = 'split'
+        return (status, pieces)
+
+#
+class LiftOverCommand:
+
+    def __init__ (self):
+        self.initArgParser()
+
+    def initArgParser (self):
+        """
+        Sets up the parser for the command line args.
+        """
+        self.parser = argparse.ArgumentParser(description='Lift over BED or GFF3 intervals from genome A to genome B, using synteny blocks.')
+        self.parser.add_argument('blocks', metavar='BLOCKS',
+            help='Block file from generate.py (TSV, or binary .blk).')
+        self.parser.add_argument('input', metavar='INPUT', nargs='?', default='-',
+            help='BED or GFF3 file of A intervals. (default: stdin)')
+        self.parser.add_argument('-f', '--format', dest='format', choices=['bed', 'gff3'],
+            help='Input format. (default: from the INPUT extension, otherwise bed)')
+        self.parser.add_argument('-o', '--output', dest='output', metavar='FILE',
+            help='Write the lifted intervals to FILE. (default: stdout)')
+        self.parser.add_argument('--unmapped', dest='unmapped', metavar='FILE',
+            help='Write the input lines that could not be lifted over to FILE.')
+        self.parser.add_argument('--no-split', dest='noSplit', action='store_true', default=False,
+            help='Treat split intervals as unmapped, rather than writing each piece.')
+
+    def go (self, argv=None) :
+        self.args = self.parser.parse_args(argv)
+        fmt = self.args.format
+        if not fmt:
+            fmt = 'gff3' if self.args.input.endswith(('.gff3', '.gff')) else 'bed'
+        lo = LiftOver(self.args.blocks)
+        ifd = sys.stdin if self.args.input == '-' else open(self.args.input, 'r')
+        ofd = open(self.args.output, 'w') if self.args.output else sys.stdout
+        ufd = open(self.args.unmapped, 'w') if self.args.unmapped else None
+        counts = { 'mapped' : 0, 'split' : 0, 'unmapped' : 0, 'pieces' : 0 }
+        for line in ifd:
+            if line.startswith('#') or line.startswith('track') or line.startswith('browser') or not line.strip():
+                ofd.write(line)
+                continue
+            toks = line.rstrip('\r\n').split('\t')
+            if fmt == 'bed':
+                # BED is 0-based, half open
+                chr, start, end = toks[0], int(toks[1]) + 1, int(toks[2])
+                if start > end:
+                    # zero length interval (an insertion point); look up the base after it
+                    end = start
+            else:
+                chr, start, end = toks[0], int(toks[3]), int(toks[4])
+            status, pieces = lo.mapInterval(chr, start, end)
+            if status == 'split' and self.args.noSplit:
+                status = 'unmapped'
+            counts[status] += 1
+            if status == 'unmapped':
+                if ufd:
+                    ufd.write(line)
+                continue
+            for bchr, bstart, bend, ori, blkid in pieces:
+                t = list(toks)
+                t[0] = bchr
+                if fmt == 'bed':
+                    t[1] = str(bstart - 1)
+                    t[2] = str(bend)
+                    if ori == '-' and len(t) > 5 and t[5] in FLIP:
+                        t[5] = FLIP[t[5]]
+                else:
+                    t[3] = str(bstart)
+                    t[4] = str(bend)
+                    if ori == '-' and t[6] in FLIP:
+                        t[6] = FLIP[t[6]]
+                ofd.write('\t'.join(t) + '\n')
+                counts['pieces'] += 1
+        #
+        for f in [ifd, ofd, ufd]:
+            if f and f not in (sys.stdin, sys.stdout):
+                f.close()
+        sys.stderr.write('%(mapped)d mapped, %(split)d split (%(pieces)d pieces written in all), %(unmapped)d unmapped\n' % counts)
+        return counts
+
+#
+def main () :
+    LiftOverCommand().go()
+
+#
+if __name__ == "__main__":
+    main()
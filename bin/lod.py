@@ -0,0 +1,166 @@
+'''
+lod.py
+
+Level-of-detail (coarsened) block files for the viewer.
+
+At whole-genome zoom, a pixel covers hundreds of kb, and a fragmented strain pair has
+thousands of blocks too small to see individually. A coarsened level at resolution R (bp)
+merges runs of adjacent, collinear blocks whose gaps are at most R: consecutive blocks (in A order)
+are merged if they
+    - have the same A chromosome, B chromosome, and orientation,
+    - are at most R bp apart in A, and at most R bp apart in B,
+    - continue in the same direction in B (ascending for "+" blocks, descending for "-").
+Also, a block of the other orientation that is smaller than R in both genomes (e.g., a single
+gene on the opposite strand), and within R of the merged block in B, is absorbed into it.
+A merged block spans its blocks in each genome; its count and ids are those of its blocks combined
+(empty ids, as generate.py --ids ranges writes, are skipped),
+and its ratio is recomputed. An extra column, nMerged, gives the number of (full resolution) blocks it contains.
+Indel blocks (generate.py --indels) are merged with indel blocks of the same kind that are
+at most R bp apart in the genome that has them.
+
+Levels form a pyramid: each level is computed from the next finer one.
+The files are named like the full resolution file, with .lod<R> before the extension
+(e.g., A-B.lod100000.tsv). The viewer loads the coarsest level whose resolution is finer
+than a pixel at the current magnification.
+
+Usage (coarsens an existing TSV block file):
+    python lod.py A-B.tsv 10000 100000 1000000
+'''
+import blockfile
+import os
+import sys
+
+# Default resolutions (bp). These must match lodLevels in viewer.js.
+LEVELS = [10000, 100000, 1000000]
+
+#
+def levelName (fname, resolution) :
+    """
+    Returns the name of the given level of the named block file.
+    """
+    base, ext = os.path.splitext(fname)
+    return '%s.lod%d%s' % (base, resolution, ext)
+
+def coarsen (rows, resolution) :
+    """
+    Returns the blocks of the given rows (lists of TSV column values, plus optionally nMerged,
+    in A order) merged at the given resolution, as rows with nMerged.
+    """
+    out = []
+    cur = None
+    for r in rows:
+        b = {
+            'count' : int(r[1]),
+            'ori' : r[2],
+            'aChr' : r[4],
+            'bChr' : r[5],
+            'aStart' : int(r[8]),
+            'bStart' : int(r[9]),
+            'aEnd' : int(r[10]),
+            'bEnd' : int(r[11]),
+            'aIndex' : int(r[12]),
+            'bIndex' : int(r[13]),
+            'ids' : [r[14]],
+            'nMerged' : int(r[15]) if len(r) > 15 else 1,
+        }
+        b['last'] = (b['bStart'], b['bEnd']) # B extent of the last collinear block merged
+        if cur is not None and canMerge(cur, b, resolution):
+            if b['ori'] == cur['ori']:
+                cur['last'] = b['last']
+            cur['count'] += b['count']
+            cur['aEnd'] = max(cur['aEnd'], b['aEnd'])
+            cur['bStart'] = min(cur['bStart'], b['bStart'])
+            cur['bEnd'] = max(cur['bEnd'], b['bEnd'])
+            cur['bIndex'] = min(cur['bIndex'], b['bIndex'])
+            cur['ids'] += b['ids']
+            cur['nMerged'] += b['nMerged']
+        else:
+            cur = b
+            out.append(cur)
+    #
+    nrows = []
+    for i, b in enumerate(out):
+        # the missing side of an indel block (see generate.py --indels) has no length
+        alen = b['aEnd'] - b['aStart'] + 1 if b['aChr'] else 0
+        blen = b['bEnd'] - b['bStart'] + 1 if b['bChr'] else 0
+        nrows.append([
+            i + 1,
+            b['count'],
+            b['ori'],
+            "%1.2f" % ((1.0 * min(alen,blen)) / max(alen,blen)),
+            b['aChr'],
+            b['bChr'],
+            alen,
+            blen,
+            b['aStart'],
+            b['bStart'],
+            b['aEnd'],
+            b['bEnd'],
+            b['aIndex'],
+            b['bIndex'],
+            ','.join([ x for x in b['ids'] if x ]),
+            b['nMerged'],
+        ])
+    return nrows
+
+def canMerge (cur, b, resolution) :
+    """
+    Returns True if block b can be merged into the current merged block at the given resolution.
+    """
+    if b['aChr'] != cur['aChr'] or b['bChr'] != cur['bChr']:
+        return False
+    if b['aStart'] - cur['aEnd'] > resolution:
+        return False
+    if not b['aChr'] or not b['bChr']:
+        # indel blocks merge if they are close in the genome that has them
+        return b['bStart'] - cur['bEnd'] <= resolution
+    pstart, pend = cur['last']
+    if b['ori'] != cur['ori']:
+        # a block too small to see at this resolution, close to the last block in B
+        return b['aEnd'] - b['aStart'] < resolution and b['bEnd'] - b['bStart'] < resolution \
+            and b['bStart'] - pend <= resolution and pstart - b['bEnd'] <= resolution
+    if b['ori'] == '+':
+        return b['bStart'] > pend and b['bStart'] - pend <= resolution
+    else:
+        return b['bEnd'] < pstart and pstart - b['bEnd'] <= resolution
+
+def writeTsv (fname, rows) :
+    """
+    Writes the rows of a level as a TSV block file (with a header). The file is
+    written under a temporary name and then renamed.
+    """
+    tmpname = '%s.%d.tmp' % (fname, os.getpid())
+    fd = open(tmpname, 'w')
+    fd.write('\t'.join(blockfile.TSV_COLUMNS + ['nMerged']) + '\n')
+    for r in rows:
+        fd.write('\t'.join(map(str, r)) + '\n')
+    fd.close()
+    os.rename(tmpname, fname)
+
+def writeLevels (fname, rows, levels, binary=False) :
+    """
+    Writes the coarsened levels of the given (full resolution) rows of the named block file.
+    If binary is True, writes binary block files (see blockfile.py) for them too.
+    """
+    for res in sorted(levels):
+        rows = coarsen(rows, res)
+        lname = levelName(fname, res)
+        writeTsv(lname, rows)
+        if binary:
+            blockfile.write(os.path.splitext(lname)[0] + blockfile.BLK_EXT, rows)
+
+#
+def main () :
+    if len(sys.argv) < 2:
+        sys.stderr.write('Usage: python lod.py BLOCKS.tsv [RESOLUTION ...]\n')
+        sys.exit(1)
+    fd = open(sys.argv[1], 'r')
+    fd.readline()
+    rows = [ line[:-1].split('\t') for line in fd ]
+    fd.close()
+    levels = [ int(x) for x in sys.argv[2:] ] or LEVELS
+    writeLevels(sys.argv[1], rows, levels)
+
+#
+if __name__ == "__main__":
+    main()
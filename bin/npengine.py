@@ -0,0 +1,268 @@
+'''
+npengine.py
+
+Array-based ("--engine numpy") implementation of the core of SyntenyBlockGenerator:
+prepAB, prepGff, join, renumber, and generateBlocks.
+
+Rather than a dict per feature and per pair, each genome is held as parallel arrays
+(ID, chromosome code, start, end, strand) of the interned values (see features.py):
+IDs are MGI numbers and chromosomes are codes in features.CHROMOSOMES. Then:
+    - prepAB finds the 1:1 pairs by counting occurrences with unique.
+    - prepGff filters with vectorized membership tests and sorts with lexsort
+      (by chromosome name rank, then start).
+    - join maps A IDs to B IDs and B IDs to B features with sort/searchsorted.
+    - renumber computes the B index of each pair as an argsort rank.
+    - generateBlocks finds the block boundaries by comparing consecutive
+      bIndex, chromosome, and orientation values, and computes each block's
+      extent with segment reductions.
+
+The result is the same list of blocks the Python engine builds, and the same lists of
+pair IDs they are written from (see SyntenyBlockGenerator.blockIds), so writeBlocks output is byte-identical.
+
+Requires numpy. Inputs the array formulation does not cover (non-integer coordinates,
+or two A features paired with the same B feature) are left to the Python engine.
+'''
+import blockfile
+import features
+import numpy as np
+
+#
+def compute (sbg) :
+    """
+    Computes sbg.blocks from sbg.A, sbg.B and sbg.AB.
+    Returns True on success, or False if the inputs need the Python engine
+    (in which case sbg is unchanged).
+    """
+    nstages = len(sbg.stages)
+    with sbg.stage('prepAB'):
+        AB = prepAB(sbg.AB)
+    sbg.count('AB', 'read', len(sbg.AB))
+    sbg.count('AB', 'oneToOne', len(AB['a']))
+    with sbg.stage('prepGff.A'):
+        A = prepGff(sbg.A, AB['a'])
+    with sbg.stage('prepGff.B'):
+        B = prepGff(sbg.B, AB['b'])
+    pairs = None
+    if A is not None and B is not None:
+        with sbg.stage('join'):
+            pairs = join(AB, A, B)
+    if pairs is None:
+        # drop the partial timings; the Python engine records its own
+        del sbg.stages[nstages:]
+        return False
+    for name, t in [('A', A), ('B', B)]:
+        for k, v in t['counts'].items():
+            sbg.count(name, k, v)
+    sbg.count('pairs', 'joined', len(pairs['a']))
+    if sbg.args.debug: writePairs(sbg, A, B, pairs)
+    with sbg.stage('generateBlocks'):
+        generateBlocks(sbg, A, B, pairs)
+    sbg.count('blocks', 'generated', len(sbg.blocks))
+    return True
+
+#
+def prepAB (AB) :
+    """
+    Array version of SyntenyBlockGenerator.prepAB. Filters the A/B pairs to contain only the 1:1s.
+    Returns a dict of parallel arrays, a and b, sorted by a.
+    """
+    aids = np.array([ ab[0] for ab in AB ], dtype=np.int64)
+    bids = np.array([ ab[1] for ab in AB ], dtype=np.int64)
+    if len(aids) == 0:
+        return { 'a' : aids, 'b' : bids }
+    # a pair is 1:1 if its a and its b each occur in exactly one pair
+    _, ainv, acounts = np.unique(aids, return_inverse=True, return_counts=True)
+    _, binv, bcounts = np.unique(bids, return_inverse=True, return_counts=True)
+    keep = (acounts[ainv] == 1) & (bcounts[binv] == 1)
+    aids = aids[keep]
+    bids = bids[keep]
+    o = np.argsort(aids, kind='mergesort')
+    return { 'a' : aids[o], 'b' : bids[o] }
+
+#
+def prepGff (feats, index) :
+    """
+    Array version of SyntenyBlockGenerator.prepGff. Filters the features for those whose ID
+    is an MGI id in the index (an array of IDs), sorts them by chr+start, and removes overlaps.
+    Returns a dict of parallel arrays (id, chr, start, end, strand), plus
+    counts, the numbers of features dropped and kept. Returns None if the coordinates are not all ints.
+    """
+    # non-MGI features (ID None) get -1; they are dropped before it could match an AB ID
+    ids = np.array([ -1 if f.ID is None else f.ID for f in feats ], dtype=np.int64)
+    starts = np.array([ f.start for f in feats ])
+    ends = np.array([ f.end for f in feats ])
+    if len(feats) and (starts.dtype.kind not in 'iu' or ends.dtype.kind not in 'iu'):
+        return None
+    #
+    # a. Filter for features whose ID is in the index
+    isMgi = ids >= 0
+    inIndex = np.in1d(ids, index)
+    keep = np.flatnonzero(isMgi & inIndex)
+    counts = {
+        'nonMgi' : int(len(ids) - isMgi.sum()),
+        'notInAB' : int(isMgi.sum() - len(keep)),
+        }
+    chrs = np.array([ feats[i].seqid for i in keep ], dtype=np.int64)
+    strands = np.array([ feats[i].strand for i in keep ], dtype=str)
+    ids = ids[keep]
+    starts = starts[keep].astype(np.int64)
+    ends = ends[keep].astype(np.int64)
+    #
+    # b. Sort by chr+start position (stable, like list.sort).
+    rank = np.array(features.CHROMOSOMES.ranks(), dtype=np.int64)
+    order = np.lexsort((starts, rank[chrs]))
+    #
+    t = {
+        'id'     : ids[order],
+        'chr'    : chrs[order],
+        'start'  : starts[order],
+        'end'    : ends[order],
+        'strand' : strands[order],
+        'counts' : counts,
+        }
+    #
+    # c. Filter to remove any overlaps between features.
+    keep = removeOverlaps(t['chr'], t['start'], t['end'])
+    for n in ['id','chr','start','end','strand']:
+        t[n] = t[n][keep]
+    counts['overlaps'] = len(order) - len(keep)
+    counts['kept'] = len(keep)
+    return t
+
+def removeOverlaps (chrs, starts, ends) :
+    """
+    Returns the indexes of the features to keep, given sorted chr, start and end arrays.
+    As in prepGff, a feature is dropped if it overlaps the last feature kept.
+    A feature that starts after every preceding feature on its chromosome ends is always
+    kept, so only the (few) others need to be examined one by one.
+    """
+    n = len(chrs)
+    if n == 0:
+        return np.arange(0)
+    # the max end of all preceding features on the same chromosome
+    newChr = np.ones(n, dtype=bool)
+    newChr[1:] = chrs[1:] != chrs[:-1]
+    cstarts = np.flatnonzero(newChr)
+    cends = np.append(cstarts[1:], n)
+    prevMaxEnd = np.empty(n, dtype=np.int64)
+    for cs, ce in zip(cstarts.tolist(), cends.tolist()):
+        prevMaxEnd[cs] = np.iinfo(np.int64).min
+        prevMaxEnd[cs+1:ce] = np.maximum.accumulate(ends[cs:ce-1])
+    keep = starts > prevMaxEnd
+    #
+    lastEnd = None
+    for i in np.flatnonzero(~keep).tolist():
+        if keep[i-1]:
+            lastEnd = ends[i-1]
+        if not lastEnd >= starts[i]:
+            keep[i] = True
+            lastEnd = ends[i]
+    return np.flatnonzero(keep)
+
+#
+def join (AB, A, B) :
+    """
+    Array version of join + renumber. Pairs each A feature with the B feature
+    its ID corresponds to (per the 1:1 pairs in AB). Returns a dict of parallel arrays:
+        a       position of the pair's A feature in A (ascending)
+        b       position of the pair's B feature in B
+        bIndex  the pair's B index after renumbering
+    The pair's A index after renumbering is just its position in these arrays.
+    Returns None if two A features pair with the same B feature.
+    """
+    # map each A ID to its B ID
+    aids = AB['a']
+    bids = AB['b']
+    if len(aids):
+        p = np.searchsorted(aids, A['id'])
+        abid = bids[np.minimum(p, len(aids)-1)]
+    else:
+        abid = np.array([], dtype=np.int64)
+    #
+    # find the B feature with that ID. (Like the bid2feat index, the last one if there are dups.)
+    o = np.argsort(B['id'], kind='mergesort')
+    bsorted = B['id'][o]
+    p = np.searchsorted(bsorted, abid, side='right') - 1
+    found = (p >= 0)
+    found[found] = bsorted[p[found]] == abid[found]
+    apos = np.flatnonzero(found)
+    bpos = o[p[found]]
+    if len(np.unique(bpos)) != len(bpos):
+        return None
+    #
+    # the join step may cause genes to drop out, and it is important that the
+    # sequence is unbroken for each genome
+    bIndex = np.empty(len(bpos), dtype=np.int64)
+    bIndex[np.argsort(bpos, kind='mergesort')] = np.arange(len(bpos))
+    return { 'a' : apos, 'b' : bpos, 'bIndex' : bIndex }
+
+#
+def generateBlocks (sbg, A, B, pairs) :
+    """
+    Array version of generateBlocks. Sets sbg.blocks to the same list of
+    blockfile.Blocks the Python engine generates, and sbg.pairIds to the IDs of the pairs.
+    """
+    a = pairs['a']
+    b = pairs['b']
+    bIndex = pairs['bIndex']
+    n = len(a)
+    sbg.blocks = []
+    if n == 0:
+        sbg.pairIds = ([], [], [])
+        return
+    aChr = A['chr'][a]
+    bChr = B['chr'][b]
+    ori = np.where(A['strand'][a] == B['strand'][b], 1, -1)
+    #
+    # a pair starts a new block unless it can merge with the previous one
+    brk = np.ones(n, dtype=bool)
+    brk[1:] = (aChr[1:] != aChr[:-1]) \
+            | (bChr[1:] != bChr[:-1]) \
+            | (ori[1:] != ori[:-1]) \
+            | (bIndex[1:] != bIndex[:-1] + ori[1:])
+    starts = np.flatnonzero(brk)
+    ends = np.append(starts[1:], n)
+    #
+    aStart = np.minimum.reduceat(A['start'][a], starts).tolist()
+    aEnd   = np.maximum.reduceat(A['end'][a], starts).tolist()
+    bStart = np.minimum.reduceat(B['start'][b], starts).tolist()
+    bEnd   = np.maximum.reduceat(B['end'][b], starts).tolist()
+    aChrs = aChr[starts].tolist()
+    bChrs = bChr[starts].tolist()
+    # the lowest B index is the first pair's for "+" blocks, the last's for "-"
+    bLo = np.minimum(bIndex[starts], bIndex[ends-1]).tolist()
+    oris = ori[starts].tolist()
+    aIds = A['id'][a].tolist()
+    bIds = aIds if np.array_equal(A['id'][a], B['id'][b]) else B['id'][b].tolist()
+    sbg.pairIds = (aIds, bIds, bIndex.tolist())
+    #
+    Block = blockfile.Block
+    for i, (s, e) in enumerate(zip(starts.tolist(), ends.tolist())):
+        sbg.blocks.append(Block(i+1, oris[i], e-s, aChrs[i], aStart[i], aEnd[i], s,
+            bChrs[i], bStart[i], bEnd[i], bLo[i], blockfile.IDS_PAIRS, s))
+    sbg.nBlocks = len(sbg.blocks)
+
+#
+def writePairs (sbg, A, B, pairs) :
+    """
+    Debug output. Writes the pairs in the same form as SyntenyBlockGenerator.writePairs.
+    """
+    a = pairs['a']
+    b = pairs['b']
+    chrName = features.CHROMOSOMES.name
+    cols = [
+        range(len(a)),
+        pairs['bIndex'].tolist(),
+        map(features.mgiId, A['id'][a].tolist()),
+        map(chrName, A['chr'][a].tolist()),
+        A['start'][a].tolist(),
+        A['end'][a].tolist(),
+        A['strand'][a].tolist(),
+        map(features.mgiId, B['id'][b].tolist()),
+        map(chrName, B['chr'][b].tolist()),
+        B['start'][b].tolist(),
+        B['end'][b].tolist(),
+        B['strand'][b].tolist(),
+        ]
+    for r in zip(*cols):
+        sbg.ofd.write('# ' + '\t'.join([ str(x) for x in r ]) + '\n')
@@ -1,40 +1,240 @@
-
 #
 # prepStrainFile.py
 #
 # The GFF3 files from Ensemble have the MGI id embedded in the description field.
 # To generate synteny blocks, need the MGI ID as the feature's ID.
 #
-# Makes the MGI id the feature ID, and saves the 
+# Makes the MGI id the feature ID, and saves the
 # Filters out features on contigs
 #
+# Only top level gene lines (gene, ncRNA_gene, pseudogene; no Parent) are kept. Lines are
+# rejected on their seqid, type, and Parent before column 9 is examined, and a kept line is
+# written with the MGI id spliced in as its ID, rather than parsed and re-serialized.
+#
+# Usage:
+#   python prepStrainFile.py [INPUT] [--region REGION] > strain.gff3
+#       Reads one Ensembl GFF3 file (plain, gzip, or BGZF; default: stdin). Duplicates are reported on stderr.
+#       With --region (chr or chr:start-end), only the lines in that region are prepared; a position-sorted
+#       plain or BGZF INPUT is read through its region index (see bgzf.py).
+#       Duplicate MGI ids are then detected within the region only.
+#
+#   python prepStrainFile.py --all STRAINLIST --indir DIR --outdir DATADIR [--chrs-dir OUTDIR] [-j N]
+#       Batch mode. Prepares every strain in STRAINLIST, in parallel worker processes.
+#       The input for a strain is the (optionally gzipped) GFF3 file in DIR named for
+#       the strain: Ensembl's name for it (e.g., Mus_caroli.*.gff3.gz for mus_caroli),
+#       or <strain>.gff3[.gz]. Writes, for each strain:
+#           DATADIR/<strain>.gff3               the prepared features
+#           DATADIR/<strain>.duplicates.tsv     the features dropped as duplicate MGI ids
+#           OUTDIR/<strain>.chrs.tsv            the chromosome manifest (see features.py)
+#
 
-import sys
+import argparse
+import bgzf
+import features
+import glob
 import gff3
+import multiprocessing
+import os
 import re
-
-# keep track of MGI ids we've seen to avoid dups.
-seen = set()
+import sys
+import time
+import urllib
 
 # reg exp to find/capture an MGI id
 mgi_re = re.compile(r'(MGI:[0-9]+)')
-# 
-for i,f in enumerate(gff3.iterate(sys.stdin)):
-    # exclude features on contigs.
-    if len(f.seqid) > 2:
-        continue
-    # the MGI id
-    m = mgi_re.search(f.attributes.get('description',''))
-    if m:
-        mgiid = m.group(1)
-        #
-        if mgiid in seen:
-            sys.stderr.write("Duplicate detected (%s %s %s #%d).\n"%(f.attributes.get("Name",""), mgiid, f.ID, i))
+
+DUPS_EXT = '.duplicates.tsv'
+
+#
+def findMgiId (c9) :
+    """
+    Returns the MGI id in the description attribute of the given (unparsed) column 9, or None.
+    """
+    i = -1
+    while True:
+        i = c9.find('description=', i+1)
+        if i == -1:
+            return None
+        if i == 0 or c9[i-1] == gff3.SEMI:
+            break
+    i += len('description=')
+    j = c9.find(gff3.SEMI, i)
+    desc = c9[i:] if j == -1 else c9[i:j]
+    if '%' in desc:
+        desc = urllib.unquote(desc)
+    m = mgi_re.search(desc)
+    return m.group(1) if m else None
+
+def spliceID (c9, ID) :
+    """
+    Returns the given (unparsed) column 9 with its ID attribute's value replaced by ID.
+    If it has no ID attribute, one is added at the front.
+    """
+    if c9.startswith('ID='):
+        i = 3
+    else:
+        i = c9.find(';ID=')
+        if i == -1:
+            return 'ID=%s;%s' % (ID, c9)
+        i += 4
+    j = c9.find(gff3.SEMI, i)
+    return c9[:i] + ID + ('' if j == -1 else c9[j:])
+
+def prepLines (lines, ofd, dups) :
+    """
+    Prepares the lines of an Ensembl GFF3 file, writing the kept ones to ofd.
+    Lines for features on contigs, and any but top level gene lines, are dropped.
+    A line whose description contains an MGI id is written with that id as its ID; a second
+    line with the same MGI id is dropped, and (name, MGI id, original ID, line number)
+    appended to dups.
+    Returns the chromosome summary of the lines written (as features.chromosomeSummary).
+    """
+    # keep track of MGI ids we've seen to avoid dups.
+    seen = set()
+    summary = {}
+    for i,line in enumerate(lines):
+        if line.startswith(gff3.COMMENT_CHAR):
+            continue
+        tokens = line.split(gff3.TAB, 8)
+        if len(tokens) != 9:
+            raise gff3.ParseError("Wrong number of columns (%d)\n%s" % (len(tokens),line))
+        seqid = tokens[0]
+        # exclude features on contigs, and all but the (top level) genes.
+        if len(seqid) > 2 or not tokens[2].endswith('gene') or 'Parent=' in tokens[8]:
             continue
-        seen.add(mgiid)
-        # no need to save the original ID since there is already a gene_id field with that value.
-        # f.attributes['ensemblId']=f.ID
-        # change the ID to be the MGI id
-        f.ID = mgiid
+        c9 = tokens[8].rstrip(gff3.NL)
+        # the MGI id
+        mgiid = findMgiId(c9)
+        if mgiid:
+            #
+            if mgiid in seen:
+                attrs = gff3.parseColumn9(c9)
+                dups.append((attrs.get('Name',''), mgiid, attrs.get('ID',''), i+1))
+                continue
+            seen.add(mgiid)
+            # change the ID to be the MGI id
+            tokens[8] = spliceID(c9, mgiid)
+            line = gff3.TAB.join(tokens) + gff3.NL
+        elif not line.endswith(gff3.NL):
+            line += gff3.NL
+        ofd.write(line)
         #
-    sys.stdout.write(str(f))
+        s = summary.get(seqid, None)
+        if s is None:
+            s = summary[seqid] = [seqid, 0, 0]
+        if tokens[4] != '.' and int(tokens[4]) > s[1]:
+            s[1] = int(tokens[4])
+        s[2] += 1
+    return [ summary[c] for c in sorted(summary) ]
+
+#
+def findInput (indir, strain, exclude=None) :
+    """
+    Returns the path of the input GFF3 file for the named strain in indir, or None if there is none.
+    Looks for Ensembl's name, <Strain>.*.gff3[.gz], then <strain>.gff3[.gz].
+    The file named exclude (the output, if indir is also the output directory) is never returned.
+    """
+    ensembl = strain[:1].upper() + strain[1:] + '.*'
+    for pat in [ensembl + '.gff3.gz', ensembl + '.gff3', strain + '.gff3.gz', strain + '.gff3']:
+        fnames = [ f for f in sorted(glob.glob(os.path.join(indir, pat)))
+            if not (exclude and os.path.abspath(f) == os.path.abspath(exclude)) ]
+        if fnames:
+            return fnames[-1]
+    return None
+
+def prepStrain (task) :
+    """
+    Batch mode worker. Prepares one strain's file, writing the prepared features, duplicates
+    report, and chromosome manifest. Returns (strain, number of features written, number of duplicates, seconds).
+    """
+    strain, fname, outdir, chrsdir = task
+    t0 = time.time()
+    ofname = os.path.join(outdir, strain + '.gff3')
+    tmpname = '%s.%d.tmp' % (ofname, os.getpid())
+    ifd = bgzf.openText(fname)
+    ofd = open(tmpname, 'w')
+    dups = []
+    summary = prepLines(ifd, ofd, dups)
+    ifd.close()
+    ofd.close()
+    os.rename(tmpname, ofname)
+    #
+    dname = os.path.join(outdir, strain + DUPS_EXT)
+    tmpname = '%s.%d.tmp' % (dname, os.getpid())
+    fd = open(tmpname, 'w')
+    fd.write('name\tmgiId\tid\tline\n')
+    for d in dups:
+        fd.write('%s\t%s\t%s\t%d\n' % d)
+    fd.close()
+    os.rename(tmpname, dname)
+    #
+    features.writeChromosomeManifest(os.path.join(chrsdir, strain + '.chrs.tsv'), summary)
+    return (strain, sum([ s[2] for s in summary ]), len(dups), round(time.time() - t0, 3))
+
+def goBatch (args) :
+    strains = [ s.strip() for s in open(args.strainList, 'r') ]
+    strains = [ s for s in strains if s and s != 'strain' ]
+    tasks = []
+    for s in strains:
+        fname = findInput(args.indir, s, os.path.join(args.outdir, s + '.gff3'))
+        if fname is None:
+            sys.stderr.write('No input file for %s in %s. Skipped.\n' % (s, args.indir))
+            continue
+        tasks.append((s, fname, args.outdir, args.chrsdir))
+    for d in [args.outdir, args.chrsdir]:
+        if not os.path.isdir(d):
+            os.makedirs(d)
+    jobs = args.jobs or multiprocessing.cpu_count()
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap_unordered(prepStrain, tasks)
+    else:
+        pool = None
+        results = (prepStrain(t) for t in tasks)
+    for i,(s, n, ndups, secs) in enumerate(results):
+        sys.stderr.write('[%d/%d] %s: %d features, %d duplicates (%.1f s)\n' % (i+1, len(tasks), s, n, ndups, secs))
+    if pool:
+        pool.close()
+        pool.join()
+
+#
+def main () :
+    parser = argparse.ArgumentParser(description='Prepare Ensembl GFF3 files for generate.py: make the MGI id the ID of each gene.')
+    parser.add_argument('input', metavar='INPUT', nargs='?', default='-',
+        help='Ensembl GFF3 file (plain, gzip, or BGZF). (default: stdin)')
+    parser.add_argument('--region', dest='region', metavar='REGION',
+        help='Prepare only the lines in REGION, chr or chr:start-end. Not with --all.')
+    parser.add_argument('--all', dest='strainList', metavar='STRAINLIST',
+        help='Batch mode. Prepare every strain listed in STRAINLIST (one name per line). Otherwise, reads stdin and writes stdout.')
+    parser.add_argument('--indir', dest='indir', default='.', metavar='DIR',
+        help='Batch mode. Directory containing the (optionally gzipped) Ensembl GFF3 files. (default: %(default)s)')
+    parser.add_argument('--outdir', dest='outdir', default='.', metavar='DATADIR',
+        help='Batch mode. Directory where the prepared <strain>.gff3 files (and duplicates reports) are written. (default: %(default)s)')
+    parser.add_argument('--chrs-dir', dest='chrsdir', metavar='OUTDIR',
+        help='Batch mode. Directory where the chromosome manifests are written. (default: DATADIR)')
+    parser.add_argument('-j', dest='jobs', type=int, metavar='N',
+        help='Batch mode. Number of worker processes. (default: number of CPUs)')
+    args = parser.parse_args()
+    if args.region is not None:
+        if args.strainList:
+            parser.error('--region cannot be used with --all.')
+        try:
+            bgzf.parseRegion(args.region)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.strainList:
+        args.chrsdir = args.chrsdir or args.outdir
+        goBatch(args)
+        return
+    if args.region is not None:
+        lines = bgzf.regionLines(args.input, args.region)
+    else:
+        lines = bgzf.openText(args.input)
+    dups = []
+    prepLines(lines, sys.stdout, dups)
+    for d in dups:
+        sys.stderr.write("Duplicate detected (%s %s %s #%d).\n" % d)
+
+#
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+'''
+summary.py
+
+Per-pair summary statistics of block files, and the strains x strains matrix of them
+that lets a landing view pick out interesting pairs without loading every block file.
+
+For each pair, the statistics (of the full resolution blocks) are:
+    blocks          number of blocks
+    genes           number of gene pairs in them (sum of blockCount)
+    inversions      blocks with orientation "-"
+    translocations  blocks whose A and B chromosomes differ
+    inflated        blocks whose inflation (1/blockRatio, as in the viewer) is at least INFLATION_THRESHOLD
+    inflatedBp      total A length (bp) of the inflated blocks
+    aBp             total A length (bp) of all the blocks
+    indels          indel blocks (generate.py --indels), which are not counted in the others
+generate.py accumulates them as it writes each block (see add), so no extra pass over the blocks
+is needed. In batch mode, it writes them for every pair to
+    OUTDIR/summary.json     { version, inflationThreshold, strains, stats, matrix }, where matrix maps
+                            each statistic to a list of rows, one per A strain, each with one
+                            value per B strain (null if the pair was not generated)
+    OUTDIR/summary.tsv      one line per pair: A, B, and the statistics
+Pairs that are not recomputed keep their statistics from the previous summary.tsv.
+
+Usage (summarizes the existing block files of the strains in OUTDIR/strainList.tsv):
+    python summary.py OUTDIR
+'''
+import json
+import os
+import sys
+
+VERSION = '1'
+SUMMARY_JSON = 'summary.json'
+SUMMARY_TSV = 'summary.tsv'
+
+# Blocks at least this inflated are counted as inflated. This must match the default
+# inflationThreshold in viewer.js.
+INFLATION_THRESHOLD = 1.1
+
+# The statistics, in output order.
+STATS = [
+    'blocks',
+    'genes',
+    'inversions',
+    'translocations',
+    'inflated',
+    'inflatedBp',
+    'aBp',
+    'indels',
+]
+
+#
+def newSummary () :
+    """
+    Returns an empty summary: a dict with each of STATS set to 0.
+    """
+    return dict.fromkeys(STATS, 0)
+
+def add (s, r) :
+    """
+    Adds one block to summary s. r is the block's row: its values in the order of the
+    TSV columns (either as written, or as strings read back from a block file).
+    """
+    if not r[4] or not r[5]:
+        s['indels'] += 1
+        return
+    s['blocks'] += 1
+    s['genes'] += int(r[1])
+    if r[2] == '-':
+        s['inversions'] += 1
+    if r[4] != r[5]:
+        s['translocations'] += 1
+    alen = int(r[6])
+    s['aBp'] += alen
+    # the ratio as the viewer sees it (two decimals); 0.00 is infinitely inflated
+    ratio = float(r[3])
+    if ratio == 0 or 1.0 / ratio >= INFLATION_THRESHOLD:
+        s['inflated'] += 1
+        s['inflatedBp'] += alen
+
+def summarizeFile (fname) :
+    """
+    Returns the summary of the named TSV block file.
+    """
+    s = newSummary()
+    fd = open(fname, 'r')
+    fd.readline()
+    for line in fd:
+        add(s, line.split('\t', 7))
+    fd.close()
+    return s
+
+#
+def readTsv (fname) :
+    """
+    Reads a summary.tsv file. Returns a dict from pair name ("A-B") to summary,
+    or an empty dict if there is no such file.
+    """
+    summaries = {}
+    if not os.path.exists(fname):
+        return summaries
+    fd = open(fname, 'r')
+    names = fd.readline()[:-1].split('\t')
+    if names[2:] != STATS:
+        # written with other statistics; start over
+        fd.close()
+        return summaries
+    for line in fd:
+        r = line[:-1].split('\t')
+        summaries['%s-%s' % (r[0], r[1])] = dict(zip(STATS, map(int, r[2:])))
+    fd.close()
+    return summaries
+
+def write (outdir, strains, summaries) :
+    """
+    Writes OUTDIR/summary.json and OUTDIR/summary.tsv (each atomically) for the given strains,
+    from a dict from pair name ("A-B") to summary. Pairs not in summaries are null in the
+    JSON matrix, and omitted from the TSV.
+    """
+    matrix = {}
+    for stat in STATS:
+        matrix[stat] = []
+        for a in strains:
+            row = []
+            for b in strains:
+                s = summaries.get('%s-%s' % (a, b), None)
+                row.append(s[stat] if s else None)
+            matrix[stat].append(row)
+    fname = os.path.join(outdir, SUMMARY_JSON)
+    tmpname = '%s.%d.tmp' % (fname, os.getpid())
+    fd = open(tmpname, 'w')
+    json.dump({
+        'version' : VERSION,
+        'inflationThreshold' : INFLATION_THRESHOLD,
+        'strains' : strains,
+        'stats' : STATS,
+        'matrix' : matrix,
+    }, fd, separators=(',', ':'), sort_keys=True)
+    fd.write('\n')
+    fd.close()
+    os.rename(tmpname, fname)
+    #
+    fname = os.path.join(outdir, SUMMARY_TSV)
+    tmpname = '%s.%d.tmp' % (fname, os.getpid())
+    fd = open(tmpname, 'w')
+    fd.write('\t'.join(['A', 'B'] + STATS) + '\n')
+    for a in strains:
+        for b in strains:
+            s = summaries.get('%s-%s' % (a, b), None)
+            if s:
+                fd.write('\t'.join([a, b] + [ str(s[stat]) for stat in STATS ]) + '\n')
+    fd.close()
+    os.rename(tmpname, fname)
+
+#
+def main () :
+    if len(sys.argv) != 2:
+        sys.stderr.write('Usage: python summary.py OUTDIR\n')
+        sys.exit(1)
+    outdir = sys.argv[1]
+    fd = open(os.path.join(outdir, 'strainList.tsv'), 'r')
+    strains = [ s.strip() for s in fd ]
+    fd.close()
+    strains = [ s for s in strains if s and s != 'strain' ]
+    summaries = {}
+    for a in strains:
+        for b in strains:
+            fname = os.path.join(outdir, '%s-%s.tsv' % (a, b))
+            if os.path.exists(fname):
+                summaries['%s-%s' % (a, b)] = summarizeFile(fname)
+    write(outdir, strains, summaries)
+
+#
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+'''
+synserve.py
+
+A long-running HTTP service that computes synteny blocks on demand.
+
+Rather than precomputing the block files for every pair of strains (generate.py --all),
+the service keeps each strain's projected features in memory (read once, at startup with
+--preload, or on first use), and computes the blocks for a pair the first time it is requested.
+It serves the same URLs the viewer fetches from the output directory:
+    /output/strainList.tsv          the strains (from --strains, or the GFF3 files in DATADIR)
+    /output/<strain>.chrs.tsv       a strain's chromosome manifest
+    /output/<A>-<B>.tsv             the blocks for strains A and B
+    /output/<A>-<B>.lod<RES>.tsv    a coarsened level of them (see lod.py)
+    /stats                          JSON: cache size and hit rates, strains loaded, compute times
+Any other path is served as a static file from ROOT (so the viewer itself can be served too).
+Binary block files (.blk) are not served; the viewer falls back to the TSV.
+
+Computed block files are kept in an LRU cache with a size budget (--cache-mb).
+Concurrent requests for a pair that is being computed wait for that computation
+rather than starting another.
+
+Generator options (e.g., -AB, --engine, --chain-gap) can be given after "--"; they apply to every pair.
+Options that write other files, or blocks the viewer does not expect, are rejected: --all, --stream,
+--binary, --lod, --metrics, --region, --mirror, --verify-mirror, --indels, and --ids ranges.
+
+Example:
+    python synserve.py --datadir ../data --root .. --port 8000 -- --chain-gap 2
+'''
+import argparse
+import BaseHTTPServer
+import blockfile
+import cStringIO
+import collections
+import features
+import generate
+import glob
+import json
+import lod
+import os
+import re
+import SimpleHTTPServer
+import SocketServer
+import sys
+import threading
+import time
+import urlparse
+
+#
+class Cache:
+    """
+    A thread safe LRU cache with a total size budget (the sum of len(value) over the entries),
+    or no limit if budget is None. get() computes missing values, and concurrent gets of
+    the same missing key share one computation.
+    """
+    def __init__ (self, budget=None):
+        self.budget = budget
+        self.entries = collections.OrderedDict() # key -> value, least recently used first
+        self.size = 0
+        self.pending = {} # key -> [event, value, exception] for computations in progress
+        self.lock = threading.Lock()
+        self.stats = {
+            'hits' : 0,
+            'misses' : 0,
+            'coalesced' : 0,
+            'evictions' : 0,
+        }
+
+    def get (self, key, compute) :
+        """
+        Returns the value for key, calling compute() to make it if it is not cached.
+        """
+        with self.lock:
+            if key in self.entries:
+                value = self.entries.pop(key)
+                self.entries[key] = value
+                self.stats['hits'] += 1
+                return value
+            p = self.pending.get(key, None)
+            if p is None:
+                p = self.pending[key] = [threading.Event(), None, None]
+                self.stats['misses'] += 1
+                mine = True
+            else:
+                self.stats['coalesced'] += 1
+                mine = False
+        if not mine:
+            p[0].wait()
+            if p[2] is not None:
+                raise p[2]
+            return p[1]
+        #
+        try:
+            p[1] = compute()
+        except Exception as e:
+            p[2] = e
+        with self.lock:
+            del self.pending[key]
+            if p[2] is None:
+                self.put(key, p[1])
+        p[0].set()
+        if p[2] is not None:
+            raise p[2]
+        return p[1]
+
+    def put (self, key, value) :
+        """
+        Adds an entry, evicting the least recently used entries to stay within the budget.
+        A value larger than the whole budget is not cached. Call with the lock held.
+        """
+        if self.budget is not None and len(value) > self.budget:
+            return
+        self.entries[key] = value
+        self.size += len(value)
+        while self.budget is not None and self.size > self.budget:
+            k, v = self.entries.popitem(last=False)
+            self.size -= len(v)
+            self.stats['evictions'] += 1
+
+    def getStats (self) :
+        with self.lock:
+            s = dict(self.stats)
+            s['entries'] = len(self.entries)
+            s['bytes'] = self.size
+            s['budget'] = self.budget
+            n = s['hits'] + s['misses'] + s['coalesced']
+            s['hitRate'] = round(1.0 * (s['hits'] + s['coalesced']) / n, 4) if n else None
+            return s
+
+#
+class SyntenyService:
+
+    def __init__ (self, args, genArgs):
+        """
+        Initializes the service from the command line args, and the generator's (parsed) args.
+        """
+        self.args = args
+        self.genArgs = genArgs
+        if args.strains:
+            self.strains = generate.SyntenyBlockGenerator().readStrainList(args.strains)
+        else:
+            self.strains = sorted([ os.path.basename(f)[:-5] for f in glob.glob(os.path.join(args.datadir, '*.gff3')) ])
+        self.strainSet = set(self.strains)
+        self.cache = Cache(args.cacheMb << 20) # block files and chromosome manifests
+        self.genomes = Cache() # strain -> sorted list of ProjectedFeatures
+        self.AB = None
+        if genArgs.fileAB:
+            self.AB = generate.SyntenyBlockGenerator().readAB(genArgs.fileAB)
+        self.lock = threading.Lock()
+        self.computeSeconds = {} # pair -> seconds taken to compute it
+        self.started = time.time()
+
+    def genome (self, strain) :
+        """
+        Returns the sorted features of the named strain, reading them the first time.
+        """
+        def load () :
+            fname = os.path.join(self.args.datadir, strain + '.gff3')
+            sys.stderr.write('Reading %s\n' % fname)
+            feats = features.internFeatures(features.load(fname, cache=not self.genArgs.noCache))
+            generate.sortFeatures(feats)
+            return feats
+        return self.genomes.get(strain, load)
+
+    def chromosomes (self, strain) :
+        """
+        Returns the text of the strain's chromosome manifest.
+        """
+        return self.cache.get(strain + '.chrs', lambda: features.formatChromosomeManifest(
+            features.chromosomeSummary(self.genome(strain))))
+
+    def blocks (self, a, b, resolution=None) :
+        """
+        Returns the text of the block file for strains a and b, at the given resolution
+        (None for full resolution).
+        """
+        name = '%s-%s' % (a, b)
+        if resolution is not None:
+            return self.cache.get('%s.lod%d' % (name, resolution), lambda: self.coarsen(a, b, resolution))
+        return self.cache.get(name, lambda: self.computePair(a, b))
+
+    def computePair (self, a, b) :
+        t0 = time.time()
+        sbg = generate.SyntenyBlockGenerator()
+        sbg.args = self.genArgs
+        sbg.ofd = cStringIO.StringIO()
+        sbg.goPair(self.genome(a), self.genome(b), self.AB)
+        with self.lock:
+            self.computeSeconds['%s-%s' % (a, b)] = round(time.time() - t0, 6)
+        return sbg.ofd.getvalue()
+
+    def coarsen (self, a, b, resolution) :
+        # each level is coarsened from the next finer of the standard ones, as lod.writeLevels does
+        finer = [ r for r in lod.LEVELS if r < resolution ]
+        text = self.blocks(a, b, finer[-1] if finer else None)
+        rows = [ line.split('\t') for line in text.split('\n')[1:-1] ]
+        out = cStringIO.StringIO()
+        out.write('\t'.join(blockfile.TSV_COLUMNS + ['nMerged']) + '\n')
+        for r in lod.coarsen(rows, resolution):
+            out.write('\t'.join(map(str, r)) + '\n')
+        return out.getvalue()
+
+    def splitPair (self, name) :
+        """
+        Splits a pair name, A-B, into its strain names (which may themselves contain dashes).
+        Returns (A, B), or None if it is not a pair of known strains.
+        """
+        for m in re.finditer('-', name):
+            a, b = name[:m.start()], name[m.end():]
+            if a in self.strainSet and b in self.strainSet:
+                return (a, b)
+        return None
+
+    def getStats (self) :
+        with self.lock:
+            return {
+                'uptime' : round(time.time() - self.started, 3),
+                'cache' : self.cache.getStats(),
+                'strains' : len(self.strains),
+                'strainsLoaded' : dict([ (s, len(f)) for s, f in self.genomes.entries.items() ]),
+                'pairsComputed' : len(self.computeSeconds),
+                'computeSeconds' : dict(self.computeSeconds),
+            }
+
+#
+class Handler (SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+    OUTPUT_RE = re.compile(r'^/output/(.+?)(\.lod(\d+))?\.tsv$')
+
+    def do_GET (self) :
+        if not self.route(urlparse.urlparse(self.path).path):
+            SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+    def route (self, path) :
+        """
+        Answers a request for a computed resource. Returns True if it was answered,
+        or None if the path is a static file.
+        """
+        svc = self.server.service
+        if path == '/stats':
+            return self.reply(json.dumps(svc.getStats(), indent=2, sort_keys=True) + '\n', 'application/json')
+        m = self.OUTPUT_RE.match(path)
+        if not m:
+            return None
+        name = m.group(1)
+        if name == 'strainList' and not m.group(2):
+            return self.reply('strain\n' + ''.join([ s + '\n' for s in svc.strains ]))
+        if name.endswith('.chrs') and name[:-5] in svc.strainSet and not m.group(2):
+            return self.reply(svc.chromosomes(name[:-5]))
+        ab = svc.splitPair(name)
+        if ab is None:
+            return None
+        resolution = int(m.group(3)) if m.group(2) else None
+        try:
+            return self.reply(svc.blocks(ab[0], ab[1], resolution))
+        except Exception as e:
+            self.send_error(500, 'Cannot compute %s: %s' % (name, e))
+            return True
+
+    def reply (self, body, ctype='text/tab-separated-values') :
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+class Server (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+#
+def main () :
+    argv = sys.argv[1:]
+    genArgv = []
+    if '--' in argv:
+        i = argv.index('--')
+        argv, genArgv = argv[:i], argv[i+1:]
+    parser = argparse.ArgumentParser(description='Serve synteny blocks, computed on demand.')
+    parser.add_argument('--datadir', default='data', metavar='DATADIR',
+        help='Directory containing the strain GFF3 files (<strain>.gff3). (default: %(default)s)')
+    parser.add_argument('--strains', metavar='STRAINLIST',
+        help='File listing the strains to serve. (default: every GFF3 file in DATADIR)')
+    parser.add_argument('--root', default='.', metavar='ROOT',
+        help='Directory from which other paths (e.g., index.html, viewer.js) are served. (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8000,
+        help='Port to listen on. (default: %(default)s)')
+    parser.add_argument('--host', default='localhost',
+        help='Address to listen on. (default: %(default)s)')
+    parser.add_argument('--cache-mb', dest='cacheMb', type=int, default=512, metavar='MB',
+        help='Size budget of the block file cache, in MB. (default: %(default)s)')
+    parser.add_argument('--preload', action='store_true', default=False,
+        help='Read every strain at startup, rather than on first use.')
+    args = parser.parse_args(argv)
+    # the working directory becomes ROOT
+    args.datadir = os.path.abspath(args.datadir)
+    # the generator validates its own options; -A and -B are placeholders
+    sbg = generate.SyntenyBlockGenerator()
+    sbg.parseArgs(['-A', '-', '-B', '-'] + genArgv)
+    genArgs = sbg.args
+    if genArgs.fileAB:
+        genArgs.fileAB = os.path.abspath(genArgs.fileAB)
+    for opt in ['strainList', 'stream', 'binary', 'lod', 'metrics', 'region', 'mirror', 'verifyMirror', 'indels', 'idsPrefix']:
+        if getattr(genArgs, opt):
+            parser.error('Generator option not supported by the service: %s' % opt)
+    if genArgs.ids == 'ranges':
+        parser.error('Generator option not supported by the service: ids ranges')
+    #
+    svc = SyntenyService(args, genArgs)
+    if args.preload:
+        for s in svc.strains:
+            svc.genome(s)
+    os.chdir(args.root)
+    server = Server((args.host, args.port), Handler)
+    server.service = svc
+    sys.stderr.write('Serving %d strains on http://%s:%d/\n' % (len(svc.strains), args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+#
+if __name__ == "__main__":
+    main()
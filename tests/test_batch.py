@@ -0,0 +1,112 @@
+'''
+test_batch.py
+
+generate.py --all: batch mode and its manifest, which lets a rerun skip the pairs whose
+inputs and options are unchanged.
+'''
+import json
+import os
+import unittest
+
+import testutil
+
+STRAINS = ['a', 'b', 'c']
+PAIRS = [ '%s-%s' % (a, b) for a in STRAINS for b in STRAINS ]
+
+#
+class BatchTest (testutil.TempDirTestCase):
+
+    def setUp (self) :
+        testutil.TempDirTestCase.setUp(self)
+        self.datadir, self.slist = testutil.writeStrains(self.dir)
+        self.outdir = self.path('output')
+
+    def batch (self, *args) :
+        """
+        Runs a batch over the three strains with the given extra args. Returns the metrics.
+        """
+        mname = self.path('metrics.json')
+        testutil.run('generate.py', ['--all', self.slist, '--datadir', self.datadir,
+            '--outdir', self.outdir, '-j', '1', '--metrics', mname] + list(args))
+        return json.loads(testutil.readFile(mname))
+
+    def outputs (self) :
+        """
+        Returns {pair name : (mtime, contents)} of the block files.
+        """
+        out = {}
+        for p in PAIRS:
+            fname = os.path.join(self.outdir, p + '.tsv')
+            out[p] = (os.stat(fname).st_mtime, testutil.readFile(fname))
+        return out
+
+    def assertComputed (self, metrics, pairs) :
+        self.assertEqual(sorted(metrics['pairs'].keys()), sorted(pairs))
+        self.assertEqual(metrics['counts'], {'total' : 9, 'computed' : len(pairs)})
+
+    def age (self) :
+        """
+        Sets back the mtimes of the outputs, so a rewrite shows up.
+        """
+        for f in os.listdir(self.outdir):
+            os.utime(os.path.join(self.outdir, f), (0, 0))
+
+    def test_rerun (self) :
+        self.assertComputed(self.batch(), PAIRS)
+        self.age()
+        before = self.outputs()
+        self.assertComputed(self.batch(), [])
+        self.assertEqual(self.outputs(), before)
+        manifest = json.loads(testutil.readFile(os.path.join(self.outdir, 'manifest.json')))
+        self.assertEqual(sorted(manifest['pairs'].keys()), PAIRS)
+
+    def test_touchedStrain (self) :
+        self.batch()
+        self.age()
+        before = self.outputs()
+        # a new mtime but the same contents: nothing to do
+        os.utime(os.path.join(self.datadir, 'c.gff3'), None)
+        self.assertComputed(self.batch(), [])
+        self.assertEqual(self.outputs(), before)
+
+    def test_changedStrain (self) :
+        self.batch()
+        self.age()
+        before = self.outputs()
+        fname = os.path.join(self.datadir, 'c.gff3')
+        text = testutil.readFile(fname).replace('\t+\t', '\t-\t', 1)
+        fd = open(fname, 'wb')
+        fd.write(text)
+        fd.close()
+        withC = [ p for p in PAIRS if 'c' in p ]
+        self.assertComputed(self.batch(), withC)
+        after = self.outputs()
+        for p in PAIRS:
+            if p in withC:
+                self.assertNotEqual(after[p][0], before[p][0])
+            else:
+                self.assertEqual(after[p], before[p])
+
+    def test_missingOutput (self) :
+        self.batch()
+        os.remove(os.path.join(self.outdir, 'b-a.tsv'))
+        self.assertComputed(self.batch(), ['b-a'])
+
+    def test_force (self) :
+        self.batch()
+        before = self.outputs()
+        self.assertComputed(self.batch('--force'), PAIRS)
+        after = self.outputs()
+        self.assertEqual([ after[p][1] for p in PAIRS ], [ before[p][1] for p in PAIRS ])
+
+    def test_options (self) :
+        self.batch()
+        # an option that changes the output recomputes everything
+        self.assertComputed(self.batch('--chain-gap', '2'), PAIRS)
+        self.assertComputed(self.batch('--chain-gap', '2'), [])
+        # the engine does not change the output
+        self.assertComputed(self.batch('--chain-gap', '2', '--engine', 'numpy'), [])
+
+#
+if __name__ == "__main__":
+    unittest.main()
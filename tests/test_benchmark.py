@@ -0,0 +1,31 @@
+'''
+test_benchmark.py
+
+benchmark.py: every configuration agrees with its reference.
+'''
+import json
+import unittest
+
+import testutil
+
+#
+class BenchmarkTest (testutil.TempDirTestCase):
+
+    def test_configs (self) :
+        out = self.path('bench.json')
+        testutil.run('benchmark.py', ['--sizes', '2000', '--chromosomes', '4', '--inversions', '0.02',
+            '--translocations', '0.02', '--workdir', self.path('work'), '--out', out,
+            '--configs', 'numpy-chain', 'stream', 'mirror'])
+        runs = json.loads(testutil.readFile(out))['runs']
+        # the references are run too, first
+        self.assertEqual([ (r['config'], r['reference']) for r in runs ], [
+            ('python', 'python'), ('stream', 'python'), ('mirror', 'python'),
+            ('python-chain', 'python-chain'), ('numpy-chain', 'python-chain')])
+        for r in runs:
+            self.assertTrue(r['matchesReference'], r['config'])
+        self.assertTrue(runs[2]['mirrorVerified'])
+        self.assertNotEqual(runs[0]['md5'], runs[3]['md5'])
+
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+'''
+test_bgzf.py
+
+bgzf.py: BGZF files, and region reads through the region index (FILE.gfi), which must
+return exactly the lines a scan of the file finds.
+'''
+import gzip
+import os
+import random
+import unittest
+
+import testutil
+import bgzf
+
+#
+def writeSorted (fname, seed='bgzf') :
+    """
+    Writes a GFF3 file grouped by seqid and sorted by start, of short features with some long
+    ones (spanning many index windows) among them. Returns its lines.
+    """
+    r = random.Random(seed)
+    lines = []
+    for chr in ['1', '2', 'X']:
+        pos = 1
+        for i in xrange(2000):
+            pos += r.randint(0, 3000)
+            length = r.choice([10, 500, 5000, 200000]) if r.random() < 0.05 else r.randint(1, 2000)
+            lines.append('%s\tx\tgene\t%d\t%d\t.\t+\t.\tID=MGI:%d\n' % (chr, pos, pos + length, len(lines) + 1))
+    fd = open(fname, 'w')
+    fd.write('##gff-version 3\n' + ''.join(lines))
+    fd.close()
+    return lines
+
+def scan (lines, region) :
+    chr, start, end = bgzf.parseRegion(region)
+    return [ l for l in lines if l.split('\t')[0] == chr
+        and (start is None or int(l.split('\t')[4]) >= start) and (end is None or int(l.split('\t')[3]) <= end) ]
+
+#
+class RegionTest (testutil.TempDirTestCase):
+
+    def setUp (self) :
+        testutil.TempDirTestCase.setUp(self)
+        self.plain = self.path('f.gff3')
+        self.lines = writeSorted(self.plain)
+        self.bgzf = self.path('f.gff3.gz')
+        bgzf.compress(self.plain, self.bgzf)
+        r = random.Random('regions')
+        self.regions = ['1', 'X', 'Y', '2:1-1', '2:1,000-2,000,000', '1:2999990-3000010']
+        for i in xrange(100):
+            s = r.randint(1, 3500000)
+            self.regions.append('%s:%d-%d' % (r.choice(['1', '2', 'X']), s, s + r.choice([0, 100, 20000, 400000])))
+
+    def test_types (self) :
+        gz = self.path('g.gff3.gz')
+        fd = gzip.open(gz, 'wb')
+        fd.write(testutil.readFile(self.plain))
+        fd.close()
+        self.assertEqual([ bgzf.fileType(f) for f in [self.plain, self.bgzf, gz] ], ['plain', 'bgzf', 'gzip'])
+        text = testutil.readFile(self.plain)
+        for f in [self.bgzf, gz]:
+            fd = bgzf.openText(f)
+            self.assertEqual(''.join(fd), text)
+            fd.close()
+
+    def test_seek (self) :
+        fd = bgzf.openText(self.bgzf)
+        offsets = []
+        while True:
+            vo = fd.tell()
+            line = fd.readline()
+            if not line:
+                break
+            offsets.append((vo, line))
+        # lines in several blocks
+        self.assertTrue(len(set([ vo >> 16 for vo, line in offsets ])) > 2)
+        for vo, line in random.Random('seek').sample(offsets, 200) + offsets[-1:]:
+            fd.seek(vo)
+            self.assertEqual(fd.readline(), line)
+        fd.close()
+
+    def test_regions (self) :
+        for fname in [self.plain, self.bgzf]:
+            for region in self.regions:
+                self.assertEqual(list(bgzf.regionLines(fname, region)), scan(self.lines, region), (fname, region))
+            # the index was written, and is used as is
+            idx = bgzf.readIndex(fname)
+            self.assertEqual(sorted(idx['seqids'].keys()), ['1', '2', 'X'])
+            self.assertEqual(idx, bgzf.buildIndex(fname))
+
+    def test_staleIndex (self) :
+        list(bgzf.regionLines(self.plain, '1'))
+        lines = writeSorted(self.plain, 'other')
+        st = os.stat(self.plain)
+        os.utime(self.plain, (st.st_atime, st.st_mtime + 10))
+        for region in self.regions[:20]:
+            self.assertEqual(list(bgzf.regionLines(self.plain, region)), scan(lines, region), region)
+
+    def test_unsorted (self) :
+        # a file that cannot be indexed is read through
+        fname = self.path('u.gff3')
+        lines = self.lines[1::2] + self.lines[0::2]
+        fd = open(fname, 'w')
+        fd.write(''.join(lines))
+        fd.close()
+        self.assertRaises(ValueError, bgzf.buildIndex, fname)
+        for region in self.regions[:20]:
+            self.assertEqual(list(bgzf.regionLines(fname, region)), scan(lines, region), region)
+        self.assertFalse(os.path.exists(bgzf.indexPath(fname)))
+
+    def test_parseRegion (self) :
+        self.assertEqual(bgzf.parseRegion('chr1'), ('chr1', None, None))
+        self.assertEqual(bgzf.parseRegion('1:1,000-2,000'), ('1', 1000, 2000))
+        self.assertEqual(bgzf.parseRegion('HSCHR1:1:5-5'), ('HSCHR1:1', 5, 5))
+        for bad in ['', '1:0-5', '1:6-5']:
+            self.assertRaises(ValueError, bgzf.parseRegion, bad)
+
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+'''
+test_blockfile.py
+
+blockfile.py: a .blk file (and its .ids table) holds exactly the blocks of the TSV, and the ids
+--ids ranges leaves out follow from the .a.ids and .b.ids files.
+'''
+import unittest
+
+import testutil
+import blockfile
+
+#
+class BlockFileTest (testutil.TempDirTestCase):
+
+    def setUp (self) :
+        testutil.TempDirTestCase.setUp(self)
+        self.fa, self.fb, self.fab = testutil.writeGenomes(self.dir, 2000)
+
+    def generate (self, *args) :
+        """
+        Runs generate.py with --binary. Returns the TSV's (column names, rows), and the .blk file name.
+        """
+        tsv, blk = self.path('blocks.tsv'), self.path('blocks.blk')
+        testutil.run('generate.py', ['-A', self.fa, '-B', self.fb, '--binary', blk] + list(args), tsv)
+        names, rows = testutil.readRows(tsv)
+        return names, rows, blk
+
+    def rows (self, blk) :
+        """
+        Returns the TSV rows reconstructed from a .blk file.
+        """
+        hdr, cols = blockfile.read(blk)
+        ids = blockfile.readIds(blk)
+        rows = []
+        for i in xrange(hdr['n']):
+            c = dict([ (name, cols[name][i]) for name, tc in blockfile.COLUMNS ])
+            rows.append([ str(x) for x in [
+                c['blockId'], c['blockCount'], '+' if c['blockOri'] == 1 else '-',
+                '%1.2f' % (c['blockRatio100'] / 100.0),
+                hdr['aChrs'][c['aChr']], hdr['bChrs'][c['bChr']],
+                c['aEnd'] - c['aStart'] + 1, c['bEnd'] - c['bStart'] + 1,
+                c['aStart'], c['bStart'], c['aEnd'], c['bEnd'], c['aIndex'], c['bIndex'],
+                ','.join(ids[i]) ]])
+            self.assertEqual(c['nIds'], len(ids[i]))
+        return hdr, cols, rows
+
+    def checkIndexes (self, hdr, cols) :
+        n = hdr['n']
+        for chr, (first, end) in hdr['aRanges'].items():
+            self.assertEqual(set([ hdr['aChrs'][cols['aChr'][i]] for i in xrange(first, end) ]), set([chr]))
+        self.assertEqual(sum([ e - f for f, e in hdr['aRanges'].values() ]), n)
+        order = list(cols['bOrder'])
+        self.assertEqual(sorted(order), range(n))
+        keys = [ (cols['bChr'][i], cols['bStart'][i]) for i in order ]
+        self.assertEqual(keys, sorted(keys))
+        for chr, (first, end) in hdr['bRanges'].items():
+            self.assertEqual(set([ hdr['bChrs'][cols['bChr'][order[j]]] for j in xrange(first, end) ]), set([chr]))
+
+    def test_roundTrip (self) :
+        names, rows, blk = self.generate()
+        self.assertEqual(names, blockfile.TSV_COLUMNS)
+        hdr, cols, brows = self.rows(blk)
+        self.assertTrue(len(rows) > 50, len(rows))
+        self.assertEqual(brows, rows)
+        self.assertEqual(list(cols['nMerged']), [1] * len(rows))
+        self.checkIndexes(hdr, cols)
+
+    def test_chained (self) :
+        names, rows, blk = self.generate('--chain-gap', '3')
+        hdr, cols, brows = self.rows(blk)
+        self.assertEqual(brows, [ r[:15] for r in rows ])
+        self.assertEqual(list(cols['nMerged']), [ int(r[15]) for r in rows ])
+        self.assertTrue(max(cols['nMerged']) > 1)
+        self.checkIndexes(hdr, cols)
+
+    def test_convert (self) :
+        # blockfile.py converts a TSV to the same .blk file generate.py writes
+        names, rows, blk = self.generate()
+        out = self.path('converted.blk')
+        testutil.run('blockfile.py', [self.path('blocks.tsv'), out])
+        self.assertEqual(testutil.readFile(out), testutil.readFile(blk))
+        self.assertEqual(testutil.readFile(blockfile.idsPath(out)), testutil.readFile(blockfile.idsPath(blk)))
+
+    def test_notBlockFile (self) :
+        fname = self.path('x.blk')
+        fd = open(fname, 'w')
+        fd.write('blockId\tblockCount\n')
+        fd.close()
+        self.assertRaises(ValueError, blockfile.read, fname)
+
+#
+def rangeIds (row, aIds, bIds) :
+    """
+    Returns the ids of a block row whose ids are left to its index ranges (--ids ranges): its
+    pairs in A order, each pair's A ID then B ID (B descending in a "-" block), each once.
+    """
+    n, ai, bi = int(row[1]), int(row[12]), int(row[13])
+    a, b = aIds[ai:ai + n], bIds[bi:bi + n]
+    if row[2] == '-':
+        b.reverse()
+    ids = []
+    for x in [ x for pair in zip(a, b) for x in pair ]:
+        if x not in ids:
+            ids.append(x)
+    return ','.join(ids)
+
+#
+class RangeIdsTest (testutil.TempDirTestCase):
+    """
+    --ids ranges: the ids left empty follow from the .a.ids and .b.ids files, and are those
+    --ids inline writes.
+    """
+    def setUp (self) :
+        testutil.TempDirTestCase.setUp(self)
+        self.fa, self.fb, self.fab = testutil.writeGenomes(self.dir, 2000)
+
+    def readIds (self, base) :
+        return [ testutil.readFile(f).split('\n')[:-1] for f in blockfile.rangeIdsPaths(base) ]
+
+    def checkRows (self, inline, ranged, base) :
+        aIds, bIds = self.readIds(base)
+        names, rows = testutil.readRows(inline)
+        rnames, rrows = testutil.readRows(ranged)
+        self.assertEqual(rnames, names)
+        self.assertEqual(len(rrows), len(rows))
+        empty = 0
+        for r, rr in zip(rows, rrows):
+            self.assertEqual(rr[:14] + rr[15:], r[:14] + r[15:])
+            if rr[14]:
+                # only chained and indel blocks keep their ids
+                self.assertTrue(not (r[4] and r[5]) or int(r[15]) > 1, r)
+                self.assertEqual(rr[14], r[14])
+            else:
+                empty += 1
+                self.assertEqual(rangeIds(rr, aIds, bIds), r[14], r)
+        self.assertTrue(empty > 10)
+
+    def check (self, *args) :
+        inline, ranged = self.path('inline.tsv'), self.path('ranged.tsv')
+        base = self.path('ranged')
+        testutil.run('generate.py', ['-A', self.fa, '-B', self.fb] + list(args), inline)
+        testutil.run('generate.py', ['-A', self.fa, '-B', self.fb, '--ids', 'ranges', '--ids-prefix', base] + list(args), ranged)
+        self.checkRows(inline, ranged, base)
+
+    def test_ranges (self) :
+        self.check()
+
+    def test_abFile (self) :
+        self.check('-AB', self.fab)
+
+    def test_chainedIndels (self) :
+        self.check('--chain-gap', '3', '--indels')
+
+    def test_mirror (self) :
+        # the mirrored pair's ID files are named for its block file
+        self.check('--mirror', self.path('mirror.tsv'), '--chain-gap', '3')
+        inline = self.path('mirror.inline.tsv')
+        testutil.run('generate.py', ['-A', self.fa, '-B', self.fb, '--mirror', inline, '--chain-gap', '3'], self.path('x.tsv'))
+        self.checkRows(inline, self.path('mirror.tsv'), self.path('mirror'))
+
+    def test_binary (self) :
+        # the .blk file's ids table has every block's ids
+        inline, blk = self.path('inline.tsv'), self.path('ranged.blk')
+        testutil.run('generate.py', ['-A', self.fa, '-B', self.fb], inline)
+        testutil.run('generate.py', ['-A', self.fa, '-B', self.fb, '--ids', 'ranges', '--ids-prefix', self.path('ranged'),
+            '--binary', blk], self.path('ranged.tsv'))
+        names, rows = testutil.readRows(inline)
+        self.assertEqual([ ','.join(ids) for ids in blockfile.readIds(blk) ], [ r[14] for r in rows ])
+
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+'''
+test_chain.py
+
+generate.py --chain-gap: SyntenyBlockGenerator.chainBlocks, against its rules case by case,
+and against a direct (quadratic) implementation of them on random blocks.
+'''
+import argparse
+import random
+import unittest
+
+import testutil
+import blockfile
+import generate
+
+def block (id, ori, aIndex, bIndex, count=1, aChr=1, bChr=1) :
+    """
+    Returns a strict block of count pairs from the given indexes (with positions 10 bp per index).
+    """
+    return blockfile.Block(id, ori, count, aChr, aIndex * 10, (aIndex + count) * 10 - 1, aIndex,
+        bChr, bIndex * 10, (bIndex + count) * 10 - 1, bIndex, blockfile.IDS_PAIRS, aIndex)
+
+def indel (id, aIndex) :
+    return blockfile.Block(id, 1, 1, 1, aIndex * 10, aIndex * 10 + 9, aIndex, None, 0, 0, 0, blockfile.IDS_A, aIndex)
+
+def chain (blocks, k) :
+    """
+    Returns the chained blocks, as lists of the ids of their parts.
+    """
+    sbg = generate.SyntenyBlockGenerator()
+    sbg.args = argparse.Namespace(chainGap=k)
+    return [ [ p.id for p in c.parts ] for c in sbg.chainBlocks(blocks) ]
+
+def directChain (blocks, k) :
+    """
+    The chaining rules, checked against every chain so far.
+    """
+    chains = []
+    first = 0 # the first chain on the current A chromosome
+    for blk in blocks:
+        if blk.isIndel():
+            chains.append({ 'ids' : [blk.id] })
+            continue
+        if chains and blk.aChr != chains[-1].get('aChr', blk.aChr):
+            first = len(chains)
+        head = blk.bIndex if blk.ori == 1 else -(blk.bIndex + blk.count - 1)
+        tail = blk.bIndex + blk.count - 1 if blk.ori == 1 else -blk.bIndex
+        best = None
+        for n in xrange(first, len(chains)):
+            c = chains[n]
+            if c.get('key') != (blk.aChr, blk.bChr, blk.ori) or blk.aIndex - c['aHi'] - 1 > k:
+                continue
+            d = head - c['tip'] - 1
+            if -k <= d <= k and (best is None or (abs(d), d < 0, n) < best[0]):
+                best = ((abs(d), d < 0, n), c)
+        if best is None:
+            chains.append({ 'ids' : [blk.id], 'key' : (blk.aChr, blk.bChr, blk.ori), 'aChr' : blk.aChr,
+                'aHi' : blk.aIndex + blk.count - 1, 'tip' : tail })
+        else:
+            c = best[1]
+            c['ids'].append(blk.id)
+            c['aHi'] = blk.aIndex + blk.count - 1
+            c['tip'] = max(c['tip'], tail)
+    return [ c['ids'] for c in chains ]
+
+#
+class ChainTest (unittest.TestCase):
+
+    def test_gapB (self) :
+        # block 1 covers B indexes 0-1; up to k=2 B indexes may lie between it and the next
+        self.assertEqual(chain([ block(1, 1, 0, 0, 2), block(2, 1, 3, 4) ], 2), [[1, 2]])
+        self.assertEqual(chain([ block(1, 1, 0, 0, 2), block(2, 1, 3, 5) ], 2), [[1], [2]])
+        # k=0 chains only blocks that touch in both genomes
+        self.assertEqual(chain([ block(1, 1, 0, 0, 2), block(2, 1, 2, 2) ], 0), [[1, 2]])
+        self.assertEqual(chain([ block(1, 1, 0, 0, 2), block(2, 1, 3, 2) ], 0), [[1], [2]])
+
+    def test_gapA (self) :
+        self.assertEqual(chain([ block(1, 1, 0, 0, 2), block(2, 1, 4, 2) ], 2), [[1, 2]])
+        self.assertEqual(chain([ block(1, 1, 0, 0, 2), block(2, 1, 5, 2) ], 2), [[1], [2]])
+
+    def test_reverse (self) :
+        # a "-" chain continues downwards in B: block 1 covers B 10-11, so B 7 is 2 indexes on
+        self.assertEqual(chain([ block(1, -1, 0, 10, 2), block(2, -1, 2, 7) ], 2), [[1, 2]])
+        self.assertEqual(chain([ block(1, -1, 0, 10, 2), block(2, -1, 2, 6) ], 2), [[1], [2]])
+        # ... not upwards
+        self.assertEqual(chain([ block(1, -1, 0, 10, 2), block(2, -1, 2, 12) ], 0), [[1], [2]])
+        self.assertEqual(chain([ block(1, 1, 0, 10, 2), block(2, 1, 2, 12) ], 0), [[1, 2]])
+
+    def test_transposed (self) :
+        # up to k indexes back in B (a local transposition)
+        self.assertEqual(chain([ block(1, 1, 0, 10, 3), block(2, 1, 3, 11) ], 2), [[1, 2]])
+        self.assertEqual(chain([ block(1, 1, 0, 10, 3), block(2, 1, 3, 10) ], 2), [[1], [2]])
+
+    def test_differentKey (self) :
+        self.assertEqual(chain([ block(1, 1, 0, 0), block(2, -1, 1, 1) ], 3), [[1], [2]])
+        self.assertEqual(chain([ block(1, 1, 0, 0), block(2, 1, 1, 1, bChr=2) ], 3), [[1], [2]])
+        self.assertEqual(chain([ block(1, 1, 0, 0), block(2, 1, 1, 1, aChr=2) ], 3), [[1], [2]])
+
+    def test_nearest (self) :
+        # the chain whose tip is nearest wins; at equal distance, the one the block follows (rather than overlaps)
+        blocks = [ block(1, 1, 0, 0), block(2, 1, 1, 10), block(3, 1, 2, 8) ]
+        self.assertEqual(chain(blocks, 3), [[1], [2, 3]])
+        blocks = [ block(1, 1, 0, 10), block(2, 1, 1, 16), block(3, 1, 2, 14) ]
+        self.assertEqual(chain(blocks, 3), [[1, 3], [2]])
+
+    def test_interleaved (self) :
+        # two chains interleaved in A; each continues after the other's blocks
+        blocks = [ block(1, 1, 0, 0), block(2, 1, 1, 100), block(3, 1, 2, 1), block(4, 1, 3, 101) ]
+        self.assertEqual(chain(blocks, 1), [[1, 3], [2, 4]])
+
+    def test_closed (self) :
+        # a chain far behind in A is closed, however well the block would fit it in B
+        blocks = [ block(1, 1, 0, 0) ] + [ block(i, 1, i * 2, 1000 + i * 100) for i in range(2, 10) ] + [ block(10, 1, 20, 1) ]
+        self.assertEqual(chain(blocks, 2), [ [i] for i in range(1, 11) ])
+
+    def test_indels (self) :
+        blocks = [ block(1, 1, 0, 0), indel(2, 1), block(3, 1, 2, 1) ]
+        self.assertEqual(chain(blocks, 1), [[1, 3], [2]])
+
+    def test_random (self) :
+        r = random.Random('chain')
+        for trial in range(200):
+            blocks = []
+            a = 0
+            b = r.randint(0, 50)
+            aChr = 1
+            for i in range(r.randint(1, 60)):
+                if r.random() < 0.05:
+                    aChr += 1
+                if r.random() < 0.1:
+                    b = r.randint(0, 200)
+                count = r.randint(1, 3)
+                ori = r.choice([1, -1])
+                blocks.append(block(i + 1, ori, a, b, count, aChr, r.choice([1, 1, 2])))
+                a += count + r.choice([0, 0, 0, 1, 2, 4])
+                b += r.randint(-6, 8)
+                b = max(b, 0)
+            k = r.choice([0, 1, 2, 3, 5])
+            self.assertEqual(chain(blocks, k), directChain(blocks, k), (trial, k))
+
+#
+if __name__ == "__main__":
+    unittest.main()
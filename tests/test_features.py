@@ -0,0 +1,231 @@
+'''
+test_features.py
+
+features.py: the projected feature cache (FILE.fcache), the input formats, chromosome manifests,
+and interning.
+'''
+import gzip
+import mmap
+import os
+import threading
+import unittest
+
+import testutil
+import features
+
+#
+class FeatureCacheTest (testutil.TempDirTestCase):
+
+    def setUp (self) :
+        testutil.TempDirTestCase.setUp(self)
+        self.fa, self.fb, self.fab = testutil.writeGenomes(self.dir, 500)
+        self.digests = 0
+        self.fileDigest = features.fileDigest
+        def counting (fname) :
+            self.digests += 1
+            return self.fileDigest(fname)
+        features.fileDigest = counting
+
+    def tearDown (self) :
+        features.fileDigest = self.fileDigest
+        testutil.TempDirTestCase.tearDown(self)
+
+    def header (self) :
+        fd = open(features.cachePath(self.fa), 'rb')
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        hdr,_ = features.readHeader(mm)
+        mm.close()
+        fd.close()
+        return hdr
+
+    def assertSame (self, feats, expected) :
+        self.assertEqual(map(repr, feats), map(repr, expected))
+
+    def test_roundTrip (self) :
+        parsed = features.load(self.fa, cache=False)
+        self.assertSame(features.load(self.fa), parsed)
+        self.assertTrue(os.path.exists(features.cachePath(self.fa)))
+        # the second load reads the cache, not the file
+        iterate = features.gff3.iterate
+        def fail (*args, **kw) :
+            self.fail('parsed a cached file')
+        features.gff3.iterate = fail
+        try:
+            self.assertSame(features.load(self.fa), parsed)
+        finally:
+            features.gff3.iterate = iterate
+        self.assertEqual(self.header()['n'], len(parsed))
+
+    def test_touchedFile (self) :
+        parsed = features.load(self.fa)
+        st = os.stat(self.fa)
+        os.utime(self.fa, (st.st_atime, st.st_mtime + 10))
+        self.digests = 0
+        self.assertSame(features.load(self.fa), parsed)
+        self.assertEqual(self.digests, 1)
+        # the new mtime is recorded, so the digest is not checked again
+        self.assertEqual(self.header()['mtime'], os.stat(self.fa).st_mtime)
+        self.assertSame(features.load(self.fa), parsed)
+        self.assertEqual(self.digests, 1)
+
+    def test_changedFile (self) :
+        features.load(self.fa)
+        # same size, different content
+        text = testutil.readFile(self.fa).replace('\t+\t', '\t-\t', 1)
+        fd = open(self.fa, 'wb')
+        fd.write(text)
+        fd.close()
+        self.assertSame(features.load(self.fa), features.load(self.fa, cache=False))
+
+    def test_bigCoordinate (self) :
+        fd = open(self.fa, 'a')
+        fd.write('1\tx\tgene\t22705082400\t22705107266\t.\t+\t.\tID=MGI:99999999\n')
+        fd.close()
+        feats = features.load(self.fa)
+        self.assertEqual(feats[-1].start, 22705082400)
+        self.assertFalse(os.path.exists(features.cachePath(self.fa)))
+
+#
+class InputFormatTest (testutil.TempDirTestCase):
+    """
+    MouseMine exports and feature caches are read as the same features as the GFF3 they stand for.
+    """
+    def setUp (self) :
+        testutil.TempDirTestCase.setUp(self)
+        self.fa, self.fb, self.fab = testutil.writeGenomes(self.dir, 500)
+
+    def assertSame (self, feats, expected) :
+        self.assertTrue(len(expected) > 100)
+        self.assertEqual(map(repr, feats), map(repr, expected))
+
+    def test_guessFormat (self) :
+        export = self.path('a.tsv')
+        testutil.writeExport(self.fa, export)
+        features.load(self.fa)
+        for fname, format in [ (self.fa, 'gff3'), (export, 'mousemine'), (self.path('a.txt.gz'), 'mousemine'),
+                               (features.cachePath(self.fa), 'fcache'), ('-', 'gff3') ]:
+            if not os.path.exists(fname) and fname != '-':
+                fd = gzip.open(fname, 'wb')
+                fd.write(testutil.readFile(export))
+                fd.close()
+            self.assertEqual(features.guessFormat(fname), format, fname)
+
+    def test_mousemine (self) :
+        export, converted = self.path('a.tsv'), self.path('a.gff3')
+        testutil.writeExport(self.fa, export)
+        testutil.convert(export, converted)
+        expected = features.load(converted, cache=False)
+        self.assertSame(features.load(export, cache=False), expected)
+        # compressed, and cached like GFF3
+        fd = gzip.open(export + '.gz', 'wb')
+        fd.write(testutil.readFile(export))
+        fd.close()
+        self.assertSame(features.load(export + '.gz'), expected)
+        self.assertTrue(os.path.exists(features.cachePath(export + '.gz')))
+        self.assertSame(features.load(export + '.gz'), expected)
+
+    def test_fcache (self) :
+        expected = features.load(self.fa)
+        fname = self.path('a.fcache')
+        os.rename(features.cachePath(self.fa), fname)
+        os.remove(self.fa)
+        # read without the file it was made from
+        self.assertSame(features.load(fname, format='fcache'), expected)
+        self.assertSame(features.load(fname, cache=False), expected)
+        self.assertRaises(ValueError, features.load, self.fb, cache=False, format='fcache')
+
+#
+class ChromosomeManifestTest (testutil.TempDirTestCase):
+
+    def expected (self, fname) :
+        """
+        Returns the manifest rows for the named GFF3 file, counted directly from its lines.
+        """
+        rows = {}
+        for line in testutil.readFile(fname).split('\n'):
+            if line and not line.startswith('#'):
+                toks = line.split('\t')
+                r = rows.setdefault(toks[0], [toks[0], 0, 0])
+                r[1] = max(r[1], int(toks[4]))
+                r[2] += 1
+        return sorted(rows.values())
+
+    def test_summary (self) :
+        fa, fb, fab = testutil.writeGenomes(self.dir, 500, chromosomes=3)
+        for fname in [fa, fb]:
+            expected = self.expected(fname)
+            self.assertEqual(len(expected), 3)
+            # parsed, and read back from the cache
+            self.assertEqual(features.chromosomeSummary(features.load(fname)), expected)
+            self.assertEqual(features.chromosomeSummary(features.load(fname)), expected)
+            self.assertEqual(features.chromosomeSummary(features.internFeatures(features.load(fname, cache=False))), expected)
+
+    def test_batch (self) :
+        datadir, slist = testutil.writeStrains(self.dir, 500)
+        outdir = self.path('output')
+        testutil.run('generate.py', ['--all', slist, '--datadir', datadir, '--outdir', outdir, '-j', '1'])
+        for s in ['a', 'b', 'c']:
+            expected = self.expected(os.path.join(datadir, s + '.gff3'))
+            names, rows = testutil.readRows(os.path.join(outdir, s + '.chrs.tsv'))
+            self.assertEqual(names, ['chr', 'length', 'count'])
+            self.assertEqual([ [r[0], int(r[1]), int(r[2])] for r in rows ], expected)
+
+#
+class InternTest (testutil.TempDirTestCase):
+
+    def test_mgiNumber (self) :
+        for n in [0, 1, 97, 1234567, 2 ** 40]:
+            self.assertEqual(features.mgiNumber(features.mgiId(n)), n)
+        for ID in ['MGI:', 'MGI:x1', 'MGI:012', 'MGI:-1', 'MGI:1.5', 'mgi:1', 'ENSMUSG00000000001', '1']:
+            self.assertEqual(features.mgiNumber(ID), None, ID)
+
+    def test_chromosomeTable (self) :
+        t = features.ChromosomeTable()
+        names = ['2', '10', '1', 'X', '2', 'MT', '1']
+        codes = [ t.code(n) for n in names ]
+        self.assertEqual(codes, [0, 1, 2, 3, 0, 4, 2])
+        self.assertEqual([ t.name(c) for c in codes ], names)
+        ranks = t.ranks()
+        self.assertEqual(sorted(set(names)), sorted(set(names), key=lambda n: ranks[t.code(n)]))
+
+    def test_chromosomeTableThreads (self) :
+        t = features.ChromosomeTable()
+        names = [ str(i % 50) for i in range(2000) ]
+        results = []
+        def work (offset) :
+            results.append([ (n, t.code(n)) for n in names[offset:] + names[:offset] ])
+        threads = [ threading.Thread(target=work, args=(i * 7,)) for i in range(8) ]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        self.assertEqual(len(t.names), 50)
+        for r in results:
+            for n, c in r:
+                self.assertEqual(t.name(c), n)
+
+    def test_internPairs (self) :
+        pairs = [['MGI:1', 'MGI:2'], ['MGI:1', 'ENS:9'], ['ENS:8', 'ENS:9'], ['MGI:07', 'MGI:3']]
+        interned = features.internPairs(pairs)
+        self.assertEqual([ p[0] for p in interned[:2] ], [1, 1])
+        self.assertEqual(interned[0][1], 2)
+        # other IDs become distinct negative ints, the same for the same ID
+        others = [interned[1][1], interned[2][0], interned[2][1], interned[3][0]]
+        self.assertTrue(max(others) < 0)
+        self.assertEqual(others[0], others[2])
+        self.assertEqual(len(set(others)), 3)
+        self.assertEqual(interned[3][1], 3)
+
+    def test_internFeatures (self) :
+        fa, fb, fab = testutil.writeGenomes(self.dir, 300, nonMgi=0.1)
+        parsed = features.load(fa, cache=False)
+        interned = features.internFeatures(features.load(fa, cache=False))
+        for f, i in zip(parsed, interned):
+            self.assertEqual(i.ID, features.mgiNumber(f.ID))
+            self.assertEqual(features.CHROMOSOMES.name(i.seqid), f.seqid)
+            self.assertEqual((i.start, i.end, i.strand), (f.start, f.end, f.strand))
+        self.assertTrue(None in [ i.ID for i in interned ])
+
+#
+if __name__ == "__main__":
+    unittest.main()
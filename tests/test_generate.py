@@ -0,0 +1,228 @@
+'''
+test_generate.py
+
+generate.py: the alternative engines, modes, and input formats must write the same blocks as
+the default (python engine, one process, in memory, from GFF3).
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+import testutil
+import features
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#
+class GenerateTestCase (unittest.TestCase):
+    """
+    Shares one synthetic pair of genomes among the tests of a class. self.generate runs
+    generate.py on them, and assertSameBlocks compares two runs.
+    """
+    @classmethod
+    def setUpClass (cls) :
+        cls.dir = tempfile.mkdtemp()
+        cls.fa, cls.fb, cls.fab = testutil.writeGenomes(cls.dir, 3000)
+        cls.outputs = {}
+
+    @classmethod
+    def tearDownClass (cls) :
+        shutil.rmtree(cls.dir)
+
+    def generate (self, *args) :
+        """
+        Runs generate.py -A A.gff3 -B B.gff3 with the given extra args (remembering the outputs).
+        Returns its output.
+        """
+        if args not in self.outputs:
+            self.outputs[args] = testutil.run('generate.py', ['-A', self.fa, '-B', self.fb] + list(args))
+        return self.outputs[args]
+
+    def assertSameBlocks (self, args, refArgs=()) :
+        """
+        Asserts that the run with args writes exactly the blocks of the run with refArgs.
+        """
+        ref = self.generate(*refArgs)
+        self.assertTrue(ref.count('\n') > 100)
+        self.assertEqual(self.generate(*args), ref)
+
+#
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class NumpyEngineTest (GenerateTestCase):
+
+    def test_sharedIds (self) :
+        self.assertSameBlocks(('--engine', 'numpy'))
+
+    def test_abFile (self) :
+        self.assertSameBlocks(('--engine', 'numpy', '-AB', self.fab), ('-AB', self.fab))
+
+    def test_chained (self) :
+        self.assertSameBlocks(('--engine', 'numpy', '--chain-gap', '3'), ('--chain-gap', '3'))
+
+#
+class ParallelTest (GenerateTestCase):
+    """
+    -j N: blocks generated per A chromosome in worker processes.
+    """
+    def test_jobs (self) :
+        for n in ['2', '3', '8']:
+            self.assertSameBlocks(('-j', n))
+
+    def test_abFile (self) :
+        self.assertSameBlocks(('-j', '3', '-AB', self.fab), ('-AB', self.fab))
+
+    def test_chained (self) :
+        self.assertSameBlocks(('-j', '3', '--chain-gap', '3'), ('--chain-gap', '3'))
+
+#
+class StreamTest (GenerateTestCase):
+    """
+    --stream: A read and processed one chromosome at a time.
+    """
+    def test_stream (self) :
+        self.assertSameBlocks(('--stream',))
+
+    def test_abFile (self) :
+        self.assertSameBlocks(('--stream', '-AB', self.fab), ('-AB', self.fab))
+
+    def test_chained (self) :
+        self.assertSameBlocks(('--stream', '--chain-gap', '3'), ('--chain-gap', '3'))
+
+    def test_ungrouped (self) :
+        # A's chromosomes interleaved: read into memory as usual
+        lines = testutil.readFile(self.fa).split('\n')[:-1]
+        header = [ l for l in lines if l.startswith('#') ]
+        feats = [ l for l in lines if not l.startswith('#') ]
+        fname = os.path.join(self.dir, 'A.ungrouped.gff3')
+        fd = open(fname, 'w')
+        fd.write('\n'.join(header + feats[1::2] + feats[0::2]) + '\n')
+        fd.close()
+        out = testutil.run('generate.py', ['-A', fname, '-B', self.fb, '--stream'])
+        self.assertEqual(out, self.generate())
+
+#
+class MirrorTest (GenerateTestCase):
+    """
+    --mirror: the B-A blocks derived from the A-B ones must be those of a direct B-A run.
+    """
+    def checkMirror (self, *args) :
+        fname = os.path.join(self.dir, 'B-A.tsv')
+        out = self.generate('--mirror', fname, *args)
+        self.assertEqual(out, self.generate(*args))
+        direct = testutil.run('generate.py', ['-A', self.fb, '-B', self.fa] + list(args))
+        self.assertTrue(direct.count('\n') > 100)
+        self.assertEqual(testutil.readFile(fname), direct)
+
+    def test_mirror (self) :
+        self.checkMirror()
+
+    def test_chained (self) :
+        self.checkMirror('--chain-gap', '3')
+
+    def test_indels (self) :
+        self.checkMirror('--indels')
+
+    def test_verify (self) :
+        # exits 1 if the check fails
+        self.generate('--verify-mirror', '--chain-gap', '3')
+
+#
+class BatchMirrorTest (testutil.TempDirTestCase):
+
+    def test_batch (self) :
+        datadir, slist = testutil.writeStrains(self.dir, 1000)
+        outs = {}
+        for opts in [(), ('--mirror',)]:
+            outdir = self.path('output' + ''.join(opts))
+            testutil.run('generate.py', ['--all', slist, '--datadir', datadir, '--outdir', outdir, '-j', '1'] + list(opts))
+            outs[opts] = dict([ (f, testutil.readFile(os.path.join(outdir, f)))
+                for f in os.listdir(outdir) if f.endswith('.tsv') and f != 'manifest.tsv' ])
+        self.assertEqual(len(outs[()]), len(outs[('--mirror',)]))
+        self.assertTrue('c-a.tsv' in outs[()])
+        for f in outs[()]:
+            self.assertEqual(outs[('--mirror',)][f], outs[()][f], f)
+
+#
+class InputFormatTest (GenerateTestCase):
+    """
+    --informat: MouseMine exports and feature caches give the blocks of the GFF3 they stand for.
+    """
+    def test_mousemine (self) :
+        args = {}
+        for g, fname in [ ('A', self.fa), ('B', self.fb) ]:
+            export = os.path.join(self.dir, g + '.tsv')
+            testutil.writeExport(fname, export)
+            converted = os.path.join(self.dir, g + '.cvt.gff3')
+            testutil.convert(export, converted)
+            args[g] = (export, converted)
+        for opts in [ [], ['--chain-gap', '3'] ]:
+            expected = testutil.run('generate.py', ['-A', args['A'][1], '-B', args['B'][1], '--no-cache'] + opts)
+            self.assertTrue(expected.count('\n') > 100)
+            for informat in [ [], ['--informat', 'mousemine'] ]:
+                out = testutil.run('generate.py', ['-A', args['A'][0], '-B', args['B'][0]] + informat + opts)
+                self.assertEqual(out, expected, informat + opts)
+
+    def test_fcache (self) :
+        # (the first run writes the caches)
+        self.generate()
+        caches = []
+        for fname in [self.fa, self.fb]:
+            cache = fname + '.copy.fcache'
+            shutil.copy(features.cachePath(fname), cache)
+            caches.append(cache)
+        for opts in [ [], ['--informat', 'fcache'] ]:
+            self.assertEqual(testutil.run('generate.py', ['-A', caches[0], '-B', caches[1]] + opts), self.generate())
+
+    def test_batch (self) :
+        datadir = os.path.join(self.dir, 'data')
+        os.mkdir(datadir)
+        slist = os.path.join(self.dir, 'strains.txt')
+        fd = open(slist, 'w')
+        fd.write('a\nb\n')
+        fd.close()
+        for s, fname in [ ('a', self.fa), ('b', self.fb) ]:
+            testutil.writeExport(fname, os.path.join(datadir, s + '.tsv'))
+            testutil.convert(os.path.join(datadir, s + '.tsv'), os.path.join(datadir, s + '.gff3'))
+        outs = []
+        for opts in [ [], ['--informat', 'mousemine'] ]:
+            outdir = os.path.join(self.dir, 'output' + ''.join(opts))
+            testutil.run('generate.py', ['--all', slist, '--datadir', datadir, '--outdir', outdir, '-j', '1', '--no-cache'] + opts)
+            outs.append([ testutil.readFile(os.path.join(outdir, p + '.tsv')) for p in ['a-a', 'a-b', 'b-a', 'b-b'] ])
+        self.assertEqual(outs[1], outs[0])
+
+#
+class OneVsManyTest (testutil.TempDirTestCase):
+    """
+    -B with several files: the reference, A, is read and prepared once for all the partners.
+    """
+    def setUp (self) :
+        testutil.TempDirTestCase.setUp(self)
+        self.datadir, slist = testutil.writeStrains(self.dir, 2000)
+        self.fnames = dict([ (s, os.path.join(self.datadir, s + '.gff3')) for s in 'abc' ])
+
+    def checkPartners (self, *args) :
+        outdir = self.path('output')
+        fb = [ self.fnames[s] for s in 'abc' ]
+        testutil.run('generate.py', ['-A', self.fnames['a'], '-B'] + fb + ['--outdir', outdir] + list(args))
+        for s in 'abc':
+            single = testutil.run('generate.py', ['-A', self.fnames['a'], '-B', self.fnames[s]] + list(args))
+            self.assertTrue(single.count('\n') > 1)
+            self.assertEqual(testutil.readFile(os.path.join(outdir, 'a-%s.tsv' % s)), single, s)
+
+    def test_partners (self) :
+        self.checkPartners('-j', '1')
+
+    def test_workers (self) :
+        self.checkPartners('-j', '3', '--chain-gap', '2')
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy (self) :
+        self.checkPartners('-j', '1', '--engine', 'numpy')
+
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+'''
+test_gff3.py
+
+gff3.py: Feature and LazyFeature parsing, and parallel iteration.
+'''
+import pickle
+import unittest
+
+import testutil
+import gff3
+
+LINES = [
+    '1\tMGI\tgene\t100\t200\t.\t+\t.\tID=MGI:1;Name=Abc;Dbxref=ENSEMBL:X1,NCBI:11\n',
+    '2\tMGI\tpseudogene\t5\t6\t.\t-\t.\tName=Def;ID=MGI:2\n',
+    'X\tMGI\tgene\t.\t.\t.\t.\t.\tID=a%3Bb;Note=semi%3Bcolon\n',
+    'Y\tMGI\tgene\t7\t8\t0\t+\t1\tName=NoId\n',
+    'MT\tMGI\tgene\t1\t2\t.\t+\t.\tID=MGI:3',
+]
+
+#
+class LazyFeatureTest (testutil.TempDirTestCase):
+
+    def test_sameAsFeature (self) :
+        for line in LINES:
+            f = gff3.Feature(line)
+            lf = gff3.LazyFeature(line)
+            for name in gff3.Feature.fields[:8]:
+                self.assertEqual(getattr(lf, name), getattr(f, name))
+            self.assertEqual(getattr(lf, 'ID', None), getattr(f, 'ID', None))
+            self.assertEqual(lf.attributes, f.attributes)
+            self.assertEqual(lf[0:4], f[0:4])
+            self.assertEqual(str(lf), str(f))
+
+    def test_lazyID (self) :
+        lf = gff3.LazyFeature(LINES[0])
+        self.assertEqual(lf.ID, 'MGI:1')
+        # reading the ID does not parse column 9
+        self.assertTrue(lf._attrs is None)
+        self.assertEqual(lf.Name, 'Abc')
+        self.assertEqual(lf.attributes['Dbxref'], ['ENSEMBL:X1', 'NCBI:11'])
+        # quoted IDs fall back to a full parse
+        self.assertEqual(gff3.LazyFeature(LINES[2]).ID, 'a;b')
+        self.assertFalse(hasattr(gff3.LazyFeature(LINES[3]), 'ID'))
+
+    def test_setID (self) :
+        lf = gff3.LazyFeature(LINES[1])
+        lf.ID = 'MGI:99'
+        self.assertEqual(lf.attributes['ID'], 'MGI:99')
+        self.assertEqual(lf.attributes['Name'], 'Def')
+        self.assertEqual(gff3.Feature(str(lf)).ID, 'MGI:99')
+
+    def test_iterate (self) :
+        fname = self.path('f.gff3')
+        fd = open(fname, 'w')
+        fd.write(gff3.HEADER + ''.join([ l if l.endswith('\n') else l + '\n' for l in LINES ]))
+        fd.close()
+        eager = [ str(f) for f in gff3.iterate(fname) ]
+        lazy = [ str(f) for f in gff3.iterate(fname, lazy=True) ]
+        self.assertEqual(lazy, eager)
+        self.assertEqual(len(lazy), len(LINES))
+
+#
+class IterateParallelTest (testutil.TempDirTestCase):
+    """
+    iterateParallel yields what iterate does, however the file is split.
+    """
+    def setUp (self) :
+        testutil.TempDirTestCase.setUp(self)
+        self.fname = self.path('f.gff3')
+        lines = [ gff3.HEADER ]
+        for i in range(300):
+            lines.append(LINES[i % len(LINES)].rstrip('\n') + '\n')
+            if i % 7 == 0:
+                lines.append('# a comment\n')
+            if i % 11 == 0:
+                lines.append(gff3.GROUPSEP)
+        # no newline at the end
+        lines.append(LINES[-1])
+        fd = open(self.fname, 'w')
+        fd.write(''.join(lines))
+        fd.close()
+
+    def parallel (self, **kw) :
+        return list(gff3.iterateParallel(self.fname, jobs=3, chunkBytes=500, **kw))
+
+    def test_features (self) :
+        for lazy in [False, True]:
+            serial = [ str(f) for f in gff3.iterate(self.fname, lazy=lazy) ]
+            self.assertEqual([ str(f) for f in self.parallel(lazy=lazy) ], serial)
+            self.assertEqual(len(serial), 301)
+
+    def test_groups (self) :
+        serial = [ [ str(f) for f in g ] for g in gff3.iterate(self.fname, returnGroups=True) ]
+        self.assertTrue(len(serial) > 20)
+        self.assertEqual([ [ str(f) for f in g ] for g in self.parallel(returnGroups=True) ], serial)
+
+    def test_columns (self) :
+        columns = ['seqid', 'start', 'end', 'strand', 'ID', 'Name']
+        serial = [ tuple([ getattr(f, c, None) for c in columns ]) for f in gff3.iterate(self.fname) ]
+        self.assertEqual(self.parallel(columns=columns), serial)
+        groups = self.parallel(columns=columns, returnGroups=True)
+        self.assertEqual([ x for g in groups for x in g ], serial)
+        # read serially, the same
+        self.assertEqual(list(gff3.iterateParallel(self.fname, columns=columns, jobs=1)), serial)
+
+    def test_splitFile (self) :
+        text = testutil.readFile(self.fname)
+        for n in [1, 2, 5, 50, 100000]:
+            ranges = gff3.splitFile(self.fname, n)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(text))
+            for (s, e), (s2, e2) in zip(ranges, ranges[1:]):
+                self.assertEqual(e, s2)
+                self.assertEqual(text[e - 1], '\n')
+
+    def test_pickle (self) :
+        for line in LINES:
+            for readId in [False, True]:
+                lf = gff3.LazyFeature(line)
+                if readId:
+                    getattr(lf, 'ID', None)
+                copy = pickle.loads(pickle.dumps(lf, pickle.HIGHEST_PROTOCOL))
+                self.assertEqual(str(copy), str(lf))
+                self.assertEqual(getattr(copy, 'ID', None), getattr(gff3.Feature(line), 'ID', None))
+                self.assertEqual(copy.attributes, lf.attributes)
+
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+'''
+test_liftover.py
+
+liftover.py: positions and intervals mapped through hand made blocks (and the command, on
+BED and GFF3), the block index against a scan, and block files written by generate.py --indels,
+whose indel blocks (which have an empty chromosome on one side) map nothing.
+
+Usage:
+    python tests/test_liftover.py
+'''
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+sys.path.insert(0, BIN)
+
+import benchmark
+import liftover
+
+#
+def syntheticArgs (**kw) :
+    """
+    Returns the rates for benchmark.SyntheticGenomes: few rearrangements, and many genes missing from B.
+    """
+    args = argparse.Namespace(seed='liftover', chromosomes=3, inversions=0.01, translocations=0.005,
+        missing=0.1, nonOneToOne=0.0, overlaps=0.0, nonMgi=0.0)
+    for k, v in kw.items():
+        setattr(args, k, v)
+    return args
+
+class IndelLiftOverTest (unittest.TestCase):
+
+    @classmethod
+    def setUpClass (cls) :
+        cls.dir = tempfile.mkdtemp()
+        fa, fb, fab = benchmark.SyntheticGenomes(syntheticArgs(), 2000).write(cls.dir)
+        cls.tsv = os.path.join(cls.dir, 'A-B.tsv')
+        cls.blk = os.path.join(cls.dir, 'A-B.blk')
+        ofd = open(cls.tsv, 'w')
+        subprocess.check_call([sys.executable, os.path.join(BIN, 'generate.py'),
+            '-A', fa, '-B', fb, '--no-cache', '--indels', '--binary', cls.blk], stdout=ofd)
+        ofd.close()
+        cls.rows = []
+        fd = open(cls.tsv, 'r')
+        names = fd.readline()[:-1].split('\t')
+        for line in fd:
+            cls.rows.append(dict(zip(names, line[:-1].split('\t'))))
+        fd.close()
+
+    @classmethod
+    def tearDownClass (cls) :
+        shutil.rmtree(cls.dir)
+
+    def deletions (self) :
+        return [ r for r in self.rows if r['aChr'] and not r['bChr'] ]
+
+    def test_hasDeletions (self) :
+        self.assertTrue(self.deletions())
+
+    def test_readBlocksSkipsIndels (self) :
+        nSynteny = len([ r for r in self.rows if r['aChr'] and r['bChr'] ])
+        for fname in [self.tsv, self.blk]:
+            blocks = liftover.readBlocks(fname)
+            self.assertEqual(len(blocks), nSynteny)
+            for b in blocks:
+                self.assertTrue(b['aChr'] and b['bChr'])
+
+    def test_deletionsUnmapped (self) :
+        for fname in [self.tsv, self.blk]:
+            lo = liftover.LiftOver(fname)
+            nUnmapped = 0
+            for r in self.deletions():
+                chr, start, end = r['aChr'], int(r['aStart']), int(r['aEnd'])
+                status, pieces = lo.mapInterval(chr, start, end)
+                # an indel does not break a synteny block, so a deletion may lie within one
+                for p in pieces:
+                    self.assertTrue(p[0])
+                    self.assertTrue(p[1] > 0)
+                if not lo.index.find(chr, start, end):
+                    self.assertEqual(status, 'unmapped')
+                    nUnmapped += 1
+            self.assertTrue(nUnmapped > 0)
+
+#
+def blk (id, ori, aChr, aStart, aEnd, bChr, bStart, bEnd) :
+    return { 'id' : id, 'ori' : ori, 'aChr' : aChr, 'aStart' : aStart, 'aEnd' : aEnd,
+        'bChr' : bChr, 'bStart' : bStart, 'bEnd' : bEnd }
+
+BLOCKS = [
+    blk(1, '+', '1', 1001, 2000, '5', 10001, 12000),
+    blk(2, '-', '1', 3001, 4000, '6', 501, 1500),
+    blk(3, '+', '2', 100, 100, '7', 50, 50),
+]
+
+class LiftOverTest (unittest.TestCase):
+
+    def setUp (self) :
+        self.lo = liftover.LiftOver(BLOCKS)
+
+    def test_mapPosition (self) :
+        m = self.lo.mapPosition
+        # "+": the A extent maps linearly onto the B extent (twice as long)
+        self.assertEqual(m('1', 1001), [('5', 10001, '+', 1)])
+        self.assertEqual(m('1', 2000), [('5', 12000, '+', 1)])
+        self.assertEqual(m('1', 1500), [('5', 10999, '+', 1)])
+        # "-": reversed
+        self.assertEqual(m('1', 3001), [('6', 1500, '-', 2)])
+        self.assertEqual(m('1', 4000), [('6', 501, '-', 2)])
+        # a block one base long
+        self.assertEqual(m('2', 100), [('7', 50, '+', 3)])
+        for chr, pos in [('1', 1000), ('1', 2001), ('1', 2500), ('2', 99), ('3', 1500)]:
+            self.assertEqual(m(chr, pos), [])
+
+    def test_mapInterval (self) :
+        m = self.lo.mapInterval
+        self.assertEqual(m('1', 1001, 2000), ('mapped', [('5', 10001, 12000, '+', 1)]))
+        # a "-" piece is still given start <= end
+        self.assertEqual(m('1', 3001, 3500), ('mapped', [('6', 1001, 1500, '-', 2)]))
+        # spans the end of a block
+        self.assertEqual(m('1', 1900, 2100), ('split', [('5', 11800, 12000, '+', 1)]))
+        # spans two blocks
+        status, pieces = m('1', 1500, 3500)
+        self.assertEqual(status, 'split')
+        self.assertEqual([ p[4] for p in pieces ], [1, 2])
+        self.assertEqual(pieces[1], ('6', 1001, 1500, '-', 2))
+        self.assertEqual(m('1', 2001, 3000), ('unmapped', []))
+        self.assertEqual(m('X', 1, 10 ** 9), ('unmapped', []))
+
+    def test_overlappingBlocks (self) :
+        # coarsened or chained blocks may overlap, and one may contain others
+        r = random.Random('liftover')
+        blocks = []
+        for i in range(300):
+            s = r.randint(1, 100000)
+            blocks.append(blk(i, '+', '1', s, s + r.choice([0, 10, 100, 5000, 40000]), '2', 1, 1000))
+        index = liftover.BlockIndex(list(blocks))
+        for i in range(300):
+            s = r.randint(1, 150000)
+            e = s + r.choice([0, 1, 50, 3000])
+            expected = sorted([ b['id'] for b in blocks if b['aStart'] <= e and b['aEnd'] >= s ])
+            self.assertEqual(sorted([ b['id'] for b in index.find('1', s, e) ]), expected)
+
+#
+class LiftOverCommandTest (unittest.TestCase):
+
+    def setUp (self) :
+        self.dir = tempfile.mkdtemp()
+        self.blocks = os.path.join(self.dir, 'A-B.tsv')
+        fd = open(self.blocks, 'w')
+        fd.write('blockId\tblockOri\taChr\tbChr\taStart\tbStart\taEnd\tbEnd\n')
+        for b in BLOCKS:
+            fd.write('%(id)d\t%(ori)s\t%(aChr)s\t%(bChr)s\t%(aStart)d\t%(bStart)d\t%(aEnd)d\t%(bEnd)d\n' % b)
+        fd.close()
+
+    def tearDown (self) :
+        shutil.rmtree(self.dir)
+
+    def lift (self, name, text, *args) :
+        """
+        Lifts over the given input text. Returns (counts, output, unmapped output).
+        """
+        fin, fout, funm = [ os.path.join(self.dir, n) for n in [name, 'out', 'unmapped'] ]
+        for fname, t in [(fin, text), (fout, ''), (funm, '')]:
+            fd = open(fname, 'w')
+            fd.write(t)
+            fd.close()
+        counts = liftover.LiftOverCommand().go([self.blocks, fin, '-o', fout, '--unmapped', funm] + list(args))
+        return counts, open(fout).read(), open(funm).read()
+
+    def test_bed (self) :
+        bed = 'track name=x\n1\t1000\t1500\tf\t0\t+\n1\t3000\t3500\tg\t0\t+\n1\t1899\t3500\th\n1\t2500\t2600\ti\n'
+        counts, out, unmapped = self.lift('in.bed', bed)
+        self.assertEqual(out, 'track name=x\n5\t10000\t10999\tf\t0\t+\n6\t1000\t1500\tg\t0\t-\n' +
+            '5\t11799\t12000\th\n6\t1000\t1500\th\n')
+        self.assertEqual(unmapped, '1\t2500\t2600\ti\n')
+        self.assertEqual(counts, { 'mapped' : 2, 'split' : 1, 'unmapped' : 1, 'pieces' : 4 })
+        counts, out, unmapped = self.lift('in.bed', bed, '--no-split')
+        self.assertEqual(unmapped, '1\t1899\t3500\th\n1\t2500\t2600\ti\n')
+        self.assertEqual(counts['pieces'], 2)
+
+    def test_gff3 (self) :
+        gff = '##gff-version 3\n1\tx\tgene\t3001\t3500\t.\t+\t.\tID=a\n'
+        counts, out, unmapped = self.lift('in.gff3', gff)
+        self.assertEqual(out, '##gff-version 3\n6\tx\tgene\t1001\t1500\t.\t-\t.\tID=a\n')
+
+#
+if __name__ == "__main__":
+    unittest.main()
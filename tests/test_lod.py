@@ -0,0 +1,103 @@
+'''
+test_lod.py
+
+lod.py: coarsened levels merge runs of collinear blocks, conserving their pairs.
+'''
+import unittest
+
+import testutil
+import lod
+
+def row (ori, aChr, aStart, aEnd, bChr, bStart, bEnd, count=1, ids='') :
+    """
+    Returns a TSV block row (with made up id, ratio, and indexes).
+    """
+    return [0, count, ori, '1.00', aChr, bChr, aEnd - aStart + 1, bEnd - bStart + 1,
+        aStart, bStart, aEnd, bEnd, aStart // 1000, bStart // 1000, ids]
+
+#
+class CoarsenTest (unittest.TestCase):
+
+    def merged (self, rows, res=1000) :
+        """
+        Returns the nMerged of each coarsened block.
+        """
+        return [ r[15] for r in lod.coarsen(rows, res) ]
+
+    def test_collinear (self) :
+        rows = [ row('+', '1', 0, 99, '2', 5000, 5099, 2, 'a,b'),
+                 row('+', '1', 500, 599, '2', 6000, 6099, 3, 'c'),
+                 row('+', '1', 1500, 1599, '2', 6500, 6599, 1, '') ]
+        merged = lod.coarsen(rows, 1000)
+        self.assertEqual(len(merged), 1)
+        m = merged[0]
+        self.assertEqual(m[0:3], [1, 6, '+'])
+        self.assertEqual(m[4:14], ['1', '2', 1600, 1600, 0, 5000, 1599, 6599, 0, 5])
+        self.assertEqual(m[14:], ['a,b,c', 3])
+        self.assertEqual(m[3], '1.00')
+
+    def test_reverse (self) :
+        # "-" blocks merge while descending in B
+        rows = [ row('-', '1', 0, 99, '2', 9000, 9099), row('-', '1', 200, 299, '2', 8000, 8099) ]
+        self.assertEqual(self.merged(rows), [2])
+        rows = [ row('-', '1', 0, 99, '2', 8000, 8099), row('-', '1', 200, 299, '2', 9000, 9099) ]
+        self.assertEqual(self.merged(rows), [1, 1])
+
+    def test_breaks (self) :
+        first = row('+', '1', 0, 99, '2', 5000, 5099)
+        for b in [ row('+', '3', 200, 299, '2', 5200, 5299),  # another A chromosome
+                   row('+', '1', 200, 299, '3', 5200, 5299),  # another B chromosome
+                   row('+', '1', 1200, 1299, '2', 5200, 5299), # too far in A
+                   row('+', '1', 200, 299, '2', 6200, 6299),  # too far in B
+                   row('+', '1', 200, 299, '2', 4000, 4099),  # backwards in B
+                   row('-', '1', 200, 2299, '2', 5200, 5299) ]: # opposite, and too big
+            self.assertEqual(self.merged([first, b]), [1, 1], b)
+
+    def test_absorbed (self) :
+        # a small block of the other orientation is absorbed, and the run continues past it
+        rows = [ row('+', '1', 0, 99, '2', 5000, 5099),
+                 row('-', '1', 200, 299, '2', 5200, 5299),
+                 row('+', '1', 400, 499, '2', 5400, 5499) ]
+        self.assertEqual(self.merged(rows), [3])
+        self.assertEqual(lod.coarsen(rows, 1000)[0][2], '+')
+
+    def test_pyramid (self) :
+        rows = [ row('+', '1', i * 5000, i * 5000 + 99, '2', i * 5000, i * 5000 + 99) for i in range(10) ]
+        self.assertEqual(self.merged(rows, 1000), [1] * 10)
+        self.assertEqual(self.merged(rows, 10000), [10])
+        # nMerged counts full resolution blocks
+        self.assertEqual(self.merged(lod.coarsen(rows[:4], 1000) + lod.coarsen(rows[4:], 1000), 10000), [10])
+
+#
+class LevelsTest (testutil.TempDirTestCase):
+
+    def test_levels (self) :
+        fa, fb, fab = testutil.writeGenomes(self.dir, 3000)
+        fname = self.path('A-B.tsv')
+        testutil.run('generate.py', ['-A', fa, '-B', fb], fname)
+        testutil.run('lod.py', [fname])
+        names, rows = testutil.readRows(fname)
+        prev = rows
+        for res in lod.LEVELS:
+            lnames, lrows = testutil.readRows(lod.levelName(fname, res))
+            self.assertEqual(lnames, names + ['nMerged'])
+            self.assertTrue(len(lrows) <= len(prev))
+            # every pair is in exactly one block, and the blocks are consecutive runs of the full resolution ones
+            self.assertEqual(sum([ int(r[1]) for r in lrows ]), sum([ int(r[1]) for r in rows ]))
+            self.assertEqual(sorted(','.join([ r[14] for r in lrows ]).split(',')),
+                             sorted(','.join([ r[14] for r in rows ]).split(',')))
+            i = 0
+            for r in lrows:
+                run = rows[i:i + int(r[15])]
+                i += int(r[15])
+                self.assertEqual((r[4], r[5], r[8]), (run[0][4], run[0][5], run[0][8]))
+                self.assertEqual(int(r[10]), max([ int(x[10]) for x in run ]))
+                self.assertEqual(int(r[9]), min([ int(x[9]) for x in run ]))
+                self.assertEqual(int(r[11]), max([ int(x[11]) for x in run ]))
+            self.assertEqual(i, len(rows))
+            prev = lrows
+        self.assertTrue(len(prev) < len(rows))
+
+#
+if __name__ == "__main__":
+    unittest.main()
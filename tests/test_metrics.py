@@ -0,0 +1,59 @@
+'''
+test_metrics.py
+
+generate.py's per-stage instrumentation (see SyntenyBlockGenerator.stage).
+'''
+import argparse
+import os
+import unittest
+
+import testutil
+import generate
+
+MB = 1024 * 1024
+
+def canResetPeak () :
+    return os.access('/proc/self/clear_refs', os.W_OK) and os.path.exists('/proc/self/status')
+
+#
+@unittest.skipUnless(canResetPeak(), 'the peak RSS cannot be reset here')
+class StagePeakRssTest (unittest.TestCase):
+
+    def generator (self) :
+        sbg = generate.SyntenyBlockGenerator()
+        sbg.args = argparse.Namespace(profileDir=None)
+        return sbg
+
+    def allocate (self, sbg, name, mb) :
+        with sbg.stage(name):
+            data = 'x' * (mb * MB)
+            del data
+        return sbg.stages[-1]['peakRssKb']
+
+    def test_sequentialPairs (self) :
+        # two pairs computed one after the other by the same process, as by a pool worker
+        big = self.allocate(self.generator(), 'generateBlocks', 200)
+        small = self.allocate(self.generator(), 'generateBlocks', 1)
+        # the earlier pair's peak is not reported again
+        self.assertTrue(big - small > 150 * 1024, (big, small))
+
+    def test_stagesOfOnePair (self) :
+        sbg = self.generator()
+        self.allocate(sbg, 'join', 200)
+        self.allocate(sbg, 'generateBlocks', 1)
+        join, blocks = [ s['peakRssKb'] for s in sbg.stages ]
+        self.assertTrue(join - blocks > 150 * 1024, (join, blocks))
+
+    def test_nested (self) :
+        # an inner stage's reset does not lose the enclosing stage's peak
+        sbg = self.generator()
+        with sbg.stage('outer'):
+            data = 'x' * (200 * MB)
+            del data
+            self.allocate(sbg, 'inner', 1)
+        inner, outer = [ s['peakRssKb'] for s in sbg.stages ]
+        self.assertTrue(outer - inner > 150 * 1024, (outer, inner))
+
+#
+if __name__ == "__main__":
+    unittest.main()
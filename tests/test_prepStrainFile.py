@@ -0,0 +1,102 @@
+'''
+test_prepStrainFile.py
+
+prepStrainFile.py: preparing Ensembl GFF3 files, line by line and in batch.
+'''
+import gzip
+import os
+import unittest
+
+import testutil
+import features
+import gff3
+import prepStrainFile
+
+HEADER = '##gff-version 3\n##sequence-region 1 1 195154279\n'
+
+LINES = [
+    '1\tensembl\tgene\t3000\t4000\t.\t-\t.\tID=gene:ENSMUSG01;Name=Xkr4;biotype=protein_coding;'
+        'description=X-linked Kx blood group related 4 [Source:MGI Symbol%3BAcc:MGI:3528744]\n',
+    '1\tensembl\tmRNA\t3000\t4000\t.\t-\t.\tID=transcript:ENSMUST01;Parent=gene:ENSMUSG01\n',
+    '1\tensembl\tncRNA_gene\t5000\t5100\t.\t+\t.\tdescription=predicted gene [Source:MGI Symbol%3BAcc:MGI:1];Name=Gm1\n',
+    'JH584295.1\tensembl\tgene\t10\t20\t.\t+\t.\tID=gene:ENSMUSG02;description=x [Source:MGI Symbol%3BAcc:MGI:2]\n',
+    '2\tensembl\tpseudogene\t100\t200\t.\t+\t.\tID=gene:ENSMUSG03;Name=NoMgi;description=novel gene\n',
+    '2\tensembl\tgene\t300\t400\t.\t+\t.\tID=gene:ENSMUSG04;Name=Dup;description=again [Source:MGI Symbol%3BAcc:MGI:1]\n',
+    '2\tensembl\tgene\t500\t600\t.\t+\t.\tID=gene:ENSMUSG05;Name=Last;description=[Source:MGI Symbol%3BAcc:MGI:5]',
+]
+
+EXPECTED = [
+    '1\tensembl\tgene\t3000\t4000\t.\t-\t.\tID=MGI:3528744;Name=Xkr4;biotype=protein_coding;'
+        'description=X-linked Kx blood group related 4 [Source:MGI Symbol%3BAcc:MGI:3528744]\n',
+    '1\tensembl\tncRNA_gene\t5000\t5100\t.\t+\t.\tID=MGI:1;description=predicted gene [Source:MGI Symbol%3BAcc:MGI:1];Name=Gm1\n',
+    '2\tensembl\tpseudogene\t100\t200\t.\t+\t.\tID=gene:ENSMUSG03;Name=NoMgi;description=novel gene\n',
+    '2\tensembl\tgene\t500\t600\t.\t+\t.\tID=MGI:5;Name=Last;description=[Source:MGI Symbol%3BAcc:MGI:5]\n',
+]
+
+#
+class PrepLinesTest (testutil.TempDirTestCase):
+
+    def test_findMgiId (self) :
+        self.assertEqual(prepStrainFile.findMgiId('ID=a;description=b [Source:MGI Symbol%3BAcc:MGI:12]'), 'MGI:12')
+        self.assertEqual(prepStrainFile.findMgiId('description=MGI:7;Name=x'), 'MGI:7')
+        # only the description attribute counts
+        self.assertEqual(prepStrainFile.findMgiId('Note=MGI:7;xdescription=MGI:8;description=none'), None)
+        self.assertEqual(prepStrainFile.findMgiId('ID=MGI:7'), None)
+
+    def test_spliceID (self) :
+        self.assertEqual(prepStrainFile.spliceID('ID=a;Name=b', 'MGI:1'), 'ID=MGI:1;Name=b')
+        self.assertEqual(prepStrainFile.spliceID('Name=b;ID=a;x=y', 'MGI:1'), 'Name=b;ID=MGI:1;x=y')
+        self.assertEqual(prepStrainFile.spliceID('Name=b;ID=a', 'MGI:1'), 'Name=b;ID=MGI:1')
+        self.assertEqual(prepStrainFile.spliceID('Name=b;xID=a', 'MGI:1'), 'ID=MGI:1;Name=b;xID=a')
+
+    def test_prepLines (self) :
+        fname = self.path('out.gff3')
+        ofd = open(fname, 'w')
+        dups = []
+        summary = prepStrainFile.prepLines(iter(HEADER.splitlines(True) + LINES), ofd, dups)
+        ofd.close()
+        self.assertEqual(testutil.readFile(fname), ''.join(EXPECTED))
+        self.assertEqual(dups, [('Dup', 'MGI:1', 'gene:ENSMUSG04', 8)])
+        self.assertEqual(summary, [['1', 5100, 2], ['2', 600, 2]])
+        # the same as parsing a line and setting its ID
+        for line, out, ID in [(LINES[0], EXPECTED[0], 'MGI:3528744'), (LINES[2], EXPECTED[1], 'MGI:1')]:
+            fin, fout = gff3.Feature(line), gff3.Feature(out)
+            self.assertEqual(fout.attributes.pop('ID'), ID)
+            fin.attributes.pop('ID', None)
+            self.assertEqual(fout.attributes, fin.attributes)
+            self.assertEqual(fout[0:8], fin[0:8])
+
+#
+class BatchTest (testutil.TempDirTestCase):
+
+    def test_batch (self) :
+        indir, outdir, chrsdir = self.path('in'), self.path('data'), self.path('output')
+        os.mkdir(indir)
+        fd = gzip.open(os.path.join(indir, 'Mus_caroli.CAROLI_EIJ_v1.1.99.gff3.gz'), 'wb')
+        fd.write(HEADER + ''.join(LINES))
+        fd.close()
+        fd = open(os.path.join(indir, 'c57bl6j.gff3'), 'w')
+        fd.write(HEADER + ''.join(LINES[:3]))
+        fd.close()
+        slist = self.path('strains.txt')
+        fd = open(slist, 'w')
+        fd.write('strain\nmus_caroli\nc57bl6j\nmissing\n')
+        fd.close()
+        testutil.run('prepStrainFile.py', ['--all', slist, '--indir', indir, '--outdir', outdir,
+            '--chrs-dir', chrsdir, '-j', '2'])
+        self.assertEqual(testutil.readFile(os.path.join(outdir, 'mus_caroli.gff3')), ''.join(EXPECTED))
+        self.assertEqual(testutil.readFile(os.path.join(outdir, 'c57bl6j.gff3')), ''.join(EXPECTED[:2]))
+        self.assertEqual(testutil.readFile(os.path.join(outdir, 'mus_caroli' + prepStrainFile.DUPS_EXT)),
+            'name\tmgiId\tid\tline\nDup\tMGI:1\tgene:ENSMUSG04\t8\n')
+        self.assertFalse(os.path.exists(os.path.join(outdir, 'missing.gff3')))
+        for s in ['mus_caroli', 'c57bl6j']:
+            self.assertEqual(testutil.readFile(os.path.join(chrsdir, s + '.chrs.tsv')),
+                features.formatChromosomeManifest(features.chromosomeSummary(
+                    features.load(os.path.join(outdir, s + '.gff3'), cache=False))))
+        # single file mode writes the same
+        out = testutil.run('prepStrainFile.py', [os.path.join(indir, 'Mus_caroli.CAROLI_EIJ_v1.1.99.gff3.gz')])
+        self.assertEqual(out, ''.join(EXPECTED))
+
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+'''
+test_region.py
+
+Checks that generate.py --region writes exactly the blocks of the full run whose A extent
+overlaps the region (same IDs, indexes, and ids).
+
+Usage:
+    python tests/test_region.py
+'''
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+sys.path.insert(0, BIN)
+
+import benchmark
+
+#
+def syntheticArgs (**kw) :
+    """
+    Returns the rates for benchmark.SyntheticGenomes. Translocations make B genes of one
+    region join to A genes elsewhere, which is what a region run must not lose track of.
+    """
+    args = argparse.Namespace(seed='region', chromosomes=4, inversions=0.01, translocations=0.02,
+        missing=0.02, nonOneToOne=0.0, overlaps=0.0, nonMgi=0.0)
+    for k, v in kw.items():
+        setattr(args, k, v)
+    return args
+
+def readRows (fname) :
+    """
+    Reads a TSV block file. Returns (header, rows), each row a list of strings.
+    """
+    fd = open(fname, 'r')
+    lines = fd.read().split('\n')[:-1]
+    fd.close()
+    return lines[0], [ l.split('\t') for l in lines[1:] ]
+
+class RegionTest (unittest.TestCase):
+
+    @classmethod
+    def setUpClass (cls) :
+        cls.dir = tempfile.mkdtemp()
+        cls.fa, cls.fb, cls.fab = benchmark.SyntheticGenomes(syntheticArgs(), 3000).write(cls.dir)
+
+    @classmethod
+    def tearDownClass (cls) :
+        shutil.rmtree(cls.dir)
+
+    def generate (self, *args) :
+        """
+        Runs generate.py on the synthetic genomes with the given extra args. Returns (header, rows).
+        """
+        fname = os.path.join(self.dir, 'out.tsv')
+        ofd = open(fname, 'w')
+        subprocess.check_call([sys.executable, os.path.join(BIN, 'generate.py'),
+            '-A', self.fa, '-B', self.fb] + list(args), stdout=ofd)
+        ofd.close()
+        return readRows(fname)
+
+    def checkRegion (self, chr, start=None, end=None, *args) :
+        hdr, full = self.generate(*args)
+        names = hdr.split('\t')
+        aChr, aStart, aEnd = [ names.index(n) for n in ['aChr', 'aStart', 'aEnd'] ]
+        expected = [ r for r in full if r[aChr] == chr
+            and (start is None or int(r[aEnd]) >= start) and (end is None or int(r[aStart]) <= end) ]
+        region = chr if start is None else '%s:%d-%d' % (chr, start, end)
+        rhdr, rows = self.generate('--region', region, *args)
+        self.assertEqual(rhdr, hdr)
+        self.assertTrue(expected)
+        self.assertEqual(rows, expected)
+
+    def test_chromosome (self) :
+        for chr in ['1', '2', '4']:
+            self.checkRegion(chr)
+
+    def test_range (self) :
+        hdr, full = self.generate()
+        names = hdr.split('\t')
+        aChr, aEnd = names.index('aChr'), names.index('aEnd')
+        # the middle third of chromosome 2's blocks
+        ends = sorted([ int(r[aEnd]) for r in full if r[aChr] == '2' ])
+        self.checkRegion('2', ends[len(ends) // 3], ends[2 * len(ends) // 3])
+
+    def test_chained (self) :
+        self.checkRegion('3', None, None, '--chain-gap', '2')
+
+    def test_parallel (self) :
+        self.checkRegion('3', None, None, '-j', '2')
+
+    def test_indels (self) :
+        # deletion blocks in the region are written; insertion blocks have no A extent
+        hdr, full = self.generate('--indels')
+        names = hdr.split('\t')
+        aChr, bChr = names.index('aChr'), names.index('bChr')
+        self.assertTrue([ r for r in full if r[aChr] == '2' and not r[bChr] ])
+        self.checkRegion('2', None, None, '--indels')
+
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+'''
+test_summary.py
+
+summary.py: per-pair statistics of block files, and the summary files batch mode writes,
+which must agree with summarizing the block files afresh.
+'''
+import json
+import os
+import unittest
+
+import testutil
+import summary
+
+def row (ori, ratio, aChr, bChr, aLen, count=1) :
+    """
+    Returns a TSV block row (with made up id, B length, positions, and ids).
+    """
+    return ['0', str(count), ori, ratio, aChr, bChr, str(aLen), '100', '1', '1', str(aLen), '100', '0', '0', '']
+
+#
+class AddTest (unittest.TestCase):
+
+    def test_add (self) :
+        s = summary.newSummary()
+        for r in [ row('+', '1.00', '1', '1', 100, 3),
+                   row('-', '1.00', '1', '1', 200),   # inversion
+                   row('+', '1.00', '1', '2', 300),   # translocation
+                   row('+', '0.90', '1', '1', 400),   # inflated (1/0.9 >= 1.1)
+                   row('+', '0.95', '1', '1', 500),   # not quite
+                   row('+', '0.00', '1', '1', 600),   # infinitely inflated
+                   row('+', '1.00', '1', '', 700) ]:  # indel, counted apart
+            summary.add(s, r)
+        self.assertEqual(s, { 'blocks' : 6, 'genes' : 8, 'inversions' : 1, 'translocations' : 1,
+            'inflated' : 2, 'inflatedBp' : 1000, 'aBp' : 2100, 'indels' : 1 })
+
+#
+class BatchSummaryTest (testutil.TempDirTestCase):
+
+    def test_batch (self) :
+        datadir, slist = testutil.writeStrains(self.dir, 1000)
+        outdir = self.path('output')
+        testutil.run('generate.py', ['--all', slist, '--datadir', datadir, '--outdir', outdir, '-j', '1'])
+        strains = ['a', 'b', 'c']
+        tsv = summary.readTsv(os.path.join(outdir, summary.SUMMARY_TSV))
+        self.assertEqual(sorted(tsv.keys()), sorted([ '%s-%s' % (a, b) for a in strains for b in strains ]))
+        # what generate.py accumulated is what the block files hold
+        for name, s in tsv.items():
+            self.assertEqual(s, summary.summarizeFile(os.path.join(outdir, name + '.tsv')), name)
+        self.assertTrue(tsv['a-b']['inversions'] > 0 and tsv['a-b']['translocations'] > 0)
+        fd = open(os.path.join(outdir, summary.SUMMARY_JSON), 'r')
+        js = json.load(fd)
+        fd.close()
+        self.assertEqual((js['version'], js['strains'], js['stats']), (summary.VERSION, strains, summary.STATS))
+        for stat in summary.STATS:
+            self.assertEqual(js['matrix'][stat],
+                [ [ tsv['%s-%s' % (a, b)][stat] for b in strains ] for a in strains ], stat)
+        # summary.py writes the same files from the block files alone
+        files = [ testutil.readFile(os.path.join(outdir, f)) for f in [summary.SUMMARY_TSV, summary.SUMMARY_JSON] ]
+        for f in [summary.SUMMARY_TSV, summary.SUMMARY_JSON]:
+            os.remove(os.path.join(outdir, f))
+        testutil.run('summary.py', [outdir])
+        self.assertEqual([ testutil.readFile(os.path.join(outdir, f)) for f in [summary.SUMMARY_TSV, summary.SUMMARY_JSON] ], files)
+
+    def test_otherStats (self) :
+        # a summary.tsv with other statistics is ignored
+        fname = self.path(summary.SUMMARY_TSV)
+        fd = open(fname, 'w')
+        fd.write('A\tB\tblocks\na\tb\t3\n')
+        fd.close()
+        self.assertEqual(summary.readTsv(fname), {})
+        self.assertEqual(summary.readTsv(self.path('missing.tsv')), {})
+
+#
+if __name__ == "__main__":
+    unittest.main()
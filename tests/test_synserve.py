@@ -0,0 +1,118 @@
+'''
+test_synserve.py
+
+synserve.py: the service serves the blocks a batch run writes, and rejects the generator
+options it cannot honor.
+'''
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import unittest
+
+import testutil
+import generate
+import synserve
+
+#
+class CacheTest (unittest.TestCase):
+
+    def test_lru (self) :
+        c = synserve.Cache(10)
+        for k in 'abc':
+            self.assertEqual(c.get(k, lambda: k * 4), k * 4)
+        # a and b do not both fit with c; a (least recently used) goes
+        self.assertEqual(sorted(c.entries.keys()), ['b', 'c'])
+        c.get('b', None)
+        c.get('d', lambda: 'dddd')
+        self.assertEqual(sorted(c.entries.keys()), ['b', 'd'])
+        # too big to cache at all
+        c.get('e', lambda: 'e' * 11)
+        self.assertEqual(sorted(c.entries.keys()), ['b', 'd'])
+        s = c.getStats()
+        self.assertEqual((s['hits'], s['misses'], s['evictions'], s['bytes']), (1, 5, 2, 8))
+
+    def test_shared (self) :
+        # concurrent gets of a missing key share one computation
+        c = synserve.Cache()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+        def compute () :
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'value'
+        results = []
+        first = threading.Thread(target=lambda: results.append(c.get('k', compute)))
+        first.start()
+        started.wait()
+        others = [ threading.Thread(target=lambda: results.append(c.get('k', compute))) for i in range(3) ]
+        for t in others:
+            t.start()
+        while c.getStats()['coalesced'] < 3:
+            pass
+        release.set()
+        for t in [first] + others:
+            t.join()
+        self.assertEqual(results, ['value'] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_error (self) :
+        c = synserve.Cache()
+        def fail () :
+            raise ValueError('no')
+        self.assertRaises(ValueError, c.get, 'k', fail)
+        self.assertEqual(c.get('k', lambda: 'v'), 'v')
+
+#
+class ServiceTest (testutil.TempDirTestCase):
+
+    def service (self, *genArgv) :
+        args = argparse.Namespace(datadir=self.datadir, strains=None, cacheMb=16)
+        sbg = generate.SyntenyBlockGenerator()
+        sbg.parseArgs(['-A', '-', '-B', '-'] + list(genArgv))
+        return synserve.SyntenyService(args, sbg.args)
+
+    def test_sameAsBatch (self) :
+        self.datadir, slist = testutil.writeStrains(self.dir, 1000)
+        outdir = self.path('output')
+        testutil.run('generate.py', ['--all', slist, '--datadir', self.datadir, '--outdir', outdir,
+            '-j', '1', '--lod', '--chain-gap', '2'])
+        svc = self.service('--chain-gap', '2')
+        self.assertEqual(svc.strains, ['a', 'b', 'c'])
+        for a in svc.strains:
+            self.assertEqual(svc.chromosomes(a), testutil.readFile(os.path.join(outdir, a + '.chrs.tsv')))
+            for b in svc.strains:
+                name = '%s-%s' % (a, b)
+                self.assertEqual(svc.splitPair(name), (a, b))
+                self.assertEqual(svc.blocks(a, b), testutil.readFile(os.path.join(outdir, name + '.tsv')))
+                for res in [100000, 10000]:
+                    self.assertEqual(svc.blocks(a, b, res),
+                        testutil.readFile(os.path.join(outdir, '%s.lod%d.tsv' % (name, res))))
+
+    def serve (self, *genArgv) :
+        """
+        Starts synserve.py with the given generator options. Returns its exit status and standard
+        error; a service that starts (rather than rejecting the options) is killed after a while.
+        """
+        p = subprocess.Popen([sys.executable, os.path.join(testutil.BIN, 'synserve.py'),
+            '--datadir', self.dir, '--port', '0', '--'] + list(genArgv), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        timer = threading.Timer(30, p.kill)
+        timer.start()
+        out, err = p.communicate()
+        timer.cancel()
+        return p.returncode, err
+
+    def test_unsupported (self) :
+        for opts in [ ['--stream'], ['--region', '1'], ['--metrics', 'm.json'], ['--mirror', 'BA.tsv'],
+                      ['--indels'], ['--ids', 'ranges', '--ids-prefix', 'x'] ]:
+            status, err = self.serve(*opts)
+            self.assertEqual(status, 2, opts)
+            self.assertTrue('not supported by the service' in err, (opts, err))
+        # --verify-mirror is rejected by the generator itself (there is no real pair)
+        self.assertEqual(self.serve('--verify-mirror')[0], 2)
+
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+'''
+testutil.py
+
+Shared helpers for the tests: synthetic genomes (from benchmark.py), running the scripts
+in bin/, and reading their outputs.
+
+Run all the tests with:
+    python -m unittest discover tests
+'''
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+sys.path.insert(0, BIN)
+
+import benchmark
+
+#
+def syntheticArgs (**kw) :
+    """
+    Returns the rates for benchmark.SyntheticGenomes: a few of every kind of rearrangement
+    and irregularity, overridden by kw.
+    """
+    args = argparse.Namespace(seed='test', chromosomes=4, inversions=0.01, translocations=0.01,
+        missing=0.02, nonOneToOne=0.01, overlaps=0.01, nonMgi=0.01)
+    for k, v in kw.items():
+        setattr(args, k, v)
+    return args
+
+def writeGenomes (dirname, n=2000, **kw) :
+    """
+    Writes a synthetic pair of genomes with n genes to dirname (see benchmark.SyntheticGenomes.write).
+    Returns the paths of A.gff3, B.gff3, and AB.tsv.
+    """
+    return benchmark.SyntheticGenomes(syntheticArgs(**kw), n).write(dirname)
+
+def writeStrains (dirname, n=1000) :
+    """
+    Writes three synthetic strains for batch mode: dirname/data/a.gff3, b.gff3 (a rearranged),
+    and c.gff3 (another rearrangement), and the strain list, dirname/strains.txt.
+    Returns the paths of the data directory and the strain list.
+    """
+    datadir = os.path.join(dirname, 'data')
+    os.makedirs(datadir)
+    for names, seed in [ (['a', 'b'], 'test'), ([None, 'c'], 'test2') ]:
+        paths = writeGenomes(dirname, n, seed=seed)
+        for name, path in zip(names, paths):
+            if name:
+                os.rename(path, os.path.join(datadir, name + '.gff3'))
+    slist = os.path.join(dirname, 'strains.txt')
+    fd = open(slist, 'w')
+    fd.write('a\nb\nc\n')
+    fd.close()
+    return datadir, slist
+
+def writeExport (gffname, fname) :
+    """
+    Writes the genes of the named GFF3 file as a MouseMine gene export (the input of cvt.py):
+    ID, symbol, chromosome, start, end, and strand (+1 or -1). Features with no ID are left out.
+    """
+    import gff3
+    fd = open(fname, 'w')
+    fd.write('# MouseMine genes\n')
+    for f in gff3.iterate(gffname):
+        if getattr(f, 'ID', None):
+            fd.write('\t'.join([f.ID, getattr(f, 'Name', f.ID), f.seqid, str(f.start), str(f.end),
+                { '+' : '+1', '-' : '-1' }.get(f.strand, '')]) + '\n')
+    fd.close()
+
+def convert (export, gffname) :
+    """
+    Converts a MouseMine gene export to GFF3 with cvt.py.
+    """
+    ifd, ofd = open(export, 'r'), open(gffname, 'w')
+    try:
+        # (cvt.py does not skip comments)
+        lines = [ l for l in ifd if not l.startswith('#') ]
+        p = subprocess.Popen([sys.executable, os.path.join(BIN, 'cvt.py')], stdin=subprocess.PIPE, stdout=ofd)
+        p.communicate(''.join(lines))
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, 'cvt.py')
+    finally:
+        ifd.close()
+        ofd.close()
+
+def run (script, args, stdout=None) :
+    """
+    Runs the named script in bin/ with the given args, in a fresh interpreter. Its standard
+    output is written to the file named stdout, if given. Returns the output otherwise.
+    Raises subprocess.CalledProcessError if the script fails.
+    """
+    argv = [sys.executable, os.path.join(BIN, script)] + list(args)
+    if stdout is None:
+        return subprocess.check_output(argv)
+    fd = open(stdout, 'w')
+    try:
+        subprocess.check_call(argv, stdout=fd)
+    finally:
+        fd.close()
+
+def readFile (fname) :
+    fd = open(fname, 'rb')
+    text = fd.read()
+    fd.close()
+    return text
+
+def readRows (fname) :
+    """
+    Reads a TSV file with a header line. Returns (column names, rows), each row a list of strings.
+    """
+    lines = readFile(fname).split('\n')[:-1]
+    return lines[0].split('\t'), [ l.split('\t') for l in lines[1:] ]
+
+#
+class TempDirTestCase (unittest.TestCase):
+    """
+    A test case with a fresh temporary directory, self.dir, for each test.
+    """
+    def setUp (self) :
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown (self) :
+        shutil.rmtree(self.dir)
+
+    def path (self, *names) :
+        return os.path.join(self.dir, *names)
@@ -25,6 +25,11 @@ var aSelected = []; // currently selected A chrs
 var bSelected = []; // currently selected B chrs
 
 var allBlocks = []; // the synteny blocks
+var loadIds = () => Promise.resolve(); // returns a promise that the blocks' ids are loaded (see makeIdsLoader)
+
+// Resolutions (bp) of the coarsened block files (see bin/lod.py), coarsest first.
+var lodLevels = [1000000, 100000, 10000];
+var lodLevel = 0; // resolution of the blocks shown (0 == full resolution)
 
 var minRectHeight = 2; // Min size in px for drawing a block. 0 for no minimum
 var magnification = 1.0;
@@ -34,7 +39,7 @@ var inflationThreshold = 1.1; // only show blocks whose inflation is >= this val
 var facets = []; // empty to show all
 var facetFuncs = {
     "inversions" : function (blk) { return blk.ori === "-" },
-    "translocations" : function (blk) { return blk.aChr !== blk.bChr },
+    "translocations" : function (blk) { return blk.aChr !== blk.bChr && blk.aChr !== null && blk.bChr !== null },
     "deletions" : function (blk) { return blk.aChr === null || blk.bChr === null; },
     "inflation" : function (blk) { return blk.inflation >= inflationThreshold },
     "maxBlockSize" : function (blk) { return blk.bLength <= maxBlockSize }
@@ -173,19 +178,173 @@ function d3tsv(url) {
     }); 
 }
 
+//
+// Fetches a binary block file (see bin/blockfile.py).
+// Returns a promise that resolves to { header, columns }, where columns maps each column
+// name to a typed array over the file's data, or rejects if the file cannot be read.
+var blkArrayTypes = { b : Int8Array, B : Uint8Array, H : Uint16Array, I : Uint32Array };
+function fetchBlockFile(url) {
+    return fetch(url).then(function (r) {
+        if (!r.ok) throw { status: r.status, statusText: r.statusText };
+        return r.arrayBuffer();
+    }).then(function (buf) {
+        let magic = String.fromCharCode.apply(null, new Uint8Array(buf, 0, 8));
+        if (magic !== "SBGBLK01") throw { status: 0, statusText: `${url} is not a block file.` };
+        let hlen = new DataView(buf).getUint32(8, true);
+        let header = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 12, hlen)));
+        let columns = {};
+        for (let name in header.columns) {
+            let [tc, start, end] = header.columns[name];
+            let T = blkArrayTypes[tc];
+            columns[name] = new T(buf, start, (end - start) / T.BYTES_PER_ELEMENT);
+        }
+        return { header, columns };
+    });
+}
+
+//
+// Returns the resolution of the coarsest block level whose resolution is finer than a pixel,
+// given the length of the longest chromosome and the magnification. Returns 0 (full resolution)
+// if there is none.
+function lodLevelFor(maxLen, mag) {
+    let bpPerPixel = maxLen / (height * mag);
+    return lodLevels.find(r => r <= bpPerPixel) || 0;
+}
+
+//
+// Loads the synteny blocks between genomes a and b, at the given resolution (0 for full resolution).
+// Reads the binary block file if there is one, otherwise the TSV. If the level is not
+// there, loads the full resolution blocks. Returns a promise that resolves to { blocks, idsUrl, rangesBase, level },
+// where idsUrl is the url of the blocks' ID table if their ids have yet to be loaded, or null, and
+// rangesBase is the base name of the per-genome ID files if some blocks' ids are given by their index ranges
+// (generate.py --ids ranges; see bin/blockfile.py), or null.
+function loadBlocks(a, b, level) {
+    let base = `./output/${a}-${b}` + (level ? `.lod${level}` : "");
+    let blocks = fetchBlockFile(base + ".blk").then(function (blk) {
+        let h = blk.header;
+        let c = blk.columns;
+        let bks = [];
+        for (let i = 0; i < h.n; i++) {
+            bks.push({
+                name   : `${level}:${c.blockId[i]}`,
+                record : i,
+                ori    : c.blockOri[i] === 1 ? "+" : "-",
+                aChr   : h.aChrs[c.aChr[i]] || null,
+                aStart : c.aStart[i],
+                aEnd   : c.aEnd[i],
+                aLength: c.aEnd[i] - c.aStart[i] + 1,
+                bChr   : h.bChrs[c.bChr[i]] || null,
+                bStart : c.bStart[i],
+                bEnd   : c.bEnd[i],
+                bLength: c.bEnd[i] - c.bStart[i] + 1,
+                nIds   : c.nIds[i],
+                nMerged: c.nMerged ? c.nMerged[i] : 1,
+                ids    : null,
+                inflation : 1 / (c.blockRatio100[i] / 100),
+                map    : d3.scale.linear().clamp(true)
+            });
+        }
+        return { blocks: bks, idsUrl: base + ".ids", rangesBase: null, level: level };
+    }, function () {
+        return d3tsv(base + ".tsv").then(function (abBlks) {
+            let bks = [];
+            let ranged = false;
+            abBlks.forEach(function(k){
+              // a synteny block with empty ids has them in the per-genome ID files
+              let range = k.ids === "" && k.aChr && k.bChr;
+              let ids = range ? null : k.ids.split(',');
+              ranged = ranged || range;
+              bks.push({
+                name   : `${level}:${k.blockId}`,
+                ori    : k.blockOri,
+                aChr   : k.aChr || null, // indel blocks (generate.py --indels) have an empty chr on one side
+                aStart : k.aStart,
+                aEnd   : k.aEnd,
+                aLength: k.aLength,
+                bChr   : k.bChr || null,
+                bStart : k.bStart,
+                bEnd   : k.bEnd,
+                bLength: k.bLength,
+                nIds   : ids ? ids.length : +k.blockCount,
+                nMerged: k.nMerged ? +k.nMerged : 1,
+                ids    : ids,
+                range  : range ? { ori: k.blockOri, a: +k.aIndex, b: +k.bIndex, n: +k.blockCount } : null,
+                inflation : 1 / k.blockRatio,
+                map    : d3.scale.linear().clamp(true)
+              });
+            });
+            return { blocks: bks, idsUrl: null, rangesBase: ranged ? base : null, level: level };
+        });
+    });
+    return level ? blocks.catch(() => loadBlocks(a, b, 0)) : blocks;
+}
+
+//
+// Shows the blocks at the level for the current magnification, loading them if necessary.
+function setLodLevel() {
+    if (!yscale) return;
+    let level = lodLevelFor(yscale.domain()[1], magnification);
+    if (level === lodLevel) return;
+    lodLevel = level;
+    loadBlocks(aName, bName, level).then(function (r) {
+        if (level !== lodLevel) return; // superseded
+        allBlocks = r.blocks;
+        loadIds = makeIdsLoader(allBlocks, r.idsUrl, r.rangesBase);
+        redraw();
+    });
+}
+
+//
+// Returns a function that loads the ids of the given blocks (from their ID table, one line per
+// block record, or from the per-genome ID files, for blocks with a range) the first time it is called,
+// and returns a promise that they are loaded.
+function makeIdsLoader(blocks, idsUrl, rangesBase) {
+    let p = (idsUrl || rangesBase) ? null : Promise.resolve();
+    let fetchLines = url => fetch(url).then(r => r.text()).then(txt => txt.split('\n'));
+    return function () {
+        if (!p && idsUrl) {
+            p = fetchLines(idsUrl).then(function (lines) {
+                blocks.forEach(b => b.ids = lines[b.record] ? lines[b.record].split(',') : []);
+                svg.selectAll('a.sblock title').text(blockTitle);
+            });
+        }
+        else if (!p) {
+            p = Promise.all([
+                fetchLines(rangesBase + ".a.ids"),
+                fetchLines(rangesBase + ".b.ids")
+            ]).then(function (data) {
+                blocks.filter(b => b.range).forEach(b => b.ids = rangeIds(b.range, data[0], data[1]));
+                svg.selectAll('a.sblock title').text(blockTitle);
+            });
+        }
+        return p;
+    };
+}
+
+//
+// Returns the ids of a block from its index ranges and the IDs of each genome's paired features,
+// in index order: for each pair, in A order, its A ID, then its B ID (each id once).
+function rangeIds(range, aIds, bIds) {
+    let ids = new Set();
+    for (let k = 0; k < range.n; k++) {
+        let bk = range.ori === "+" ? range.b + k : range.b + range.n - 1 - k;
+        ids.add(aIds[range.a + k]).add(bIds[bk]);
+    }
+    return Array.from(ids);
+}
+
 function go () {
     aName = d3.select("#aGenome")[0][0].value;
     bName = d3.select("#bGenome")[0][0].value;
     console.log("GO!", aName, bName);
-    let makefn = (a,b) => `./output/${a}-${b}.tsv`;
+    // chromosome manifest (chr, length, count) for one genome
+    let chrsfn = a => `./output/${a}.chrs.tsv`;
     Promise.all([
-        d3tsv(makefn(aName,aName)),
-        d3tsv(makefn(bName,bName)),
-        d3tsv(makefn(aName,bName))
+        d3tsv(chrsfn(aName)),
+        d3tsv(chrsfn(bName))
     ]).then(function(data) {
-        let aChrs = data[0].map(c => [ c.aChr, c.aLength, aName ]);
-        let bChrs = data[1].map(c => [ c.bChr, c.bLength, bName ]);
-        let abBlks = data[2];
+        let aChrs = data[0].map(c => [ c.chr, c.length, aName ]);
+        let bChrs = data[1].map(c => [ c.chr, c.length, bName ]);
         let allChrs = aChrs.concat(bChrs).sort((a,b) => {
             let ca = a[0];
             let cb = b[0];
@@ -197,30 +356,18 @@ function go () {
                 return can - cbn;
         });
 
-        let bks = [];
-        abBlks.forEach(function(k){
-          bks.push({
-            name   : ""+k.blockId,
-            ori    : k.blockOri,
-            aChr   : k.aChr,
-            aStart : k.aStart,
-            aEnd   : k.aEnd,
-            aLength: k.aLength,
-            bChr   : k.bChr,
-            bStart : k.bStart,
-            bEnd   : k.bEnd,
-            bLength: k.bLength,
-            ids    : k.ids.split(','),
-            inflation : 1 / k.blockRatio,
-            map    : d3.scale.linear().clamp(true)
-          });
+        // pick the block level for the current magnification (contigs are not drawn; see processChrs)
+        let maxLen = d3.max(allChrs.filter(c => c[0].length <= 2), c => +c[1]);
+        lodLevel = lodLevelFor(maxLen, magnification);
+        return loadBlocks(aName, bName, lodLevel).then(function (r) {
+            allBlocks = r.blocks;
+            loadIds = makeIdsLoader(allBlocks, r.idsUrl, r.rangesBase);
+            aSelected = [];
+            bSelected = [];
+            species = [];
+            sp2chrs = {}
+            processChrs( allChrs );
         });
-        allBlocks = bks;
-        aSelected = [];
-        bSelected = [];
-        species = [];
-        sp2chrs = {}
-        processChrs( allChrs );
     });
 }
 
@@ -307,6 +454,7 @@ function zoom() {
   magnification = d3.event.scale;
   setZoomLabel();
   drawBlocks();
+  setLodLevel();
 }
 
 function resetView(){
@@ -315,6 +463,7 @@ function resetView(){
   magnification = 1;
   setZoomLabel(1);
   drawBlocks();
+  setLodLevel();
 }
 
 function setTitle(bspecies, cspecies) {
@@ -338,17 +487,28 @@ function setTitle(bspecies, cspecies) {
 function blockClicked () {
     let alt = d3.event.altKey;
     let b = d3.select(this);
-    let ids = b.data()[0].ids;
-    //
-    let formName = alt ? 'mmLinkForm' : 'mgiLinkForm';
-    let inpName  = alt ? 'externalids' : 'ids';
-    let joinChar = alt ? ',' : ' ';
-    let form = d3.select(`form[name="${formName}"]`);
-    let input = form.select(`input[name="${inpName}"]`);
-    input[0][0].value = ids.join(joinChar);
-    //
-    form[0][0].enctype = alt ? '' : 'multipart/form-data';
-    form[0][0].submit()
+    loadIds().then(function () {
+        let ids = b.data()[0].ids;
+        //
+        let formName = alt ? 'mmLinkForm' : 'mgiLinkForm';
+        let inpName  = alt ? 'externalids' : 'ids';
+        let joinChar = alt ? ',' : ' ';
+        let form = d3.select(`form[name="${formName}"]`);
+        let input = form.select(`input[name="${inpName}"]`);
+        input[0][0].value = ids.join(joinChar);
+        //
+        form[0][0].enctype = alt ? '' : 'multipart/form-data';
+        form[0][0].submit()
+    });
+}
+
+// Tooltip text for a block. The ids are shown once they are loaded.
+function blockTitle(d) {
+    return (d.aChr === null ? 'A=none' : `A=${fmtLoc(d.aChr,d.aStart,d.aEnd)}(${formatLength(d.aLength)})`)
+       +   (d.bChr === null ? ' B=none' : ` B=${fmtLoc(d.bChr,d.bStart,d.bEnd)}(${formatLength(d.bLength)})`)
+       +   `\n${d.nIds} gene${d.nIds > 1 ? 's':''}`
+       +   (d.nMerged > 1 ? ` (${d.nMerged} blocks merged)` : "")
+       +   (d.ids ? `\n${d.ids.slice(0,5).join(' ')}` + (d.ids.length > 5 ? "..." : "") : "");
 }
 
 function redraw () {
@@ -419,7 +579,8 @@ function drawChrs(spd, spd2, colors){
     // Block data
     s  = ["a","b"][spIndex];
     s2 = ["a","b"][cIndex];
-    let blocksToDraw = allBlocks;
+    // an indel block is drawn only in the genome that has it
+    let blocksToDraw = allBlocks.filter(b => b[s+'Chr'] !== null);
     if(facets.length > 0){
         blocksToDraw = blocksToDraw.filter(function(b) {
             let vals = facets.map( f => facetFuncs[f](b) );
@@ -439,6 +600,7 @@ function drawChrs(spd, spd2, colors){
          .append('rect')
 	 .attr('class', 'sblock')
          .on("click", blockClicked)
+         .on("mouseover", () => loadIds())
            .append('title')    
 	   ;
 
@@ -446,13 +608,7 @@ function drawChrs(spd, spd2, colors){
     blks.exit().remove();
 
     // Block tooltips
-    blks.select('title').text(function(d,i){
-         return `A=${fmtLoc(d.aChr,d.aStart,d.aEnd)}(${formatLength(d.aLength)})`
-            +   ` B=${fmtLoc(d.bChr,d.bStart,d.bEnd)}(${formatLength(d.bLength)})`
-            +   `\n${d.ids.length} gene${d.ids.length > 1 ? 's':''}`
-            +   `\n${d.ids.slice(0,5).join(' ')}`
-            +   (d.ids.length > 5 ? "..." : "");
-     })
+    blks.select('title').text(blockTitle)
 
     // Transition effects
     blks.select('rect')